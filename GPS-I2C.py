@@ -9,6 +9,8 @@ I2C 接続の Qwiic Titan GPS を使って NMEA / GNSS 情報を表示するス
 
 import time
 import sys
+import i2c_health
+from scheduler import Scheduler
 
 try:
     import qwiic_titan_gps
@@ -37,6 +39,8 @@ def try_get_last_nmea(gps):
     # まず get_nmea_data() を呼ぶ（内部で NMEA を取得してくれる場合あり）
     try:
         _ = gps.get_nmea_data()
+    except OSError:
+        raise  # I2C のエラーは呼び出し側の BusSupervisor に数えさせる
     except Exception:
         pass
 
@@ -94,47 +98,58 @@ def main():
 
     print("I2C GPS 接続 OK。データ受信開始。Ctrl-C で停止。")
     last_print = time.monotonic()
-    try:
-        while True:
-            # まず生NMEAを試す
-            nmea = try_get_last_nmea(gps)
-
-            if nmea:
-                # 取得できた生NMEAを逐次パースして、GGA/RMC を検出する（pynmea2 があるなら使う）
-                if HAVE_PYNMEA2:
-                    # NMEA 文は複数来る場合があるので $ で分割してパース（最後の完全文のみ取り出す）
-                    lines = [s for s in (nmea.split('\n') if '\n' in nmea else [nmea]) if s.strip()]
-                    for line in lines:
-                        try:
-                            msg = pynmea2.parse(line)
-                        except pynmea2.ParseError:
-                            continue
-                        if isinstance(msg, pynmea2.types.talker.GGA) or msg.sentence_type == "GGA":
-                            lat = getattr(msg, "latitude", None)
-                            lon = getattr(msg, "longitude", None)
-                            fix = getattr(msg, "gps_qual", None)
-                            sat = getattr(msg, "num_sats", None)
-                            print(f"GGA - 緯度:{lat} 経度:{lon} 測位品質:{fix} 衛星数:{sat}")
-                        elif isinstance(msg, pynmea2.types.talker.RMC) or msg.sentence_type == "RMC":
-                            speed = getattr(msg, "spd_over_grnd", None)
-                            true_course = getattr(msg, "true_course", None)
-                            print(f"RMC - 速度:{speed}ノット, 真方位:{true_course}度")
-                else:
-                    # pynmea2 がない場合は生NMEA文字列をそのまま出力
-                    print("生NMEA:", nmea)
+    # 読み取りエラーが続いたら begin() で再接続する
+    supervisor = i2c_health.BusSupervisor()
+    supervisor.register("gps", reinit=gps.begin)
 
+    def poll():
+        # まず生NMEAを試す
+        try:
+            nmea = supervisor.call("gps", try_get_last_nmea, gps)
+        except i2c_health.DeviceBackoff:
+            return
+        except OSError as e:
+            print("I2C読み取りエラー:", e)
+            return
+
+        if nmea:
+            # 取得できた生NMEAを逐次パースして、GGA/RMC を検出する（pynmea2 があるなら使う）
+            if HAVE_PYNMEA2:
+                # NMEA 文は複数来る場合があるので $ で分割してパース（最後の完全文のみ取り出す）
+                lines = [s for s in (nmea.split('\n') if '\n' in nmea else [nmea]) if s.strip()]
+                for line in lines:
+                    try:
+                        msg = pynmea2.parse(line)
+                    except pynmea2.ParseError:
+                        continue
+                    if isinstance(msg, pynmea2.types.talker.GGA) or msg.sentence_type == "GGA":
+                        lat = getattr(msg, "latitude", None)
+                        lon = getattr(msg, "longitude", None)
+                        fix = getattr(msg, "gps_qual", None)
+                        sat = getattr(msg, "num_sats", None)
+                        print(f"GGA - 緯度:{lat} 経度:{lon} 測位品質:{fix} 衛星数:{sat}")
+                    elif isinstance(msg, pynmea2.types.talker.RMC) or msg.sentence_type == "RMC":
+                        speed = getattr(msg, "spd_over_grnd", None)
+                        true_course = getattr(msg, "true_course", None)
+                        print(f"RMC - 速度:{speed}ノット, 真方位:{true_course}度")
             else:
-                # 生NMEAが取れなければ gnss_messages を参照して代替出力
-                # get_nmea_data() をもう一度投げてみる（ライブラリ依存で内部バッファが更新される場合あり）
-                try:
-                    gps.get_nmea_data()
-                except Exception:
-                    pass
-                print_from_gnss_messages(gps)
-
-            # 1秒に1回くらい行いたければ以下の制御（元スクリプトは毎ループで標準出力）
-            time.sleep(POLL_INTERVAL)
-
+                # pynmea2 がない場合は生NMEA文字列をそのまま出力
+                print("生NMEA:", nmea)
+
+        else:
+            # 生NMEAが取れなければ gnss_messages を参照して代替出力
+            # get_nmea_data() をもう一度投げてみる（ライブラリ依存で内部バッファが更新される場合あり）
+            try:
+                supervisor.call("gps", gps.get_nmea_data)
+            except Exception:
+                pass
+            print_from_gnss_messages(gps)
+
+    # POLL_INTERVAL ごとに読む（元スクリプトは毎回標準出力。処理時間ぶん周期がずれないよう絶対時刻で待つ）
+    scheduler = Scheduler()
+    scheduler.add_task("gps", 1.0 / POLL_INTERVAL, poll)
+    try:
+        scheduler.run()
     except KeyboardInterrupt:
         print("受信停止")
     finally:
@@ -11,6 +11,8 @@ SFE-GPS-14414 (Qwiic Titan GPS) を I2C 経由で読み取るシンプルなス
 import time
 import sys
 import qwiic_titan_gps
+import i2c_health
+from scheduler import Scheduler
 
 GPS_TXT_PATH = "gps_realtime.txt"
 POLL_INTERVAL = 1.0  # sec
@@ -39,43 +41,51 @@ def main_loop():
         return 1
 
     print("GPS 接続 OK。データ取得を開始します。Ctrl-C で終了。")
-    try:
-        while True:
-            # qwiic_titan_gps の実装によってプロパティ名が多少異なる場合がありますが、
-            # 一般的にはわかりやすい getter が用意されています。
-            # ここではライブラリの nmea / gnss 情報を参照する方法を想定しています。
-            try:
-                # ライブラリが提供する NMEA 文字列取得メソッドがあれば取得
-                # （なければ位置情報プロパティを参照）
-                if gps.get_nmea_data() is True:
-                    # ライブラリ内部の gnss_messages から情報を読む想定
-                    lat = gps.gnss_messages.get('Latitude', None)
-                    lon = gps.gnss_messages.get('Longitude', None)
-                    sats = gps.gnss_messages.get('NumSats', None)
-                    fix = gps.gnss_messages.get('FixType', None)
-                    # NMEA フル文が欲しければ:
-                    # nmea = gps.last_nmea_sentence  # ライブラリによる
-                else:
-                    # get_nmea_data() が False の場合は過去データを参照するかスキップ
-                    lat = None
-                    lon = None
-                    sats = None
-                    fix = None
+    # 読み取りエラーが続いたら begin() で再接続する
+    supervisor = i2c_health.BusSupervisor()
+    supervisor.register("gps", reinit=gps.begin)
 
-                # 表示
-                now = time.strftime("%Y-%m-%d %H:%M:%S")
-                print(f"[{now}] lat={lat} lon={lon} sats={sats} fix={fix}")
+    def poll():
+        # qwiic_titan_gps の実装によってプロパティ名が多少異なる場合がありますが、
+        # 一般的にはわかりやすい getter が用意されています。
+        # ここではライブラリの nmea / gnss 情報を参照する方法を想定しています。
+        try:
+            # ライブラリが提供する NMEA 文字列取得メソッドがあれば取得
+            # （なければ位置情報プロパティを参照）
+            if supervisor.call("gps", gps.get_nmea_data) is True:
+                # ライブラリ内部の gnss_messages から情報を読む想定
+                lat = gps.gnss_messages.get('Latitude', None)
+                lon = gps.gnss_messages.get('Longitude', None)
+                sats = gps.gnss_messages.get('NumSats', None)
+                fix = gps.gnss_messages.get('FixType', None)
+                # NMEA フル文が欲しければ:
+                # nmea = gps.last_nmea_sentence  # ライブラリによる
+            else:
+                # get_nmea_data() が False の場合は過去データを参照するかスキップ
+                lat = None
+                lon = None
+                sats = None
+                fix = None
 
-                # ファイル保存（座標が取得できていれば）
-                if lat is not None and lon is not None:
-                    save_realtime(lat, lon)
+            # 表示
+            now = time.strftime("%Y-%m-%d %H:%M:%S")
+            print(f"[{now}] lat={lat} lon={lon} sats={sats} fix={fix}")
 
-            except Exception as e:
-                # 個別読み取りエラーは軽く扱う（接続の一時不良等を想定）
-                print("読み取り中の例外:", e)
+            # ファイル保存（座標が取得できていれば）
+            if lat is not None and lon is not None:
+                save_realtime(lat, lon)
 
-            time.sleep(POLL_INTERVAL)
+        except i2c_health.DeviceBackoff:
+            pass
+        except Exception as e:
+            # 個別読み取りエラーは軽く扱う（接続の一時不良等を想定）
+            print("読み取り中の例外:", e)
 
+    # POLL_INTERVAL ごとに読む（処理時間ぶん周期がずれないよう絶対時刻で待つ）
+    scheduler = Scheduler()
+    scheduler.add_task("gps", 1.0 / POLL_INTERVAL, poll)
+    try:
+        scheduler.run()
     except KeyboardInterrupt:
         print("終了要求を受け取りました。")
     finally:
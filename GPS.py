@@ -2,6 +2,14 @@
 import time, re, sys
 from smbus2 import SMBus, i2c_msg
 import pynmea2
+import i2c_health
+import timebase
+from scheduler import Scheduler
+
+try:
+    import pigpio  # バスクリア（SCL トグル）に使う。無ければバスクリアはしない
+except ImportError:
+    pigpio = None
 
 # ===== 設定 =====
 I2C_BUS = 1
@@ -10,22 +18,75 @@ READ_CHUNK = 128
 AGGREGATE_PERIOD = 1.0
 POLL_INTERVAL = 0.05
 RAW_DEBUG = False
+ECHO_SENTENCES = True  # GGA / RMC の内容を表示する
 NO_MSG_RESET_SEC = 10  # 何秒メッセージ無しならバッファをクリアして再試行
 # ==================
 
 NMEA_SENTENCE_RE = re.compile(r'(\$[^$]*\*[0-9A-Fa-f]{2}\r?\n?)')  # 完全なセンテンス抽出
 
+# GGA で測位が得られるたびに handler(lat, lon, hdop, t) を呼ぶ（t はその文を受信した timebase.now()）
+# 例: FIX_HANDLERS.append(fusion.GpsImuEkf().update_gps)
+FIX_HANDLERS = []
+
+# GGA / RMC の UTC と単調時計の対応（CLOCK.mono_to_utc(t) で任意のサンプル時刻を UTC にできる）
+CLOCK = timebase.GpsClockMapping()
+
 def read_i2c_bytes(bus, addr, length):
     """i2c_msg を使って length バイトを読み取る。例外は上位で処理する。"""
     msg = i2c_msg.read(addr, length)
     bus.i2c_rdwr(msg)
     return bytes(list(msg))
 
-def process_sentence(sentence):
-    """1つの完全な NMEA 文（文字列）を受け取り parseして処理する"""
+class NmeaStream:
+    """
+    受信した断片をためて完全な NMEA 文を取り出す
+    文ごとに、その文の最後の断片を受信した時刻（timebase.now()）を付ける
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.stamps = []   # (buffer 内でその断片が終わる位置, 受信時刻)
+
+    def feed(self, text, t):
+        if text:
+            self.buffer += text
+            self.stamps.append((len(self.buffer), t))
+
+    def sentences(self):
+        """完全な文を [(文, 受信時刻), ...] で返し、残り（断片）は次回のために保持する"""
+        found = []
+        last_end = 0
+        for m in NMEA_SENTENCE_RE.finditer(self.buffer):
+            end = m.end()
+            t = next(ts for pos, ts in self.stamps if pos >= end)
+            found.append((m.group(1), t))
+            last_end = end
+        if last_end:
+            self._trim(last_end)
+        elif len(self.buffer) > 4096:
+            # 完全な文が無いまま長大化したら切り捨て
+            if RAW_DEBUG:
+                print("buffer too large, trimming", file=sys.stderr)
+            self._trim(len(self.buffer) - 1024)
+        return found
+
+    def _trim(self, n):
+        self.buffer = self.buffer[n:]
+        self.stamps = [(pos - n, t) for pos, t in self.stamps if pos > n]
+
+    def clear(self):
+        self.buffer = ""
+        self.stamps = []
+
+def process_sentence(sentence, t=None):
+    """
+    1つの完全な NMEA 文（文字列）を受け取り parseして処理する
+    :param t: その文を受信した時刻（timebase.now()）。省略時は今
+    """
     s = sentence.strip()
     if not s:
         return
+    if t is None:
+        t = timebase.now()
     try:
         msg = pynmea2.parse(s)
     except Exception as e:
@@ -42,82 +103,111 @@ def process_sentence(sentence):
             return
         fix = getattr(msg, "gps_qual", None)
         sats = getattr(msg, "num_sats", None)
-        print(f"GGA - 緯度:{lat:.6f}, 経度:{lon:.6f}, 測位品質:{fix}, 衛星数:{sats}")
+        if ECHO_SENTENCES:
+            print(f"GGA - 緯度:{lat:.6f}, 経度:{lon:.6f}, 測位品質:{fix}, 衛星数:{sats}")
+        if getattr(msg, "timestamp", None) is not None:
+            CLOCK.add_nmea(t, msg.timestamp)   # GGA には日付が無い（0 時の繰り上がりは CLOCK が処理）
+        if FIX_HANDLERS and fix not in (None, "", 0, "0"):
+            try:
+                hdop = float(getattr(msg, "horizontal_dil", "") or "nan")
+            except ValueError:
+                hdop = float("nan")
+            for handler in FIX_HANDLERS:
+                # 受け取り側の例外で GPS の読み取りループを止めない
+                try:
+                    handler(lat, lon, hdop, t)
+                except Exception as e:
+                    print("測位ハンドラでエラー:", getattr(handler, "__name__", handler), e, file=sys.stderr)
     elif isinstance(msg, pynmea2.RMC):
         try:
             speed = msg.spd_over_grnd
             course = msg.true_course
         except Exception:
             speed = course = None
-        print(f"RMC - 速度:{speed}ノット, 真方位:{course}度")
+        if ECHO_SENTENCES:
+            print(f"RMC - 速度:{speed}ノット, 真方位:{course}度")
+        if getattr(msg, "timestamp", None) is not None and getattr(msg, "datestamp", None) is not None:
+            CLOCK.add_nmea(t, msg.timestamp, msg.datestamp)
     else:
         # 他のセンテンスは今は無視（必要ならここで処理）
         if RAW_DEBUG:
             print("Other sentence:", type(msg), msg.__dict__, file=sys.stderr)
 
+def make_supervisor(bus):
+    """GPS 読み取り用の I2C 監視を作る（バスクリアできるのは pigpiod が動いているときだけ）"""
+    def clear_bus():
+        # pigpiod への接続はバスクリアのときだけ開き、終わったら閉じる
+        pi = pigpio.pi()
+        try:
+            return pi.connected and i2c_health.bus_clear_pigpio(pi)
+        finally:
+            pi.stop()
+
+    bus_clear = clear_bus if pigpio is not None else None
+
+    def reopen():
+        bus.close()
+        bus.open(I2C_BUS)
+
+    supervisor = i2c_health.BusSupervisor(bus_clear=bus_clear, reopen=reopen)
+    supervisor.register("gps", XA1110_ADDR)
+    return supervisor
+
+class XA1110Reader:
+    """
+    XA1110 を I2C で小刻みに読み（poll）、AGGREGATE_PERIOD ごとにまとめて処理する（process）
+    どちらも scheduler.Scheduler のタスクとして回す（attach()）ので、処理時間ぶん周期がずれない
+    """
+    def __init__(self, bus, supervisor, addr=XA1110_ADDR):
+        self.bus = bus
+        self.supervisor = supervisor
+        self.addr = addr
+        self.stream = NmeaStream()  # 文字列バッファ（断片ごとの受信時刻つき）
+        self.last_msg_time = time.monotonic()
+
+    def poll(self):
+        """1回分を読み取り、読んだ時点の時刻と一緒にバッファへためる"""
+        try:
+            chunk = self.supervisor.call("gps", read_i2c_bytes, self.bus, self.addr, READ_CHUNK)
+        except i2c_health.DeviceBackoff:
+            # エラー続きで休ませている間は読まない（待ち時間は監視側が決める）
+            return
+        except OSError as e:
+            # I2C の一時エラーはログして次の周期で再試行（バックオフ・再接続・バスクリアは監視側で行う）
+            print("I2C読み取りエラー:", e, file=sys.stderr)
+            return
+        if chunk:
+            if RAW_DEBUG:
+                print("RAW CHUNK:", repr(chunk), file=sys.stderr)
+            self.stream.feed(chunk.decode('ascii', errors='ignore'), timebase.now())
+
+    def process(self):
+        """たまった"完全な"センテンスをすべて処理する（断片はバッファに残る）"""
+        for sent, t in self.stream.sentences():
+            process_sentence(sent, t)
+            self.last_msg_time = time.monotonic()
+
+        # ウォッチドッグ: 一定時間メッセージが来なければバッファをクリアして再試行
+        if time.monotonic() - self.last_msg_time > NO_MSG_RESET_SEC:
+            if RAW_DEBUG:
+                print("No messages for", NO_MSG_RESET_SEC, "s -> clearing buffer", file=sys.stderr)
+                print(self.supervisor.report(), file=sys.stderr)
+            self.stream.clear()
+            self.last_msg_time = time.monotonic()
+
+    def attach(self, scheduler, priority=0, name="gps"):
+        """poll を name、process を name + "_process" というタスクで登録する（周期の切り替えは name で行う）"""
+        scheduler.add_task(name, 1.0 / POLL_INTERVAL, self.poll, priority=priority)
+        scheduler.add_task(name + "_process", 1.0 / AGGREGATE_PERIOD, self.process, priority=priority + 1)
+
 def main():
     print(f"I2C XA1110 安全版（集約 {AGGREGATE_PERIOD}s）開始")
-    buffer = ""           # 文字列バッファ
-    last_msg_time = time.monotonic()
     with SMBus(I2C_BUS) as bus:
+        reader = XA1110Reader(bus, make_supervisor(bus))
+        scheduler = Scheduler()
+        reader.attach(scheduler)
         try:
-            while True:
-                # 1秒分（AGGREGATE_PERIOD）を小刻みに読み取って集める
-                start = time.monotonic()
-                collected = []
-                while time.monotonic() - start < AGGREGATE_PERIOD:
-                    try:
-                        chunk = read_i2c_bytes(bus, XA1110_ADDR, READ_CHUNK)
-                    except OSError as e:
-                        # I2C の一時エラーはログして短く休んで再試行
-                        print("I2C読み取りエラー:", e, file=sys.stderr)
-                        time.sleep(0.2)
-                        continue
-
-                    if chunk:
-                        if RAW_DEBUG:
-                            print("RAW CHUNK:", repr(chunk), file=sys.stderr)
-                        collected.append(chunk)
-                    time.sleep(POLL_INTERVAL)
-
-                if collected:
-                    # まとめてデコードしてバッファへ追加
-                    try:
-                        text = b"".join(collected).decode('ascii', errors='ignore')
-                    except Exception as e:
-                        print("デコード失敗:", e, file=sys.stderr)
-                        text = ""
-                    if text:
-                        buffer += text
-
-                # 正規表現で"完全な"センテンスをすべて抜き出して処理
-                if buffer:
-                    matches = list(NMEA_SENTENCE_RE.finditer(buffer))
-                    if matches:
-                        last_end = 0
-                        for m in matches:
-                            sent = m.group(1)
-                            process_sentence(sent)
-                            last_end = m.end()
-                            last_msg_time = time.monotonic()
-                        # matches の最後までを削除して残り（断片）を buffer に保持
-                        buffer = buffer[last_end:]
-                    else:
-                        # 完全な文が無ければ buffer はそのまま残す（断片を待つ）
-                        # でも長大化しすぎる場合は保護
-                        if len(buffer) > 4096:
-                            # バッファ異常に大きくなったら切り捨て
-                            if RAW_DEBUG:
-                                print("buffer too large, trimming", file=sys.stderr)
-                            buffer = buffer[-1024:]
-
-                # ウォッチドッグ: 一定時間メッセージが来なければバッファをクリアして再試行
-                if time.monotonic() - last_msg_time > NO_MSG_RESET_SEC:
-                    if RAW_DEBUG:
-                        print("No messages for", NO_MSG_RESET_SEC, "s -> clearing buffer", file=sys.stderr)
-                    buffer = ""
-                    last_msg_time = time.monotonic()
-
+            scheduler.run()
         except KeyboardInterrupt:
             print("停止 (Ctrl-C)")
 
@@ -1,28 +1,92 @@
-import time
-import board
-import busio
-import adafruit_bno055
-
-# I2Cバスの初期化
-i2c = busio.I2C(board.SCL, board.SDA)
-
-# BNO055の初期化
-sensor = adafruit_bno055.BNO055_I2C(i2c)
-
-# 取得関数
-def print_sensor_data():
-    print("温度： {} ° C".format(sensor.temperature))
-    print("加速度: {}".format(sensor.acceleration))  # 単位: m/s^2
-    print("磁力: {}".format(sensor.magnetic))        # 単位: uT
-    print("ジャイロ: {}".format(sensor.gyro))        # 単位: rad/s
-    print("オイラー角: {}".format(sensor.euler))     # 単位: degrees
-    print("クォータニオン: {}".format(sensor.quaternion))
-    print("線形加速度: {}".format(sensor.linear_acceleration))
-    print("重力ベクトル: {}".format(sensor.gravity))
+import sys
+import calibration
+import i2c_health
+import timebase
+from scheduler import Scheduler
+
+# init_sensor() を呼ぶまでハードウェアには触らない（import しただけでは何もしない）
+sensor = None
+monitor = None
+supervisor = None
+
+def init_sensor():
+    """I2C バスと BNO055 を初期化し、キャリブレーションの書き戻しと監視を準備する"""
+    global sensor, monitor, supervisor
+    # ドライバはここで読み込む（import しただけではハードウェアのライブラリも要らない）
+    import board
+    import busio
+    import adafruit_bno055
+
+    # I2Cバスの初期化
+    i2c = busio.I2C(board.SCL, board.SDA)
+
+    # BNO055の初期化
+    sensor = adafruit_bno055.BNO055_I2C(i2c)
+
+    # 保存済みのキャリブレーションを書き戻す（起動直後から方位を使えるように）
+    if calibration.restore_profile(sensor) is not None:
+        print("キャリブレーションプロファイルを書き戻しました")
+    monitor = calibration.CalibrationMonitor(sensor)
+
+    # バスエラーで止まらないよう、読み取りを監視付きで行う（エラーが続けばモードを入れ直す）
+    supervisor = i2c_health.BusSupervisor()
+    supervisor.register("bno055", 0x28, reinit=lambda: i2c_health.reinit_bno055(sensor))
+    return sensor
+
+# 取得関数（全項目を読み、timebase.now() の時刻 "t" を付けた辞書で返す）
+def read_sensor_data():
+    t0 = timebase.now()
+    sample = {
+        "temperature": sensor.temperature,
+        "acceleration": sensor.acceleration,               # 単位: m/s^2
+        "magnetic": sensor.magnetic,                       # 単位: uT
+        "gyro": sensor.gyro,                               # 単位: rad/s
+        "euler": sensor.euler,                             # 単位: degrees
+        "quaternion": sensor.quaternion,
+        "linear_acceleration": sensor.linear_acceleration,
+        "gravity": sensor.gravity,
+        "calibration_status": sensor.calibration_status,
+    }
+    # 全部読むのに数 ms かかるので、読み取り区間の中央を時刻にする
+    sample["t"] = 0.5 * (t0 + timebase.now())
+    return sample
+
+def print_sensor_data(sample):
+    print("時刻: {:.3f} s".format(sample["t"]))
+    print("温度： {} ° C".format(sample["temperature"]))
+    print("加速度: {}".format(sample["acceleration"]))
+    print("磁力: {}".format(sample["magnetic"]))
+    print("ジャイロ: {}".format(sample["gyro"]))
+    print("オイラー角: {}".format(sample["euler"]))
+    print("クォータニオン: {}".format(sample["quaternion"]))
+    print("線形加速度: {}".format(sample["linear_acceleration"]))
+    print("重力ベクトル: {}".format(sample["gravity"]))
+    print(monitor.describe())
     print("="*40)
 
-# メインループ
-while True:
-    print_sensor_data()
-    time.sleep(1)
+def read_imu():
+    # 監視するのはレジスタの読み取りだけ（表示やプロファイルの保存の失敗をバスエラーに数えない）
+    try:
+        sample = supervisor.call("bno055", read_sensor_data)
+    except i2c_health.DeviceBackoff:
+        return
+    except OSError as e:
+        print("I2C読み取りエラー:", e)
+        return
+    try:
+        monitor.poll(sample["calibration_status"])
+    except OSError as e:
+        print("キャリブレーションプロファイルの保存エラー:", e)
+    print_sensor_data(sample)
+
+# メインループ（1秒周期。処理時間ぶん周期がずれないよう絶対時刻で待つ）
+def main():
+    init_sensor()
+    scheduler = Scheduler()
+    scheduler.add_task("imu", 1.0, read_imu)
+    scheduler.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
     
\ No newline at end of file
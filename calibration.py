@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+BNO055 のキャリブレーション管理
+ - sensor.magnetic のログから楕円体フィッティング（最小二乗）でハードアイアン（中心）と磁場半径を推定
+   ソフトアイアン行列は BNO055 に書き込めないので、フィットの良し悪しの確認（fit_residual）にだけ使う
+ - BNO055 のオフセットレジスタをプロファイルファイル（JSON）に保存し、起動時に書き戻す
+   → 着地後すぐに方位が使える（自己キャリブレーションを数分待たなくてよい）
+ - 実行中はキャリブレーション状態を監視し、全項目が 3 になったらプロファイルを自動保存
+ - python3 calibration.py demo で合成データによるフィッティング確認
+依存: numpy（フィッティングのみ）
+"""
+
+import json
+import os
+import sys
+import time
+
+# numpy は読み込みに時間がかかるので、フィッティングの関数の中で import する
+# （acceleration.py がこのモジュールを読んでも、IMU の起動では numpy を読まない）
+
+# ===== 設定 =====
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "bno055_calibration.json")  # 起動ディレクトリによらずスクリプトの隣に置く
+# BNO055 の動作モード（adafruit_bno055 の定数と同じ値）
+CONFIG_MODE = 0x00
+NDOF_MODE = 0x0C
+MAG_LSB_PER_UT = 16.0       # 磁気オフセットレジスタは 1uT = 16LSB
+MIN_FIT_SAMPLES = 50        # フィッティングに必要な最小サンプル数
+HEADING_MIN_MAG_STATUS = 2  # 方位を信用する磁気キャリブレーション状態の下限
+# ==================
+
+OFFSET_FIELDS = (
+    "offsets_accelerometer",
+    "offsets_magnetometer",
+    "offsets_gyroscope",
+    "radius_accelerometer",
+    "radius_magnetometer",
+)
+
+
+# --- 楕円体フィッティング ---
+def fit_ellipsoid(samples):
+    """
+    磁気サンプル (N, 3) に楕円体を当てはめ、ハードアイアン / ソフトアイアン補正を求める
+    二次曲面 a x^2 + b y^2 + c z^2 + 2d xy + 2e xz + 2f yz + 2g x + 2h y + 2i z = 1 を
+    一括の最小二乗で解く
+    :return: (hard_iron(3,), soft_iron(3,3), field_radius)
+        補正後の値は (m - hard_iron) @ soft_iron.T で、半径 field_radius の球面に乗る
+    """
+    import numpy as np
+    m = np.asarray(samples, dtype=float)
+    if m.ndim != 2 or m.shape[1] != 3:
+        raise ValueError("samples は (N, 3) の配列である必要があります")
+    if m.shape[0] < MIN_FIT_SAMPLES:
+        raise ValueError(f"サンプル数が不足しています（{m.shape[0]} < {MIN_FIT_SAMPLES}）")
+
+    # 数値安定のため平均を引き、スケールをそろえてから解く
+    mean = m.mean(axis=0)
+    scale = np.abs(m - mean).max()
+    if scale == 0:
+        raise ValueError("サンプルが1点に集中しています")
+    p = (m - mean) / scale
+    x, y, z = p[:, 0], p[:, 1], p[:, 2]
+    D = np.column_stack([x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z, 2 * x, 2 * y, 2 * z])
+    coef, *_ = np.linalg.lstsq(D, np.ones(p.shape[0]), rcond=None)
+    a, b, c, d, e, f, g, h, i = coef
+
+    A = np.array([[a, d, e], [d, b, f], [e, f, c]])
+    v = np.array([g, h, i])
+    center = -np.linalg.solve(A, v)
+    k = 1.0 + center @ A @ center
+    M = A / k
+    w, V = np.linalg.eigh(M)
+    if np.any(w <= 0):
+        raise ValueError("楕円体になりません（回転が不十分なデータの可能性）")
+
+    # M = W^T W となる対称な W（単位球へ写す）
+    W = V @ np.diag(np.sqrt(w)) @ V.T
+    hard_iron = mean + center * scale
+    # 元のスケールの平均磁場の大きさに合わせる
+    radius = float(np.cbrt(1.0 / np.prod(np.sqrt(w)))) * scale
+    soft_iron = W * radius / scale
+    return hard_iron, soft_iron, radius
+
+
+def apply_mag_correction(samples, hard_iron, soft_iron):
+    """磁気サンプル（(3,) または (N, 3)）にハードアイアン / ソフトアイアン補正をかける"""
+    import numpy as np
+    m = np.asarray(samples, dtype=float)
+    return (m - hard_iron) @ np.asarray(soft_iron).T
+
+
+def fit_residual(samples, hard_iron, soft_iron, radius):
+    """補正後の半径のばらつき（相対 RMS）。小さいほど良いフィット"""
+    import numpy as np
+    r = np.linalg.norm(apply_mag_correction(samples, hard_iron, soft_iron), axis=1)
+    return float(np.sqrt(np.mean((r / radius - 1.0) ** 2)))
+
+
+def synthetic_magnetometer(n=500, hard_iron=(20.0, -15.0, 8.0), soft_iron=None,
+                           field=45.0, noise=0.3, seed=0):
+    """
+    回転させた機体で取れる磁気サンプルを合成する（テスト・動作確認用）
+    :param soft_iron: 真の磁場に掛かる歪み行列（None なら適当な歪みを使う）
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    u = rng.normal(size=(n, 3))
+    u /= np.linalg.norm(u, axis=1, keepdims=True)
+    if soft_iron is None:
+        soft_iron = np.array([[1.15, 0.08, 0.02], [0.08, 0.92, -0.05], [0.02, -0.05, 1.03]])
+    m = (u * field) @ np.asarray(soft_iron).T + np.asarray(hard_iron)
+    return m + rng.normal(0, noise, m.shape)
+
+
+# --- プロファイル保存 / 復元 ---
+def read_offsets(sensor):
+    """BNO055 のオフセットレジスタを辞書で読み出す"""
+    profile = {}
+    for name in OFFSET_FIELDS:
+        value = getattr(sensor, name)
+        profile[name] = list(value) if isinstance(value, (tuple, list)) else int(value)
+    return profile
+
+
+def save_profile(sensor, path=PROFILE_PATH, mag_fit=None):
+    """
+    現在のオフセットをプロファイルファイルに保存する
+    一時ファイルに書いてディスクに書き出してから置き換えるので、途中で電源が落ちても前のプロファイルが残る
+    :param mag_fit: fit_ellipsoid() の戻り値があれば、チップに反映できるハードアイアンと半径を記録として保存
+    """
+    profile = read_offsets(sensor)
+    profile["saved_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    if mag_fit is not None:
+        hard_iron, _, radius = mag_fit
+        profile["mag_hard_iron"] = [float(v) for v in hard_iron]
+        profile["mag_field_radius"] = float(radius)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return profile
+
+
+def load_profile(path=PROFILE_PATH):
+    """プロファイルを読み込む。無い・壊れている（書き込み中の電源断など）ときは None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            profile = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        print(f"プロファイル {path} が壊れているので使いません:", e, file=sys.stderr)
+        return None
+    if not isinstance(profile, dict):
+        print(f"プロファイル {path} の形式が違うので使いません", file=sys.stderr)
+        return None
+    return profile
+
+
+def restore_profile(sensor, path=PROFILE_PATH, run_mode=NDOF_MODE):
+    """
+    保存済みのオフセットを BNO055 に書き戻す
+    オフセットは CONFIG モードでしか書き込めないため、書き込み後に run_mode へ戻す
+    :return: 書き戻したプロファイル（無い・壊れていれば None。そのときは何も書き込まない）
+    """
+    profile = load_profile(path)
+    if profile is None:
+        return None
+    # 書き込む前に全項目を確かめる（途中まで書いて止まらないように）
+    values = {}
+    try:
+        for name in OFFSET_FIELDS:
+            value = profile[name]
+            values[name] = tuple(int(v) for v in value) if isinstance(value, list) else int(value)
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"プロファイル {path} の {e} が読めないので使いません", file=sys.stderr)
+        return None
+    sensor.mode = CONFIG_MODE
+    try:
+        for name, value in values.items():
+            setattr(sensor, name, value)
+    finally:
+        sensor.mode = run_mode
+    return profile
+
+
+def mag_fit_to_offsets(sensor, mag_fit):
+    """
+    ソフトウェアで求めたハードアイアン中心を BNO055 の磁気オフセットに反映する
+    （サンプルは現在のオフセット適用後の値なので、差分を足し込む）
+    """
+    hard_iron, _, radius = mag_fit
+    current = getattr(sensor, "offsets_magnetometer")
+    new = tuple(int(round(c + h * MAG_LSB_PER_UT)) for c, h in zip(current, hard_iron))
+    sensor.mode = CONFIG_MODE
+    try:
+        sensor.offsets_magnetometer = new
+        sensor.radius_magnetometer = int(round(radius * MAG_LSB_PER_UT))
+    finally:
+        sensor.mode = NDOF_MODE
+    return new
+
+
+# --- 実行中の監視 ---
+class CalibrationMonitor:
+    """
+    calibration_status (sys, gyro, accel, mag; 各 0-3) を監視する
+    全項目が 3 になったら一度だけプロファイルを保存する
+    """
+    def __init__(self, sensor, path=PROFILE_PATH, autosave=True, clock=time.monotonic):
+        self.sensor = sensor
+        self.path = path
+        self.autosave = autosave
+        self.clock = clock
+        self.start_time = clock()
+        self.status = (0, 0, 0, 0)
+        self.heading_ready_time = None
+        self.fully_calibrated_time = None
+        self.saved = False
+
+    def poll(self, status=None):
+        """
+        状態を読み直して (sys, gyro, accel, mag) を返す
+        :param status: 読み取り済みの calibration_status（省略時はここで読む）
+        """
+        if status is None:
+            status = self.sensor.calibration_status
+        self.status = tuple(status)
+        now = self.clock()
+        if self.heading_ready_time is None and self.heading_usable():
+            self.heading_ready_time = now - self.start_time
+        if all(s == 3 for s in self.status):
+            if self.fully_calibrated_time is None:
+                self.fully_calibrated_time = now - self.start_time
+            if self.autosave and not self.saved:
+                save_profile(self.sensor, self.path)
+                self.saved = True
+        return self.status
+
+    def heading_usable(self):
+        """方位（euler[0]）を航法に使ってよいか"""
+        sys_s, _, _, mag_s = self.status
+        return sys_s >= 1 and mag_s >= HEADING_MIN_MAG_STATUS
+
+    def describe(self):
+        sys_s, gyro_s, accel_s, mag_s = self.status
+        return f"校正状態 sys:{sys_s} gyro:{gyro_s} accel:{accel_s} mag:{mag_s}"
+
+
+def collect_mag_samples(sensor, duration=30.0, interval=0.02):
+    """機体をゆっくり回しながら磁気サンプルを集める"""
+    import numpy as np
+    samples = []
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        m = sensor.magnetic
+        if m is not None and None not in m:
+            samples.append(m)
+        time.sleep(interval)
+    return np.array(samples)
+
+
+def demo():
+    import numpy as np
+    truth_hard = np.array([20.0, -15.0, 8.0])
+    m = synthetic_magnetometer(hard_iron=truth_hard)
+    hard, soft, radius = fit_ellipsoid(m)
+    print("推定ハードアイアン:", np.round(hard, 2), " 真値:", truth_hard)
+    print("推定磁場半径:", round(radius, 2))
+    print("補正前の残差:", round(fit_residual(m, m.mean(axis=0), np.eye(3), radius), 4))
+    print("補正後の残差:", round(fit_residual(m, hard, soft, radius), 4))
+    return 0
+
+
+def main():
+    import board
+    import busio
+    import adafruit_bno055
+
+    i2c = busio.I2C(board.SCL, board.SDA)
+    sensor = adafruit_bno055.BNO055_I2C(i2c)
+    if restore_profile(sensor) is not None:
+        print("保存済みプロファイルを書き戻しました:", PROFILE_PATH)
+    monitor = CalibrationMonitor(sensor, autosave=False)
+
+    print("機体を 8 の字にゆっくり回してください（30秒）")
+    samples = collect_mag_samples(sensor)
+    try:
+        mag_fit = fit_ellipsoid(samples)
+    except ValueError as e:
+        print("フィッティング失敗:", e)
+        mag_fit = None
+    else:
+        print("残差:", round(fit_residual(samples, *mag_fit), 4))
+        mag_fit_to_offsets(sensor, mag_fit)
+
+    monitor.poll()
+    print(monitor.describe())
+    save_profile(sensor, mag_fit=mag_fit)
+    print("プロファイルを保存しました:", PROFILE_PATH)
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "demo":
+        sys.exit(demo())
+    sys.exit(main())
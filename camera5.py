@@ -1,18 +1,25 @@
 import subprocess
-import cv2
-import numpy as np
 import time
 
-def take_picture(output_path):
+# cv2 / numpy は読み込みに数秒かかる（Pi Zero）ので、画像処理を始めるときに import する
+# 着地直後の起動を遅らせないため、撮影だけなら読み込まない
+def load_cv():
+    """cv2 と numpy を読み込んで返す（2回目以降はキャッシュ済みなので一瞬）"""
+    import cv2
+    import numpy as np
+    return cv2, np
+
+def take_picture(output_path, width=None, height=None):
     """
     libcamera-jpeg コマンドを使って写真を撮影します。
+    width / height を渡すとその大きさで保存します（省略するとセンサーの最大解像度）。
     """
+    command = ['libcamera-jpeg', '-t', '2000', '-o', output_path]
+    if width is not None and height is not None:
+        command += ['--width', str(width), '--height', str(height)]
     try:
         print("写真を撮影中...")
-        subprocess.run(
-            ['libcamera-jpeg', '-t', '2000', '-o', output_path],
-            check=True
-        )
+        subprocess.run(command, check=True)
         print(f"写真が {output_path} に保存されました。")
     except subprocess.CalledProcessError as e:
         print(f"写真撮影コマンドの実行に失敗しました: {e}")
@@ -23,11 +30,24 @@ def find_red_cone(image_path):
     """
     画像から赤いコーン（物体）を検知し、その中心座標を返します。
     """
+    cv2, np = load_cv()
     try:
         img = cv2.imread(image_path)
-        if img is None:
-            print(f"エラー: 画像ファイル {image_path} を読み込めません。")
-            return (-1, -1)
+    except Exception as e:
+        print(f"画像処理中にエラーが発生しました: {e}")
+        return (-1, -1)
+    if img is None:
+        print(f"エラー: 画像ファイル {image_path} を読み込めません。")
+        return (-1, -1)
+    return find_red_cone_in_image(img)
+
+def find_red_cone_in_image(img):
+    """
+    BGR 画像（numpy 配列）から赤いコーンを検知し、その中心座標を返します。
+    共有メモリ上のフレーム（shm_bus.py）をコピーせずにそのまま渡せます。
+    """
+    cv2, np = load_cv()
+    try:
         hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
         lower_red1 = np.array([0, 50, 50])
         upper_red1 = np.array([10, 255, 255])
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+エンコーダ無しのデッドレコニング（モーター指令 + 速度カーブ + IMU ヨー）
+ - motor_pawer_control の left_duty / right_duty（バランス補正込みの指令値）を
+   左右それぞれの「デューティ → 車輪速度」カーブで速度に変換し、制御周期で位置を積分する
+ - 方位は BNO055 のヨーがあればそれを使い、無ければ左右の速度差から求める
+ - GPS が途切れている間（GPS.py の NO_MSG_RESET_SEC 相当）も位置を出し続ける
+ - 速度カーブは GPS の走行ログから一括の最小二乗で求める（calibrate_from_logs）
+ - python3 dead_reckoning.py で模擬ログから校正し、GPS 断の区間を再生して誤差を表示
+依存: numpy
+"""
+
+import math
+import sys
+
+import numpy as np
+
+from fusion import LocalProjection, wrap_angle
+from timebase import asof_join, interpolate
+
+# ===== 設定 =====
+TRACK_WIDTH = 0.20          # 左右の車輪の間隔 (m)
+GPS_TIMEOUT = 3.0           # これ以上 GPS 測位が無ければデッドレコニングに切り替える (s)
+DEADBAND_CANDIDATES = np.arange(0.0, 41.0, 1.0)  # 不感帯 (%) の探索範囲
+MIN_CAL_SPEED = 0.05        # 校正に使う最低速度 (m/s)。止まっている区間は除く
+POSITION_DRIFT = 0.05       # 走行距離 1m あたりの位置誤差の増え方 (m)
+# ==================
+
+
+class SpeedCurve:
+    """
+    符号付きデューティ (%) → 車輪速度 (m/s)
+    v = sign(d) * (a * x + b * x^2),  x = max(|d| - deadband, 0)
+    """
+    def __init__(self, a=0.012, b=0.0, deadband=10.0):
+        if a <= 0 or b < 0:
+            raise ValueError("速度カーブは a > 0, b >= 0 である必要があります")
+        self.a = a
+        self.b = b
+        self.deadband = deadband
+
+    def speed(self, duty):
+        x = np.maximum(np.abs(duty) - self.deadband, 0.0)
+        v = np.sign(duty) * (self.a * x + self.b * x * x)
+        return float(v) if np.ndim(v) == 0 else v
+
+    def duty_for(self, speed):
+        """speed (m/s) を出すのに必要なデューティ（逆関数）"""
+        s = abs(speed)
+        if s == 0:
+            return 0.0
+        if self.b == 0:
+            x = s / self.a
+        else:
+            x = (-self.a + math.sqrt(self.a ** 2 + 4 * self.b * s)) / (2 * self.b)
+        return math.copysign(x + self.deadband, speed)
+
+    @classmethod
+    def fit(cls, duty, speed, deadbands=DEADBAND_CANDIDATES):
+        """
+        (デューティ, 速度) の組から最小二乗で求める
+        不感帯の候補ごとの残差を一括で計算して最良のものを選ぶ
+        """
+        # 後進は符号を反転して前進と同じカーブに重ねる
+        duty = np.asarray(duty, dtype=float)
+        d = np.abs(duty)
+        v = np.asarray(speed, dtype=float) * np.where(duty < 0, -1.0, 1.0)
+        x = np.maximum(d[None, :] - deadbands[:, None], 0.0)          # (K, N)
+        # 正規方程式 [Σx² Σx³; Σx³ Σx⁴][a b]^T = [Σxv Σx²v] を候補ぶんまとめて解く
+        s2 = (x ** 2).sum(axis=1)
+        s3 = (x ** 3).sum(axis=1)
+        s4 = (x ** 4).sum(axis=1)
+        r1 = (x * v).sum(axis=1)
+        r2 = (x * x * v).sum(axis=1)
+        det = s2 * s4 - s3 * s3
+        ok = det > 1e-9
+        a = np.where(ok, (r1 * s4 - r2 * s3) / np.where(ok, det, 1.0), 0.0)
+        b = np.where(ok, (s2 * r2 - s3 * r1) / np.where(ok, det, 1.0), 0.0)
+        # b < 0 は高デューティで速度が下がるカーブで、duty_for の逆関数も作れない
+        # 制約 b >= 0 の最小二乗解は b = 0 の境界上にあるので、そこで a だけを解き直す
+        neg = b < 0
+        a = np.where(neg, r1 / np.where(s2 > 0, s2, 1.0), a)
+        b = np.where(neg, 0.0, b)
+        resid = ((a[:, None] * x + b[:, None] * x * x - v) ** 2).sum(axis=1)
+        resid[~ok | (a <= 0)] = np.inf
+        k = int(np.argmin(resid))
+        if not np.isfinite(resid[k]):
+            raise ValueError("速度カーブを求められません（データ不足）")
+        return cls(float(a[k]), float(b[k]), float(deadbands[k]))
+
+    def __repr__(self):
+        return f"SpeedCurve(a={self.a:.5f}, b={self.b:.7f}, deadband={self.deadband:.1f})"
+
+
+class DeadReckoner:
+    """
+    制御周期で呼ぶ位置積分器
+    座標は fusion.py と同じ局所平面（東・北, m）、ヨーは北=0 時計回り
+    """
+    def __init__(self, left_curve=None, right_curve=None, track_width=TRACK_WIDTH):
+        self.left_curve = left_curve or SpeedCurve()
+        self.right_curve = right_curve or SpeedCurve()
+        self.track_width = track_width
+        self.x = 0.0
+        self.y = 0.0
+        self.yaw = 0.0
+        self.speed = 0.0
+        self.sigma = 0.0            # 位置の不確かさ (m)
+        self.last_fix_time = None
+        self.distance_since_fix = 0.0
+
+    def step(self, dt, left_duty, right_duty, yaw_deg=None):
+        """
+        1制御周期ぶん進める
+        :param left_duty, right_duty: 符号付きデューティ（motor_pawer_control.left_duty 等）
+        :param yaw_deg: IMU のヨー（度）。None なら左右の速度差で積分
+        """
+        vl = self.left_curve.speed(left_duty)
+        vr = self.right_curve.speed(right_duty)
+        v = 0.5 * (vl + vr)
+        if yaw_deg is None:
+            # 時計回り正: 左が速いと右に曲がる
+            new_yaw = wrap_angle(self.yaw + (vl - vr) / self.track_width * dt)
+        else:
+            new_yaw = math.radians(yaw_deg)
+        # 区間の中間の方位で積分する
+        mid = self.yaw + 0.5 * wrap_angle(new_yaw - self.yaw)
+        self.x += v * math.sin(mid) * dt
+        self.y += v * math.cos(mid) * dt
+        self.yaw = new_yaw
+        self.speed = v
+        self.distance_since_fix += abs(v) * dt
+        self.sigma += POSITION_DRIFT * abs(v) * dt
+        return self.x, self.y
+
+    def step_motor(self, dt, motor, yaw_deg=None):
+        """motor_pawer_control の現在の指令で進める"""
+        return self.step(dt, motor.left_duty, motor.right_duty, yaw_deg)
+
+    def update_fix(self, t, x, y, sigma=0.0):
+        """GPS（または fusion.GpsImuEkf）の位置で積分をやり直す"""
+        self.x = x
+        self.y = y
+        self.sigma = sigma
+        self.last_fix_time = t
+        self.distance_since_fix = 0.0
+
+    def gps_lost(self, t, timeout=GPS_TIMEOUT):
+        """GPS 断で、デッドレコニングの位置を使うべき状態か"""
+        return self.last_fix_time is None or t - self.last_fix_time > timeout
+
+    def suggest_balance(self, power):
+        """
+        power (%) で左右が同じ速度になる (left_balance, right_balance)
+        遅い側を 1.0 にして、速い側を絞る
+        power が不感帯以下だとどちらかが進まず決められないので ValueError
+        """
+        deadband = max(self.left_curve.deadband, self.right_curve.deadband)
+        if power <= deadband:
+            raise ValueError(f"パワー {power}% は不感帯 {deadband:.0f}% 以下なのでバランスを決められません")
+        v = min(self.left_curve.speed(power), self.right_curve.speed(power))
+        lb = self.left_curve.duty_for(v) / power
+        rb = self.right_curve.duty_for(v) / power
+        return min(1.0, lb), min(1.0, rb)
+
+
+# --- 校正 ---
+def calibrate_from_logs(gps_log, duty_log, yaw_log=None, track_width=TRACK_WIDTH):
+    """
+    GPS の走行ログから左右の速度カーブを求める
+    :param gps_log: [t, 緯度, 経度] の配列（時刻は timebase.now() 基準）
+    :param duty_log: [t, 左デューティ, 右デューティ]（指令が変わったときだけでよい）
+    :param yaw_log: [t, ヨー(度)]。あれば旋回成分を左右に振り分ける
+    :return: (left_curve, right_curve)
+    """
+    gps_log = np.asarray(gps_log, dtype=float)
+    t = gps_log[:, 0]
+    proj = LocalProjection(gps_log[0, 1], gps_log[0, 2])
+    east, north = proj.to_local(gps_log[:, 1], gps_log[:, 2])
+
+    # 区間ごとの平均速度（中間時刻の値とする）
+    dt = np.diff(t)
+    de = np.diff(east)
+    dn = np.diff(north)
+    t_mid = t[:-1] + 0.5 * dt
+
+    duty = asof_join(t_mid, duty_log[:, 0], duty_log[:, 1:3])
+    # 区間中に指令が変わったものは除く
+    duty_start = asof_join(t[:-1], duty_log[:, 0], duty_log[:, 1:3])
+    duty_end = asof_join(t[1:], duty_log[:, 0], duty_log[:, 1:3])
+    steady = np.all(duty_start == duty_end, axis=1) & np.all(np.isfinite(duty), axis=1)
+    direction = np.sign(duty[:, 0] + duty[:, 1])
+
+    if yaw_log is not None:
+        # 移動量を機首方向に射影した符号付き速度（GPS ノイズで速さが底上げされない）
+        yaw = np.radians(interpolate(yaw_log[:, 0], yaw_log[:, 1], t, angular=True))
+        dyaw = wrap_angle(np.diff(yaw))
+        yaw_mid = yaw[:-1] + 0.5 * dyaw
+        v = (de * np.sin(yaw_mid) + dn * np.cos(yaw_mid)) / dt
+        # 旋回中は GPS 間の弦が走行した弧より短いので、一定曲率として弧長に直す
+        half = 0.5 * np.abs(dyaw)
+        v *= np.where(half > 1e-6, half / np.sin(np.maximum(half, 1e-6)), 1.0)
+        yaw_rate = dyaw / dt
+        use = steady & np.isfinite(v)
+    else:
+        # 方位が無ければ速さに指令の符号を付ける（低速域はノイズで過大になるので除く）
+        v = np.hypot(de, dn) / dt * direction
+        yaw_rate = np.zeros_like(v)
+        use = steady & (np.abs(v) > MIN_CAL_SPEED) & (direction != 0)
+
+    vl = v + 0.5 * track_width * yaw_rate
+    vr = v - 0.5 * track_width * yaw_rate
+    if use.sum() < 5:
+        raise ValueError("校正に使える走行区間が足りません")
+    left = SpeedCurve.fit(duty[use, 0], vl[use])
+    right = SpeedCurve.fit(duty[use, 1], vr[use])
+    return left, right
+
+
+# --- 再生検証 ---
+def simulate_logs(left_true, right_true, duration=240.0, rate=50.0, seed=0, track_width=TRACK_WIDTH,
+                  gps_sigma=0.3, gps_tau=30.0, gps_jitter=0.05):
+    """
+    真の速度カーブで走る模擬ログを作る
+    GPS の誤差は、相関時間 gps_tau [s] でゆっくり動く gps_sigma [m] の成分と、測位ごとの gps_jitter [m] のばらつき
+    （受信機の誤差はマルチパス・電離層などで数十秒かけて動き、連続した測位の差には小さくしか出ない。
+    gps_tau=0 で測位ごとに独立な誤差になる）
+    :return: (truth[t,x,y,yaw], duty_log[t,l,r], gps_log[t,lat,lon], yaw_log[t,yaw_deg])
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration * rate)
+    t = np.arange(n) / rate
+    # 4 秒ごとにランダムな指令（前進中心、たまに旋回・後進）
+    # 不感帯を求められるよう、停止と不感帯付近の低デューティの区間も混ぜる
+    seg = (t // 4).astype(int)
+    base = rng.choice([0, 10, 15, 20, 25, 30, 40, 55, 70, 85, 100], size=seg.max() + 1)
+    turn = rng.choice([0, 0, 0, 5, -5, 10], size=seg.max() + 1)
+    back = rng.random(seg.max() + 1) < 0.1
+    left = np.where(back[seg], -base[seg], np.clip(base[seg] + turn[seg], 0, 100))
+    right = np.where(back[seg], -base[seg], np.clip(base[seg] - turn[seg], 0, 100))
+
+    vl = left_true.speed(left)
+    vr = right_true.speed(right)
+    v = 0.5 * (vl + vr)
+    yaw = np.cumsum((vl - vr) / track_width) / rate
+    x = np.cumsum(v * np.sin(yaw)) / rate
+    y = np.cumsum(v * np.cos(yaw)) / rate
+
+    change = np.flatnonzero(np.r_[True, (np.diff(left) != 0) | (np.diff(right) != 0)])
+    duty_log = np.column_stack([t[change], left[change], right[change]])
+    idx = np.arange(0, n, int(rate))
+    proj = LocalProjection(35.0, 139.0)
+    noise = rng.normal(0, gps_sigma, (idx.size, 2))
+    alpha = math.exp(-1.0 / gps_tau) if gps_tau > 0 else 0.0
+    for k in range(1, idx.size):
+        noise[k] = alpha * noise[k - 1] + math.sqrt(1.0 - alpha ** 2) * noise[k]
+    noise += rng.normal(0, gps_jitter, noise.shape)
+    lat, lon = proj.to_latlon(x[idx] + noise[:, 0], y[idx] + noise[:, 1])
+    gps_log = np.column_stack([t[idx], lat, lon])
+    yaw_log = np.column_stack([t, np.degrees(yaw + rng.normal(0, math.radians(1), n)) % 360])
+    truth = np.column_stack([t, x, y, yaw])
+    return truth, duty_log, gps_log, yaw_log
+
+
+def main():
+    left_true = SpeedCurve(0.010, 0.00002, 18.0)
+    right_true = SpeedCurve(0.009, 0.00002, 22.0)
+    # 停止・低デューティの区間を含む模擬ログから、不感帯が許容誤差内で求まるか確かめる
+    tolerance = 4.0     # 許す不感帯の推定誤差 (%)
+    ok = True
+    curves = []
+    for seed in (0, 1, 2):
+        truth, duty_log, gps_log, yaw_log = simulate_logs(left_true, right_true, duration=600.0, seed=seed)
+        left, right = calibrate_from_logs(gps_log, duty_log, yaw_log)
+        curves.append((left, right))
+        err = max(abs(left.deadband - left_true.deadband), abs(right.deadband - right_true.deadband))
+        ok &= err <= tolerance
+        print(f"seed {seed}: 不感帯 左 {left.deadband:.0f}%（真値 {left_true.deadband:.0f}）"
+              f" 右 {right.deadband:.0f}%（真値 {right_true.deadband:.0f}）"
+              f" -> {'OK' if err <= tolerance else 'NG'}")
+
+    left, right = curves[0]
+    print("推定した左カーブ:", left)
+    print("推定した右カーブ:", right)
+    for d in (40, 70, 100):
+        print(f"  デューティ {d:3d}%: 左 {left.speed(d):.3f} m/s（真値 {left_true.speed(d):.3f}）"
+              f" 右 {right.speed(d):.3f} m/s（真値 {right_true.speed(d):.3f}）")
+
+    # 別の走行ログで、60 秒目から 30 秒間 GPS が途切れたとして再生する
+    truth, duty_log, gps_log, yaw_log = simulate_logs(left_true, right_true, duration=120.0, seed=1)
+    dr = DeadReckoner(left, right)
+    rate = 50.0
+    t_out, t_back = 60.0, 90.0
+    i0 = int(t_out * rate)
+    dr.update_fix(t_out, truth[i0, 1], truth[i0, 2])
+    dr.yaw = truth[i0, 3]
+    duty = asof_join(truth[:, 0], duty_log[:, 0], duty_log[:, 1:3])
+    for i in range(i0 + 1, int(t_back * rate)):
+        dr.step(1.0 / rate, duty[i, 0], duty[i, 1], yaw_log[i, 1])
+    i1 = int(t_back * rate) - 1
+    err = math.hypot(dr.x - truth[i1, 1], dr.y - truth[i1, 2])
+    travelled = np.hypot(np.diff(truth[i0:i1 + 1, 1]), np.diff(truth[i0:i1 + 1, 2])).sum()
+    print(f"GPS 断 {t_back - t_out:.0f} 秒・走行 {travelled:.1f} m 後の位置誤差: {err:.2f} m"
+          f"（推定の不確かさ {dr.sigma:.2f} m）")
+
+    lb, rb = dr.suggest_balance(80)
+    print(f"パワー 80 でまっすぐ走るためのバランス: L={lb:.3f}, R={rb:.3f}")
+    for power in (0, 15):
+        try:
+            dr.suggest_balance(power)
+            print(f"パワー {power}: 不感帯以下なのにバランスを返しました -> NG")
+            ok = False
+        except ValueError as e:
+            print(f"パワー {power}: {e} -> OK")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
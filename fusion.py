@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+GPS / IMU センサーフュージョン（拡張カルマンフィルタ）
+ - BNO055 の線形加速度とヨー角で位置・速度・方位を IMU レート（50〜100Hz）で予測
+ - GPS.py の 1Hz 測位で補正（HDOP に応じて観測ノイズを重み付け）
+ - 行列はすべて固定サイズで事前確保し、predict はループ内でメモリ確保しない
+ - python3 fusion.py で真値シミュレーションに対するリプレイ検証を実行
+依存: numpy
+
+状態ベクトル x = [東(m), 北(m), 東向き速度(m/s), 北向き速度(m/s), ヨー(rad)]
+ヨーは北=0、時計回りを正（BNO055 の euler[0] と同じ向き）
+"""
+
+import math
+import sys
+import time
+
+import numpy as np
+
+# ===== 設定 =====
+EARTH_RADIUS = 6378137.0     # WGS84 長半径 (m)
+ACCEL_NOISE = 0.5            # 線形加速度のノイズ (m/s^2)
+YAW_RATE_NOISE = 0.05        # ヨー角速度のプロセスノイズ (rad/s)
+YAW_MEAS_NOISE = math.radians(3.0)  # BNO055 ヨー角の観測ノイズ (rad)
+GPS_UERE = 3.0               # HDOP=1 のときの水平誤差 (m)
+GPS_GATE = 13.8              # 2自由度 χ² (99.9%)。これを超える GPS は外れ値として捨てる
+VELOCITY_DAMPING = 0.02      # 加速度積分のドリフト抑制用の速度減衰 (1/s)
+# ==================
+
+N_STATE = 5
+
+
+def wrap_angle(a):
+    """角度を [-pi, pi) に正規化"""
+    return (a + math.pi) % (2.0 * math.pi) - math.pi
+
+
+class LocalProjection:
+    """
+    緯度経度を原点まわりの局所平面（東・北, m）に変換する
+    数 km 程度の走行範囲なら正距円筒近似で十分
+    """
+    def __init__(self, lat0, lon0):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self._k_lon = math.radians(1.0) * EARTH_RADIUS * math.cos(math.radians(lat0))
+        self._k_lat = math.radians(1.0) * EARTH_RADIUS
+
+    def to_local(self, lat, lon):
+        return ((lon - self.lon0) * self._k_lon, (lat - self.lat0) * self._k_lat)
+
+    def to_latlon(self, east, north):
+        return (self.lat0 + north / self._k_lat, self.lon0 + east / self._k_lon)
+
+
+class GpsImuEkf:
+    """
+    GPS / IMU 拡張カルマンフィルタ
+    predict() を IMU の周期で、update_yaw() を方位取得ごとに、
+    update_gps() を GPS 測位ごとに呼ぶ
+    """
+    def __init__(self, accel_noise=ACCEL_NOISE, yaw_rate_noise=YAW_RATE_NOISE,
+                 yaw_noise=YAW_MEAS_NOISE, uere=GPS_UERE, gate=GPS_GATE):
+        self.accel_var = accel_noise ** 2
+        self.yaw_rate_var = yaw_rate_noise ** 2
+        self.yaw_var = yaw_noise ** 2
+        self.uere = uere
+        self.gate = gate
+
+        self.x = np.zeros(N_STATE)
+        self.P = np.diag([1e4, 1e4, 1.0, 1.0, math.pi ** 2])
+        self.projection = None
+        self.initialized = False
+        self.last_time = None
+        self.rejected_fixes = 0
+
+        # 作業領域（ループ内で確保しない）
+        self._F = np.eye(N_STATE)
+        self._Q = np.zeros((N_STATE, N_STATE))
+        self._tmp = np.empty((N_STATE, N_STATE))
+        self._k = np.empty(N_STATE)
+        self._H_pos = np.zeros((2, N_STATE))
+        self._H_pos[0, 0] = 1.0
+        self._H_pos[1, 1] = 1.0
+        self._R_pos = np.zeros((2, 2))
+        self._z_pos = np.empty(2)
+        self._eye = np.eye(N_STATE)
+
+    # --- 予測 ---
+    def predict(self, dt, accel_forward, accel_left, yaw_rate=0.0):
+        """
+        IMU 1 サンプル分だけ状態を進める
+        :param accel_forward: 機体前方向の線形加速度 (m/s^2)
+        :param accel_left: 機体左方向の線形加速度 (m/s^2)
+        :param yaw_rate: 時計回りを正とするヨー角速度 (rad/s)
+        """
+        if dt <= 0.0:
+            return
+        x = self.x
+        F = self._F
+        Q = self._Q
+        s = math.sin(x[4])
+        c = math.cos(x[4])
+        # 機体座標 → 東・北
+        a_e = accel_forward * s - accel_left * c
+        a_n = accel_forward * c + accel_left * s
+
+        half_dt2 = 0.5 * dt * dt
+        damp = 1.0 - VELOCITY_DAMPING * dt
+        x[0] += x[2] * dt + a_e * half_dt2
+        x[1] += x[3] * dt + a_n * half_dt2
+        x[2] = x[2] * damp + a_e * dt
+        x[3] = x[3] * damp + a_n * dt
+        x[4] = wrap_angle(x[4] + yaw_rate * dt)
+
+        # ヤコビアン（a_e, a_n のヨー微分はそれぞれ a_n, -a_e）
+        F[0, 2] = dt
+        F[1, 3] = dt
+        F[2, 2] = damp
+        F[3, 3] = damp
+        F[0, 4] = a_n * half_dt2
+        F[1, 4] = -a_e * half_dt2
+        F[2, 4] = a_n * dt
+        F[3, 4] = -a_e * dt
+
+        # プロセスノイズ（加速度ホワイトノイズの離散化）
+        q = self.accel_var
+        Q[0, 0] = Q[1, 1] = q * half_dt2 * half_dt2
+        Q[0, 2] = Q[2, 0] = Q[1, 3] = Q[3, 1] = q * half_dt2 * dt
+        Q[2, 2] = Q[3, 3] = q * dt * dt
+        Q[4, 4] = self.yaw_rate_var * dt * dt
+
+        # P = F P F^T + Q
+        np.dot(F, self.P, out=self._tmp)
+        np.dot(self._tmp, F.T, out=self.P)
+        self.P += Q
+
+    def step_imu(self, t, accel_forward, accel_left, yaw_deg=None, yaw_rate=0.0):
+        """
+        IMU サンプルを時刻付きで取り込む（predict + 方位補正）
+        :param t: time.monotonic() 基準の時刻 (s)
+        :param yaw_deg: BNO055 の euler[0]（度）。None なら方位補正しない
+        """
+        if self.last_time is not None:
+            self.predict(t - self.last_time, accel_forward, accel_left, yaw_rate)
+        self.last_time = t
+        if yaw_deg is not None:
+            self.update_yaw(math.radians(yaw_deg))
+
+    # --- 補正 ---
+    def update_yaw(self, yaw):
+        """方位（rad, 北=0 時計回り）で補正（スカラー観測なので行列演算は不要）"""
+        P = self.P
+        k = self._k
+        innov = wrap_angle(yaw - self.x[4])
+        s = P[4, 4] + self.yaw_var
+        np.divide(P[:, 4], s, out=k)
+        # P = P - k P[4,:]（外積も作業領域に書く）
+        np.multiply(k[:, None], P[4, :], out=self._tmp)
+        P -= self._tmp
+        k *= innov
+        self.x += k
+        self.x[4] = wrap_angle(self.x[4])
+
+    def update_gps(self, lat, lon, hdop=None, t=None):
+        """
+        GPS 測位で位置を補正する
+        最初の測位は局所座標の原点にして状態を初期化する
+        :param t: 測位を受信した時刻（timebase.now()）。最後の IMU より新しければ、その時刻まで予測してから補正する
+        :return: 採用したら True、外れ値として捨てたら False
+        """
+        if t is not None and self.last_time is not None and t > self.last_time:
+            self.predict(t - self.last_time, 0.0, 0.0)
+            self.last_time = t
+        if self.projection is None:
+            self.projection = LocalProjection(lat, lon)
+        east, north = self.projection.to_local(lat, lon)
+        if hdop is None or not hdop > 0:
+            hdop = 1.0
+        var = (hdop * self.uere) ** 2
+
+        if not self.initialized:
+            self.x[0] = east
+            self.x[1] = north
+            self.P[0, 0] = self.P[1, 1] = var
+            self.initialized = True
+            return True
+
+        H = self._H_pos
+        R = self._R_pos
+        z = self._z_pos
+        R[0, 0] = R[1, 1] = var
+        z[0] = east - self.x[0]
+        z[1] = north - self.x[1]
+
+        S = self.P[:2, :2] + R
+        S_inv = np.linalg.inv(S)
+        if float(z @ S_inv @ z) > self.gate:
+            self.rejected_fixes += 1
+            return False
+
+        K = self.P @ H.T @ S_inv
+        self.x += K @ z
+        self.x[4] = wrap_angle(self.x[4])
+        # Joseph 形式で数値的に対称・正定値を保つ
+        I_KH = self._eye - K @ H
+        self.P = I_KH @ self.P @ I_KH.T + K @ R @ K.T
+        return True
+
+    # --- 出力 ---
+    def position(self):
+        """(東, 北) [m]"""
+        return float(self.x[0]), float(self.x[1])
+
+    def latlon(self):
+        """推定位置の (緯度, 経度)。GPS 未取得なら None"""
+        if self.projection is None:
+            return None
+        return self.projection.to_latlon(self.x[0], self.x[1])
+
+    def heading_deg(self):
+        """推定方位（度, 0-360, 北=0 時計回り）"""
+        return math.degrees(self.x[4]) % 360.0
+
+    def speed(self):
+        return math.hypot(self.x[2], self.x[3])
+
+
+# --- リプレイ検証 ---
+def simulate_ground_truth(duration=120.0, imu_rate=100.0, gps_rate=1.0, seed=0,
+                          lat0=35.0, lon0=139.0):
+    """
+    真値の走行軌跡と、それに対応する IMU / GPS ログを生成する
+    :return: (truth, imu_log, gps_log)
+        truth  : [t, 東, 北, ヨー(rad)] の配列
+        imu_log: [t, 前方加速度, 左加速度, ヨー(度), ヨー角速度(rad/s)]
+        gps_log: [t, 緯度, 経度, HDOP]
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(0.0, duration, 1.0 / imu_rate)
+    # 加減速しながら蛇行する軌跡
+    speed = 0.6 + 0.4 * np.sin(2 * np.pi * t / 40.0)
+    yaw_rate = 0.15 * np.sin(2 * np.pi * t / 25.0)
+    yaw = np.cumsum(yaw_rate) / imu_rate
+    dt = 1.0 / imu_rate
+    east = np.cumsum(speed * np.sin(yaw)) * dt
+    north = np.cumsum(speed * np.cos(yaw)) * dt
+    accel_fwd = np.gradient(speed, dt)
+    accel_left = -speed * yaw_rate  # 時計回り旋回で右向き（負の左）向心加速度
+
+    imu_log = np.column_stack([
+        t,
+        accel_fwd + rng.normal(0, 0.15, t.size),
+        accel_left + rng.normal(0, 0.15, t.size),
+        np.degrees(yaw + rng.normal(0, math.radians(2.0), t.size)) % 360.0,
+        yaw_rate + rng.normal(0, 0.01, t.size),
+    ])
+
+    proj = LocalProjection(lat0, lon0)
+    step = max(1, int(round(imu_rate / gps_rate)))
+    idx = np.arange(0, t.size, step)
+    hdop = rng.uniform(0.8, 2.5, idx.size)
+    noise = rng.normal(0, 1.0, (idx.size, 2)) * (hdop * 1.5)[:, None]
+    lat, lon = proj.to_latlon(east[idx] + noise[:, 0], north[idx] + noise[:, 1])
+    gps_log = np.column_stack([t[idx], lat, lon, hdop])
+    truth = np.column_stack([t, east, north, yaw])
+    return truth, imu_log, gps_log
+
+
+def replay(imu_log, gps_log, ekf=None):
+    """
+    IMU / GPS ログを時刻順に EKF へ流し、IMU 時刻ごとの推定 [t, 東, 北, ヨー] を返す
+    """
+    if ekf is None:
+        ekf = GpsImuEkf()
+    out = np.empty((imu_log.shape[0], 4))
+    gi = 0
+    n_gps = gps_log.shape[0]
+    for i, (t, ax, ay, yaw_deg, yaw_rate) in enumerate(imu_log):
+        while gi < n_gps and gps_log[gi, 0] <= t:
+            _, lat, lon, hdop = gps_log[gi]
+            ekf.update_gps(lat, lon, hdop)
+            gi += 1
+        ekf.step_imu(t, ax, ay, yaw_deg, yaw_rate)
+        out[i, 0] = t
+        out[i, 1:3] = ekf.x[:2]
+        out[i, 3] = ekf.x[4]
+    return out, ekf
+
+
+def main():
+    truth, imu_log, gps_log = simulate_ground_truth()
+    est, ekf = replay(imu_log, gps_log)
+    # 原点は最初の GPS 測位なので、真値側も同じ原点に合わせる
+    proj = ekf.projection
+    e0, n0 = LocalProjection(35.0, 139.0).to_local(proj.lat0, proj.lon0)
+    err = np.hypot(est[:, 1] - (truth[:, 1] - e0), est[:, 2] - (truth[:, 2] - n0))
+    skip = imu_log.shape[0] // 10  # 収束前の区間は除外
+    print(f"位置誤差 RMS: {np.sqrt(np.mean(err[skip:] ** 2)):.2f} m, 最大: {err[skip:].max():.2f} m")
+
+    gps_err = []
+    for t, lat, lon, _ in gps_log:
+        i = int(np.searchsorted(truth[:, 0], t))
+        e, n = proj.to_local(lat, lon)
+        gps_err.append(math.hypot(e - (truth[i, 1] - e0), n - (truth[i, 2] - n0)))
+    print(f"GPS 単独の誤差 RMS: {np.sqrt(np.mean(np.square(gps_err))):.2f} m")
+    print(f"外れ値として捨てた測位: {ekf.rejected_fixes}")
+
+    n = 2000
+    start = time.perf_counter()
+    for _ in range(n):
+        ekf.predict(0.01, 0.1, 0.0, 0.01)
+    print(f"predict 平均時間: {(time.perf_counter() - start) / n * 1e6:.1f} us")
+    start = time.perf_counter()
+    for _ in range(n):
+        ekf.update_yaw(0.1)
+    print(f"update_yaw 平均時間: {(time.perf_counter() - start) / n * 1e6:.1f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
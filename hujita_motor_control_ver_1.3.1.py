@@ -18,26 +18,36 @@
 # --- 標準ライブラリ・外部ライブラリのインポート ---
 import sys
 import time
+import math
 import os
+import select
+import threading
 import pigpio
 import tty
 import termios
+import motor_ramp
+from scheduler import Scheduler
 
 # --- キー入力処理 ---
-class _Getch:
+class _KeyPoller:
     """
-    標準入力から1文字を取得します。画面にはエコーされません。
+    標準入力から1文字を待たずに取得します（押されていなければ None）。画面にはエコーされません。
+    with 文の間だけ端末を cbreak モードにします。
     Unix系OS (Linux, macOS, Raspberry Piなど) 専用の実装です。
     """
+    def __enter__(self):
+        self.fd = sys.stdin.fileno()
+        self.old_settings = termios.tcgetattr(self.fd)
+        tty.setcbreak(self.fd)
+        return self
+
+    def __exit__(self, *exc):
+        termios.tcsetattr(self.fd, termios.TCSADRAIN, self.old_settings)
+
     def __call__(self):
-        fd = sys.stdin.fileno()
-        old_settings = termios.tcgetattr(fd)
-        try:
-            tty.setraw(sys.stdin.fileno())
-            char = sys.stdin.read(1)
-        finally:
-            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-        return char.encode('utf-8')
+        if not select.select([self.fd], [], [], 0)[0]:
+            return None
+        return os.read(self.fd, 1)
 
 
 # --- 定数定義 ---
@@ -58,16 +68,25 @@ CURVE_TURN_POWER_RATIO = 0.75 # カーブ旋回時のパワー比率
 CURVE_TURN_RATE = 0.3       # カーブ旋回時の内輪の速度比率
 SPIN_TURN_POWER_RATIO = 0.75  # 信地旋回時のパワー比率
 SPIN_TURN_RATE = -1.0       # 信地旋回時の内輪の速度比率 (-1.0で逆回転)
+OBSTACLE_CHECK_DISTANCE = 0.5 # 障害物マップで前方を確認する距離 (m)
+CURVE_TURN_CHECK_ANGLE = 30.0 # カーブ旋回時に確認する進行方向のずれ (度)
+RANGING_RATE = 10.0         # 障害物マップ用の距離測定の周期 (Hz)
+POSE_RATE = 50.0            # 障害物マップ用のデッドレコニングの周期 (Hz)
+KEY_POLL_RATE = 50.0        # キー入力を確認する周期 (Hz)
 
 class motor_pawer_control: #10期リスペクト
     """
     モーター制御や状態をまとめたクラス
     """
-    def __init__(self, pi):
+    def __init__(self, pi, obstacle_map=None, ramp=None):
         self.pi = pi
+        self.obstacle_map = obstacle_map  # occupancy_grid.OccupancyGrid（無ければ確認しない）
+        self.ramp = ramp  # motor_ramp.RampEngine（無ければ指令をそのままピンへ書く）
         self.power = 80  # モーターの基本パワー (0-100)
         self.left_balance = 1.0  # 左モーターのバランス補正値
         self.right_balance = 1.0 # 右モーターのバランス補正値
+        self.left_duty = 0.0   # 左モーターへの指令（符号付き、正: 正転）
+        self.right_duty = 0.0  # 右モーターへの指令（符号付き、正: 正転）
 
         # GPIOピンのセットアップ
         pins = [LEFT_MOTOR_PIN1, LEFT_MOTOR_PIN2, RIGHT_MOTOR_PIN1, RIGHT_MOTOR_PIN2]
@@ -78,33 +97,72 @@ class motor_pawer_control: #10期リスペクト
 
         self.stop()
 
+    def _set_motor(self, pin1, pin2, duty):
+        """符号付きの指令を1つのモーターのピンへ書く（逆側のピンを先に 0 にする）"""
+        if duty >= 0:
+            self.pi.set_PWM_dutycycle(pin2, 0)
+            self.pi.set_PWM_dutycycle(pin1, duty)
+        else:
+            self.pi.set_PWM_dutycycle(pin1, 0)
+            self.pi.set_PWM_dutycycle(pin2, -duty)
+
+    def _drive(self, left, right):
+        """
+        左右モーターへの符号付き指令
+        ランプがあれば目標値として渡すだけで、実際の変化はランプ側で少しずつ行う
+        """
+        self.left_duty = left
+        self.right_duty = right
+        if self.ramp is not None:
+            self.ramp.set_targets(left=left, right=right)
+            return
+        self._set_motor(LEFT_MOTOR_PIN1, LEFT_MOTOR_PIN2, left)
+        self._set_motor(RIGHT_MOTOR_PIN1, RIGHT_MOTOR_PIN2, right)
+
     def stop(self):
-        """モーターを停止（ブレーキではない）"""
-        self.pi.set_PWM_dutycycle(LEFT_MOTOR_PIN1, 0)
-        self.pi.set_PWM_dutycycle(LEFT_MOTOR_PIN2, 0)
-        self.pi.set_PWM_dutycycle(RIGHT_MOTOR_PIN1, 0)
-        self.pi.set_PWM_dutycycle(RIGHT_MOTOR_PIN2, 0)
+        """モーターを停止（ブレーキではない。ランプがあれば徐々に止める）"""
+        self._drive(0, 0)
+
+    def stop_now(self):
+        """ランプを無視して即停止（終了処理用）"""
+        self.left_duty = self.right_duty = 0.0
+        if self.ramp is not None:
+            self.ramp.stop_now()
+            return
+        self._drive(0, 0)
 
     def brake(self):
         """モーターにブレーキをかける"""
+        self.left_duty = self.right_duty = 0.0
+        if self.ramp is not None:
+            self.ramp.brake(self.power)
+            return
         self.pi.set_PWM_dutycycle(LEFT_MOTOR_PIN1, self.power)
         self.pi.set_PWM_dutycycle(LEFT_MOTOR_PIN2, self.power)
         self.pi.set_PWM_dutycycle(RIGHT_MOTOR_PIN1, self.power)
         self.pi.set_PWM_dutycycle(RIGHT_MOTOR_PIN2, self.power)
 
+    def is_clear(self, relative_heading=0.0, distance=OBSTACLE_CHECK_DISTANCE):
+        """
+        障害物マップで、今の向きから relative_heading 度ずれた方向が通れるか
+        マップが無い場合は常に True
+        """
+        if self.obstacle_map is None:
+            return True
+        heading = self.obstacle_map.yaw + relative_heading
+        return self.obstacle_map.is_path_clear(heading, distance)
+
     def forward(self):
-        """前進"""
-        self.pi.set_PWM_dutycycle(LEFT_MOTOR_PIN2, 0)
-        self.pi.set_PWM_dutycycle(RIGHT_MOTOR_PIN2, 0)
-        self.pi.set_PWM_dutycycle(LEFT_MOTOR_PIN1, self.power * self.left_balance)
-        self.pi.set_PWM_dutycycle(RIGHT_MOTOR_PIN1, self.power * self.right_balance)
+        """前進（前方に障害物があれば停止して False を返す）"""
+        if not self.is_clear():
+            self.stop()
+            return False
+        self._drive(self.power * self.left_balance, self.power * self.right_balance)
+        return True
 
     def backward(self):
         """後進"""
-        self.pi.set_PWM_dutycycle(LEFT_MOTOR_PIN1, 0)
-        self.pi.set_PWM_dutycycle(RIGHT_MOTOR_PIN1, 0)
-        self.pi.set_PWM_dutycycle(LEFT_MOTOR_PIN2, self.power * self.left_balance)
-        self.pi.set_PWM_dutycycle(RIGHT_MOTOR_PIN2, self.power * self.right_balance)
+        self._drive(-self.power * self.left_balance, -self.power * self.right_balance)
 
     def turn(self, direction, power_ratio, turn_rate):
         """
@@ -115,34 +173,25 @@ class motor_pawer_control: #10期リスペクト
                         -1: 逆回転（信地旋回）
                          0: 停止（片輪旋回）
                          0.3: 正回転（カーブ旋回）
+        :return: 曲がる先に障害物があって停止した場合は False
         """
+        # 前に進みながら曲がる場合は、曲がる先が空いているか確認する（信地旋回はその場なので不要）
+        if turn_rate >= 0:
+            angle = -CURVE_TURN_CHECK_ANGLE if direction == 'left' else CURVE_TURN_CHECK_ANGLE
+            if not self.is_clear(angle):
+                self.stop()
+                return False
+
         turn_power = self.power * power_ratio
 
-        # 方向によって左右のパワーを決定
+        # 外側は正転、内側は turn_rate 倍（turn_rateが負なら逆回転）
+        outer_power = turn_power
+        inner_power = turn_power * turn_rate
         if direction == 'left':
-            outer_power = turn_power
-            inner_power = turn_power * turn_rate
-            outer_pin1, outer_pin2 = RIGHT_MOTOR_PIN1, RIGHT_MOTOR_PIN2
-            inner_pin1, inner_pin2 = LEFT_MOTOR_PIN1, LEFT_MOTOR_PIN2
-            outer_balance, inner_balance = self.right_balance, self.left_balance
-        else: 
-            outer_power = turn_power
-            inner_power = turn_power * turn_rate
-            outer_pin1, outer_pin2 = LEFT_MOTOR_PIN1, LEFT_MOTOR_PIN2
-            inner_pin1, inner_pin2 = RIGHT_MOTOR_PIN1, RIGHT_MOTOR_PIN2
-            outer_balance, inner_balance = self.left_balance, self.right_balance
-
-        # 外側のモーターをセット
-        self.pi.set_PWM_dutycycle(outer_pin2, 0)
-        self.pi.set_PWM_dutycycle(outer_pin1, outer_power * outer_balance)
-
-        # 内側のモーターをセット (turn_rateが負なら逆回転)
-        if turn_rate >= 0:
-            self.pi.set_PWM_dutycycle(inner_pin2, 0)
-            self.pi.set_PWM_dutycycle(inner_pin1, inner_power * inner_balance)
+            self._drive(inner_power * self.left_balance, outer_power * self.right_balance)
         else:
-            self.pi.set_PWM_dutycycle(inner_pin1, 0)
-            self.pi.set_PWM_dutycycle(inner_pin2, -inner_power * inner_balance)
+            self._drive(outer_power * self.left_balance, inner_power * self.right_balance)
+        return True
 
     def adjust_power(self, amount):
         """モーターパワーを調整"""
@@ -166,7 +215,116 @@ class motor_pawer_control: #10期リスペクト
         print(f"左右バランス: L={self.left_balance:.3f}, R={self.right_balance:.3f}")
 
 
+# --- 障害物マップ ---
+def start_obstacle_map(ramp):
+    """
+    kyori.py の超音波距離で障害物マップ（occupancy_grid.OccupancyGrid）を作り、別スレッドで更新し続ける
+    ラジコン操作では IMU / GPS を使わないので、姿勢はランプの実際の出力からデッドレコニングで求める
+    （距離測定の busy wait でランプ更新が遅れないよう、ランプとは別のスレッドにする）
+    :return: (マップ, スケジューラ, スレッド)。距離センサーが使えなければ None
+    """
+    try:
+        import kyori
+        import occupancy_grid
+        import dead_reckoning
+        kyori.setup()
+    except Exception as e:
+        print("距離センサーが使えないため、障害物マップ無しで動かします:", e)
+        return None
+
+    grid = occupancy_grid.OccupancyGrid()
+    reckoner = dead_reckoning.DeadReckoner()
+    last = [time.monotonic()]
+
+    def update_pose():
+        now = time.monotonic()
+        duties = ramp.duties()
+        reckoner.step(now - last[0], duties["left"], duties["right"])
+        last[0] = now
+        grid.update_pose(reckoner.x, reckoner.y, math.degrees(reckoner.yaw))
+
+    def update_range():
+        _, distance_cm = kyori.measure_stamped()
+        if distance_cm is None:
+            return   # エコーが来なかった（前が空いているとは限らないので地図は更新しない）
+        grid.integrate_range(distance_cm / 100.0)
+
+    sensing = Scheduler()
+    sensing.add_task("pose", POSE_RATE, update_pose, priority=0)
+    sensing.add_task("ranging", RANGING_RATE, update_range, priority=1)
+    thread = threading.Thread(target=sensing.run, name="obstacle_map", daemon=True)
+    thread.start()
+    return grid, sensing, thread
+
+
 # --- メイン処理 ---
+def show_screen(kansei, current_action):
+    """操作説明と現在の状態を表示"""
+    # 画面クリア
+    os.system('cls' if os.name == 'nt' else 'clear')
+
+    print("--- CanSat ラジコン操作プログラム ---")
+    print("[操作キー]")
+    print("  W: 前進         S: 後進")
+    print("  A: 左信地旋回   D: 右信地旋回")
+    print("  Q: 左カーブ旋回 E: 右カーブ旋回")
+    print("  K: モーターパワー増加")
+    print("  L: モーターパワー減少")
+    print("  ,: モーター左右差調節（左にずらす）")
+    print("  .: モーター左右差調節（右にずらす）")
+    print("  SPACE: モーター停止")
+    print("  B: ブレーキ")
+    print("  X: プログラム終了")
+    print(f"[現在の状態]")
+    print(f"  アクション: {current_action}")
+    print(f"  モーターパワー: {kansei.power}")
+    print(f"  左右バランス: L={kansei.left_balance:.3f}, R={kansei.right_balance:.3f}")
+    print("キー入力待ち...")
+
+def handle_key(kansei, key):
+    """
+    1キー分の操作を行い、新しいアクション名を返す
+    未知のキーなら None（アクションは変更しない）
+    """
+    if key == b'w':
+        return "前進中" if kansei.forward() else "障害物のため停止"
+    elif key == b's':
+        kansei.backward()
+        return "後進中"
+    elif key == b'q':
+        return "左カーブ旋回中" if kansei.turn('left', CURVE_TURN_POWER_RATIO, CURVE_TURN_RATE) else "障害物のため停止"
+    elif key == b'e':
+        return "右カーブ旋回中" if kansei.turn('right', CURVE_TURN_POWER_RATIO, CURVE_TURN_RATE) else "障害物のため停止"
+    elif key == b'a':
+        kansei.turn('left', SPIN_TURN_POWER_RATIO, SPIN_TURN_RATE)
+        return "左信地旋回中"
+    elif key == b'd':
+        kansei.turn('right', SPIN_TURN_POWER_RATIO, SPIN_TURN_RATE)
+        return "右信地旋回中"
+    elif key == b'k':
+        kansei.stop()
+        kansei.adjust_power(POWER_ADJUST_STEP)
+        return "パワー増加"
+    elif key == b'l':
+        kansei.stop()
+        kansei.adjust_power(-POWER_ADJUST_STEP)
+        return "パワー減少"
+    elif key == b',':
+        kansei.stop()
+        kansei.adjust_balance('left')
+        return "バランス調整（左）"
+    elif key == b'.':
+        kansei.stop()
+        kansei.adjust_balance('right')
+        return "バランス調整（右）"
+    elif key == b' ':
+        kansei.stop()
+        return "停止中"
+    elif key == b'b':
+        kansei.brake()
+        return "ブレーキ中"
+    return None
+
 def main():
     """メインの処理ループ"""
     pi_instance = pigpio.pi()
@@ -174,91 +332,49 @@ def main():
         print("pigpioデーモンに接続できません。sudo pigpiod を実行してください。")
         return
 
-    kansei = motor_pawer_control(pi_instance)
-    getch = _Getch()
+    # 指令の急変を避けるため、ランプを専用スレッドで一定周期更新する
+    ramp = motor_ramp.RampEngine(pi_instance, {
+        "left": (LEFT_MOTOR_PIN1, LEFT_MOTOR_PIN2),
+        "right": (RIGHT_MOTOR_PIN1, RIGHT_MOTOR_PIN2),
+    })
+    # 前進・カーブ旋回の前に、進む先が空いているかを障害物マップで確認する
+    mapping = start_obstacle_map(ramp)
+    kansei = motor_pawer_control(pi_instance, obstacle_map=mapping[0] if mapping else None, ramp=ramp)
+    # ピンの PWM 設定（motor_pawer_control の初期化）が済んでからランプを回し始める
+    ramp.start_thread()
 
-    current_action = "停止中" # 初期状態
+    state = {"action": "停止中"} # 初期状態
+    # キー入力は待たずに確認し、一定周期のタスクとして回す（sleep で周期がずれない）
+    key_loop = Scheduler()
 
     try:
-        while True:
-            # 画面クリア
-            os.system('cls' if os.name == 'nt' else 'clear')
-
-            # 操作説明と現在の状態を表示
-            print("--- CanSat ラジコン操作プログラム ---")
-            print("[操作キー]")
-            print("  W: 前進         S: 後進")
-            print("  A: 左信地旋回   D: 右信地旋回")
-            print("  Q: 左カーブ旋回 E: 右カーブ旋回")
-            print("  K: モーターパワー増加")
-            print("  L: モーターパワー減少")
-            print("  ,: モーター左右差調節（左にずらす）")
-            print("  .: モーター左右差調節（右にずらす）")
-            print("  SPACE: モーター停止")
-            print("  B: ブレーキ")
-            print("  X: プログラム終了")
-            print(f"[現在の状態]")
-            print(f"  アクション: {current_action}")
-            print(f"  モーターパワー: {kansei.power}")
-            print(f"  左右バランス: L={kansei.left_balance:.3f}, R={kansei.right_balance:.3f}")
-            print("キー入力待ち...")
-
-            key = getch()
-
-            if key == b'w':
-                kansei.forward()
-                current_action = "前進中"
-            elif key == b's':
-                kansei.backward()
-                current_action = "後進中"
-            elif key == b'q':
-                kansei.turn('left', CURVE_TURN_POWER_RATIO, CURVE_TURN_RATE)
-                current_action = "左カーブ旋回中"
-            elif key == b'e':
-                kansei.turn('right', CURVE_TURN_POWER_RATIO, CURVE_TURN_RATE)
-                current_action = "右カーブ旋回中"
-            elif key == b'a':
-                kansei.turn('left', SPIN_TURN_POWER_RATIO, SPIN_TURN_RATE)
-                current_action = "左信地旋回中"
-            elif key == b'd':
-                kansei.turn('right', SPIN_TURN_POWER_RATIO, SPIN_TURN_RATE)
-                current_action = "右信地旋回中"
-            elif key == b'k':
-                kansei.stop()
-                kansei.adjust_power(POWER_ADJUST_STEP)
-                current_action = "パワー増加"
-            elif key == b'l':
-                kansei.stop()
-                kansei.adjust_power(-POWER_ADJUST_STEP)
-                current_action = "パワー減少"
-            elif key == b',':
-                kansei.stop()
-                kansei.adjust_balance('left')
-                current_action = "バランス調整（左）"
-            elif key == b'.':
-                kansei.stop()
-                kansei.adjust_balance('right')
-                current_action = "バランス調整（右）"
-            elif key == b' ':
-                kansei.stop()
-                current_action = "停止中"
-            elif key == b'b':
-                kansei.brake()
-                current_action = "ブレーキ中"
-            elif key == b'x':
-                print("プログラムを終了します。")
-                break
-            else:
-                # 未知のキーが押された場合、アクションは変更しない
-                pass
-            
-            # CPU負荷軽減
-            time.sleep(0.01)
+        with _KeyPoller() as poll_key:
+            def key_task():
+                key = poll_key()
+                if key is None:
+                    return
+                if key == b'x':
+                    print("プログラムを終了します。")
+                    key_loop.stop()
+                    return
+                action = handle_key(kansei, key)
+                if action is not None:
+                    state["action"] = action
+                show_screen(kansei, state["action"])
+
+            show_screen(kansei, state["action"])
+            key_loop.add_task("keys", KEY_POLL_RATE, key_task)
+            key_loop.run()
 
     finally:
         # プログラム終了時に必ずモーターを停止
         if 'kansei' in locals():
-            kansei.stop()
+            kansei.stop_now()
+        if 'ramp' in locals():
+            ramp.stop_thread()
+        if locals().get('mapping'):
+            mapping[1].stop()
+            mapping[2].join(timeout=1.0)
         if 'pi_instance' in locals() and pi_instance.connected:
             pi_instance.stop()
         print("クリーンアップ完了")
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+I2C センサーのヘルスモニタと自動復旧
+ - デバイスごとにエラー率・連続エラー数・応答時間を記録する
+ - エラーが続くデバイスはジッタ付きの指数バックオフで休ませる（その間は即 DeviceBackoff）
+ - 連続エラーが一定数を超えたら再初期化（GPS の begin()、BNO055 のモード再設定など）
+ - それでもだめならバスクリア（SDA が LOW に張り付いていれば SCL を最大 9 回叩いて STOP を出す）
+ - snapshot() / report() で状態を公開（テレメトリやログ用）
+ - FaultInjectingBus で任意の SMBus 互換オブジェクトにエラーを注入して動作確認できる
+"""
+
+import collections
+import errno
+import random
+import sys
+import time
+
+# ===== 設定 =====
+BACKOFF_BASE = 0.05         # 最初のバックオフ (s)
+BACKOFF_MAX = 5.0           # バックオフの上限 (s)
+REINIT_AFTER = 3            # デバイスの連続エラーがこの回数でデバイスを再初期化
+BUS_CLEAR_AFTER = 6         # バス全体の連続エラーがこの回数でバスクリア
+ERROR_WINDOW = 50           # エラー率の計算に使う直近の呼び出し数
+I2C_SDA_PIN = 2             # I2C1 の SDA (BCM)
+I2C_SCL_PIN = 3             # I2C1 の SCL (BCM)
+# pigpio のピンモード（pigpio.INPUT / OUTPUT / ALT0 と同じ値）
+PI_INPUT = 0
+PI_OUTPUT = 1
+PI_ALT0 = 4
+# ==================
+
+# バスが固まっているときに出やすい errno
+BUS_STUCK_ERRNOS = {errno.EIO, errno.ETIMEDOUT, errno.EAGAIN, getattr(errno, "EREMOTEIO", 121)}
+
+
+class DeviceBackoff(OSError):
+    """バックオフ中のため呼び出さなかった（既存の except OSError でそのまま扱える）"""
+
+
+class DeviceHealth:
+    """1デバイス分の健康状態"""
+    def __init__(self, name, addr, reinit=None):
+        self.name = name
+        self.addr = addr
+        self.reinit = reinit
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.reinits = 0
+        self.bus_clears = 0
+        self.skipped = 0
+        self.latency_avg = 0.0
+        self.latency_max = 0.0
+        self.last_error = None
+        self.last_ok_time = None
+        self.retry_at = 0.0
+        self.history = collections.deque(maxlen=ERROR_WINDOW)
+
+    def error_rate(self):
+        if not self.history:
+            return 0.0
+        return 1.0 - sum(self.history) / len(self.history)
+
+    def state(self, now):
+        if self.consecutive_errors == 0:
+            return "ok"
+        if now < self.retry_at:
+            return "backoff"
+        return "degraded"
+
+    def snapshot(self, now):
+        return {
+            "name": self.name,
+            "addr": self.addr,
+            "state": self.state(now),
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate(), 3),
+            "consecutive_errors": self.consecutive_errors,
+            "latency_avg_ms": round(self.latency_avg * 1e3, 3),
+            "latency_max_ms": round(self.latency_max * 1e3, 3),
+            "reinits": self.reinits,
+            "bus_clears": self.bus_clears,
+            "skipped": self.skipped,
+            "last_error": self.last_error,
+        }
+
+
+class BusSupervisor:
+    """
+    共有 I2C バス上のデバイス呼び出しを見張る
+    例:
+        sup = BusSupervisor(bus_clear=lambda: bus_clear_pigpio(pi))
+        sup.register("gps", 0x10, reinit=gps.begin)
+        data = sup.call("gps", read_i2c_bytes, bus, 0x10, 128)
+    """
+    def __init__(self, bus_clear=None, reopen=None, publish=None,
+                 clock=time.monotonic, rng=None):
+        """
+        :param bus_clear: バスクリアを行う関数（SDA が解放されたら True を返す）
+        :param reopen: バスクリア後に SMBus を開き直す関数
+        :param publish: 状態が変わったときに snapshot() の結果を渡す関数
+        """
+        self.devices = {}
+        self.bus_clear = bus_clear
+        self.reopen = reopen
+        self.publish = publish
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.bus_clears = 0
+        self.bus_consecutive_errors = 0   # デバイスを問わない連続エラー数（張り付き検出用）
+
+    def register(self, name, addr=None, reinit=None):
+        self.devices[name] = DeviceHealth(name, addr, reinit)
+        return self.devices[name]
+
+    def call(self, name, func, *args, **kwargs):
+        """
+        func(*args) をデバイス name の呼び出しとして実行する
+        OSError はそのまま上に投げる（記録とバックオフ・復旧はここで行う）
+        """
+        dev = self.devices[name]
+        now = self.clock()
+        if now < dev.retry_at:
+            dev.skipped += 1
+            raise DeviceBackoff(errno.EAGAIN, f"{name} はバックオフ中です（残り {dev.retry_at - now:.2f}s）")
+
+        dev.calls += 1
+        start = self.clock()
+        try:
+            result = func(*args, **kwargs)
+        except OSError as e:
+            self._on_error(dev, e)
+            raise
+        latency = self.clock() - start
+        was_failing = dev.consecutive_errors > 0
+        dev.history.append(1)
+        dev.consecutive_errors = 0
+        self.bus_consecutive_errors = 0
+        dev.retry_at = 0.0
+        dev.last_ok_time = self.clock()
+        dev.latency_avg += 0.1 * (latency - dev.latency_avg)
+        dev.latency_max = max(dev.latency_max, latency)
+        if was_failing:
+            self._publish()
+        return result
+
+    def backoff_delay(self, consecutive):
+        """指数バックオフ（上限付き）に ±50% のジッタをかける"""
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (consecutive - 1)))
+        return delay * self.rng.uniform(0.5, 1.5)
+
+    def _on_error(self, dev, e):
+        dev.errors += 1
+        dev.consecutive_errors += 1
+        dev.history.append(0)
+        dev.last_error = f"{type(e).__name__}: {e}"
+        dev.retry_at = self.clock() + self.backoff_delay(dev.consecutive_errors)
+        self.bus_consecutive_errors += 1
+
+        # どのデバイスも通らない状態が続き、バス異常らしい errno ならバスクリア
+        if (self.bus_consecutive_errors >= BUS_CLEAR_AFTER
+                and getattr(e, "errno", None) in BUS_STUCK_ERRNOS):
+            self.bus_consecutive_errors = 0
+            if self.clear_bus(dev):
+                # バスが戻ったので各デバイスのバックオフを解除してすぐ試す
+                for d in self.devices.values():
+                    d.retry_at = 0.0
+        if dev.consecutive_errors % REINIT_AFTER == 0:
+            self.reinit(dev)
+        self._publish()
+
+    def reinit(self, dev):
+        """デバイスの再初期化（失敗しても例外は外に出さない）"""
+        if dev.reinit is None:
+            return False
+        dev.reinits += 1
+        try:
+            dev.reinit()
+        except Exception as e:
+            print(f"{dev.name} の再初期化に失敗:", e, file=sys.stderr)
+            return False
+        print(f"{dev.name} を再初期化しました", file=sys.stderr)
+        return True
+
+    def clear_bus(self, dev=None):
+        """バスクリアと SMBus の開き直し"""
+        if self.bus_clear is None:
+            return False
+        self.bus_clears += 1
+        if dev is not None:
+            dev.bus_clears += 1
+        try:
+            released = self.bus_clear()
+            if self.reopen is not None:
+                self.reopen()
+        except Exception as e:
+            print("バスクリアに失敗:", e, file=sys.stderr)
+            return False
+        print("I2C バスクリア:", "SDA 解放" if released else "SDA が LOW のまま", file=sys.stderr)
+        return released
+
+    def snapshot(self):
+        now = self.clock()
+        return {name: dev.snapshot(now) for name, dev in self.devices.items()}
+
+    def _publish(self):
+        if self.publish is not None:
+            self.publish(self.snapshot())
+
+    def report(self):
+        lines = []
+        for s in self.snapshot().values():
+            lines.append(
+                f"[{s['name']}] 状態:{s['state']} 呼び出し:{s['calls']} エラー率:{s['error_rate']:.1%} "
+                f"連続エラー:{s['consecutive_errors']} 応答:{s['latency_avg_ms']:.2f}ms(最大 {s['latency_max_ms']:.2f}ms) "
+                f"再初期化:{s['reinits']} バスクリア:{s['bus_clears']} スキップ:{s['skipped']}")
+        return "\n".join(lines)
+
+
+# --- 復旧手順 ---
+def bus_clear_pigpio(pi, sda=I2C_SDA_PIN, scl=I2C_SCL_PIN, half_period=5e-6):
+    """
+    SDA が LOW に張り付いたスレーブを解放する（I2C 仕様の bus clear）
+    SCL を最大 9 回トグルして SDA が HIGH に戻るのを待ち、STOP 条件を出してから ALT0 に戻す
+    :return: SDA が解放されたら True
+    """
+    try:
+        pi.set_mode(sda, PI_INPUT)
+        pi.set_mode(scl, PI_OUTPUT)
+        pi.write(scl, 1)
+        time.sleep(half_period)
+        for _ in range(9):
+            if pi.read(sda):
+                break
+            pi.write(scl, 0)
+            time.sleep(half_period)
+            pi.write(scl, 1)
+            time.sleep(half_period)
+        released = bool(pi.read(sda))
+        # STOP 条件: SCL HIGH の間に SDA を LOW → HIGH
+        pi.set_mode(sda, PI_OUTPUT)
+        pi.write(sda, 0)
+        time.sleep(half_period)
+        pi.write(scl, 1)
+        time.sleep(half_period)
+        pi.write(sda, 1)
+        time.sleep(half_period)
+    finally:
+        pi.set_mode(sda, PI_ALT0)
+        pi.set_mode(scl, PI_ALT0)
+    return released
+
+
+def reinit_bno055(sensor, run_mode=0x0C):
+    """BNO055 を CONFIG → 動作モードに入れ直す（adafruit_bno055 の sensor）"""
+    sensor.mode = 0x00
+    time.sleep(0.025)
+    sensor.mode = run_mode
+
+
+# --- 故障注入 ---
+class FaultInjectingBus:
+    """
+    SMBus 互換オブジェクトを包んでエラーを注入する（動作確認・テスト用）
+    :param error_rate: 各呼び出しが OSError になる確率
+    :param stuck_after: この回数の呼び出し後に SDA 張り付き状態にする（None で無効）
+    張り付き中は release() かバスクリアが呼ばれるまで全呼び出しが EREMOTEIO になる
+    """
+    def __init__(self, bus, error_rate=0.0, stuck_after=None, seed=0):
+        self.bus = bus
+        self.error_rate = error_rate
+        self.stuck_after = stuck_after
+        self.rng = random.Random(seed)
+        self.count = 0
+        self.stuck = False
+        self.injected = 0
+
+    def release(self):
+        """SDA 張り付きを解除する（bus_clear の代わりに渡せる）"""
+        self.stuck = False
+        self.stuck_after = None
+        return True
+
+    def __getattr__(self, name):
+        target = getattr(self.bus, name)
+        if not callable(target):
+            return target
+
+        def wrapper(*args, **kwargs):
+            self.count += 1
+            if self.stuck_after is not None and self.count >= self.stuck_after:
+                self.stuck = True
+            if self.stuck:
+                self.injected += 1
+                raise OSError(getattr(errno, "EREMOTEIO", 121), "Remote I/O error (SDA stuck)")
+            if self.rng.random() < self.error_rate:
+                self.injected += 1
+                raise OSError(errno.EIO, "Input/output error (injected)")
+            return target(*args, **kwargs)
+        return wrapper
+
+
+def main():
+    class NullBus:
+        def read_i2c_block_data(self, addr, reg, length):
+            return [0] * length
+
+    # 仮想時計で 60 秒分（10ms ごとに交互に読む）を流す
+    now = [0.0]
+    bus = FaultInjectingBus(NullBus(), error_rate=0.05, stuck_after=1500, seed=1)
+    sup = BusSupervisor(bus_clear=bus.release, clock=lambda: now[0], rng=random.Random(0))
+    reinit_log = []
+    sup.register("gps", 0x10, reinit=lambda: reinit_log.append("gps"))
+    sup.register("bno055", 0x28, reinit=lambda: reinit_log.append("bno055"))
+
+    ok = failed = skipped = 0
+    for i in range(6000):
+        name, addr = ("gps", 0x10) if i % 2 else ("bno055", 0x28)
+        try:
+            sup.call(name, bus.read_i2c_block_data, addr, 0, 8)
+            ok += 1
+        except DeviceBackoff:
+            skipped += 1
+        except OSError:
+            failed += 1
+        now[0] += 0.01
+    print(f"成功 {ok} / 失敗 {failed} / バックオフで省略 {skipped}")
+    print(f"注入したエラー: {bus.injected}, 再初期化: gps {reinit_log.count('gps')} 回, "
+          f"bno055 {reinit_log.count('bno055')} 回, バスクリア: {sup.bus_clears} 回")
+    print(sup.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
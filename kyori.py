@@ -1,18 +1,26 @@
 import RPi.GPIO as GPIO
+import sys
 import time
+import timebase
+from scheduler import Scheduler
 
 #測定環境温度
 TEMP = 20
 
-#GPIO設定
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
+#エコー待ちの上限 (s)。超えたら測定失敗（配線の外れやトリガの取りこぼしで止まらないように）
+ECHO_TIMEOUT = 0.04
 
-GPIO.setup(17, GPIO.OUT)
-GPIO.setup(27, GPIO.IN)
+#GPIO設定（import しただけではピンに触らない）
+def setup():
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
 
-#繰り返し
-while True:
+    GPIO.setup(17, GPIO.OUT)
+    GPIO.setup(27, GPIO.IN)
+
+#距離測定（1回分）。(時刻, 距離 cm) を返す。時刻はエコーの中央（timebase.now() の時間軸）
+#エコーが ECHO_TIMEOUT 以内に来ない・終わらないときは (None, None) を返す
+def measure_stamped():
     
     #トリガ信号出力
     GPIO.output(17, GPIO.HIGH)
@@ -21,20 +29,42 @@ while True:
     GPIO.output(17, GPIO.LOW)
     
     #返送HIGHレベル時間計測
+    deadline = time.monotonic() + ECHO_TIMEOUT
+    soff = timebase.now()
     while GPIO.input(27) == GPIO.LOW:
-        soff = time.time()    #LOWレベル終了時刻
+        soff = timebase.now()    #LOWレベル終了時刻
+        if time.monotonic() > deadline:
+            return None, None
     
+    deadline = time.monotonic() + ECHO_TIMEOUT
+    son = timebase.now()
     while GPIO.input(27) == GPIO.HIGH:
-        son = time.time()    #HIGHレベル終了時刻
+        son = timebase.now()    #HIGHレベル終了時刻
+        if time.monotonic() > deadline:
+            return None, None
     
     #HIGHレベル期間の計算
     clc = son - soff
     
     #時間から距離に変換(TEMPは測定環境温度)
     clc = clc * (331.50 + (0.6 * TEMP)) / 2 * 100
-    
-    #画面に表示
-    print(str(clc))
-    
-    #一時停止
-    time.sleep(0.1)
\ No newline at end of file
+    return 0.5 * (soff + son), clc
+
+#距離測定（1回分）。距離 cm だけを返す（測定失敗なら None）
+def measure():
+    return measure_stamped()[1]
+
+#測定して画面に表示
+def print_distance():
+    print(str(measure()))
+
+#繰り返し（0.1秒周期。処理時間ぶん周期がずれないよう絶対時刻で待つ）
+def main():
+    setup()
+    scheduler = Scheduler()
+    scheduler.add_task("kyori", 10.0, print_distance)
+    scheduler.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
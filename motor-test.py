@@ -11,12 +11,13 @@ MOTOR_A_IN2 = 23  # GPIO23
 MOTOR_B_IN1 = 24  # GPIO24
 MOTOR_B_IN2 = 25  # GPIO25
 
-# GPIOモードの設定
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(MOTOR_A_IN1, GPIO.OUT)
-GPIO.setup(MOTOR_A_IN2, GPIO.OUT)
-GPIO.setup(MOTOR_B_IN1, GPIO.OUT)
-GPIO.setup(MOTOR_B_IN2, GPIO.OUT)
+# GPIOモードの設定（import しただけではピンに触らない）
+def setup():
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(MOTOR_A_IN1, GPIO.OUT)
+    GPIO.setup(MOTOR_A_IN2, GPIO.OUT)
+    GPIO.setup(MOTOR_B_IN1, GPIO.OUT)
+    GPIO.setup(MOTOR_B_IN2, GPIO.OUT)
 
 # モーター制御関数
 # ------------------------------------------------
@@ -64,42 +65,47 @@ def turn_right():
 
 # メインの実行部分
 # ------------------------------------------------
-try:
-    print("モーターの動作テストを開始します。")
-
-    # 前進
-    forward()
-    time.sleep(2)  # 2秒間動作
-
-    # 停止
-    stop()
-    time.sleep(1)  # 1秒間停止
-
-    # 後退
-    backward()
-    time.sleep(2)  # 2秒間動作
-
-    # 停止
-    stop()
-    time.sleep(1)
-
-    # 左回転
-    turn_left()
-    time.sleep(2)
-
-    # 停止
-    stop()
-    time.sleep(1)
-
-    # 右回転
-    turn_right()
-    time.sleep(2)
-
-    # 停止
-    stop()
-    time.sleep(1)
+def main():
+    setup()
+    try:
+        print("モーターの動作テストを開始します。")
+
+        # 前進
+        forward()
+        time.sleep(2)  # 2秒間動作
+
+        # 停止
+        stop()
+        time.sleep(1)  # 1秒間停止
+
+        # 後退
+        backward()
+        time.sleep(2)  # 2秒間動作
+
+        # 停止
+        stop()
+        time.sleep(1)
+
+        # 左回転
+        turn_left()
+        time.sleep(2)
+
+        # 停止
+        stop()
+        time.sleep(1)
+
+        # 右回転
+        turn_right()
+        time.sleep(2)
+
+        # 停止
+        stop()
+        time.sleep(1)
     
-finally:
-    # 終了処理: GPIO設定をリセット
-    GPIO.cleanup()
-    print("プログラムを終了し、GPIOをクリーンアップしました。")
\ No newline at end of file
+    finally:
+        # 終了処理: GPIO設定をリセット
+        GPIO.cleanup()
+        print("プログラムを終了し、GPIOをクリーンアップしました。")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+モーター指令のスルーレート制限（ランプ）
+ - forward() / backward() / turn() の指令を「目標値」とし、一定周期で少しずつ近づける
+   （0 → 80% の急変や、前進 → 後進の全開反転による電流スパイクでラズパイが落ちるのを防ぐ）
+ - 台形プロファイル（デューティの変化速度を制限）と S 字プロファイル（変化速度の変化も制限）
+ - 回転方向の反転は必ず 0 を通り、0 で少し待ってから逆転する
+ - 呼び出し側はブロックしない（set_target は値を置くだけ。scheduler.py のタスクで step する）
+ - python3 motor_ramp.py で記録用の偽 pigpio と仮想時計でデューティ列を表示し、スルーレートと反転時の 0 待ちを検査
+"""
+
+import math
+import sys
+import threading
+
+from scheduler import MonotonicClock, Scheduler, VirtualClock
+
+# ===== 設定 =====
+RAMP_RATE = 50.0        # ランプ更新の周期 (Hz)
+SLEW_RATE = 200.0       # デューティの最大変化速度 (%/s) → 0 から 80% まで 0.4 秒
+JERK = 1500.0           # S 字プロファイルでの変化速度の最大変化 (%/s^2)
+ZERO_DWELL = 0.1        # 反転時に 0 で待つ時間 (s)
+# ==================
+
+
+class RampChannel:
+    """
+    1つのモーター（正転ピン・逆転ピンの組）
+    duty は符号付き（正: 正転, 負: 逆転）で -100〜100
+    """
+    def __init__(self, pi, pin_fwd, pin_rev, slew_rate, jerk=None, zero_dwell=ZERO_DWELL):
+        self.pi = pi
+        self.pin_fwd = pin_fwd
+        self.pin_rev = pin_rev
+        self.slew_rate = slew_rate
+        self.jerk = jerk            # None なら台形プロファイル
+        self.zero_dwell = zero_dwell
+        self.target = 0.0
+        self.duty = 0.0
+        self.rate = 0.0             # 現在の変化速度 (%/s)（S 字用）
+        self.dwell_left = 0.0
+        self.braking = False
+        self._written = None
+
+    def set_target(self, duty):
+        self.target = max(-100.0, min(100.0, float(duty)))
+        self.braking = False
+
+    def at_target(self):
+        return self.duty == self.target and self.dwell_left <= 0
+
+    def step(self, dt):
+        """dt 秒だけ目標へ近づけ、値が変わったらピンへ書き込む"""
+        if self.braking:
+            return
+        if self.dwell_left > 0:
+            self.dwell_left -= dt
+            return
+
+        # 符号が逆の目標へは、まず 0 を目指す
+        goal = 0.0 if self.duty * self.target < 0 else self.target
+        err = goal - self.duty
+        if err == 0:
+            self.rate = 0.0
+        elif self.jerk is None:
+            step = self.slew_rate * dt
+            self.duty = goal if abs(err) <= step else self.duty + math.copysign(step, err)
+        else:
+            # 止まりきれる速度（v^2 / 2j <= 残り距離）を上限に、変化速度を jerk で増減する
+            v_des = math.copysign(min(self.slew_rate, math.sqrt(2.0 * self.jerk * abs(err))), err)
+            dv = self.jerk * dt
+            self.rate += max(-dv, min(dv, v_des - self.rate))
+            new = self.duty + self.rate * dt
+            if (goal - new) * err <= 0:
+                new = goal
+                self.rate = 0.0
+            self.duty = new
+
+        if goal == 0.0 and self.duty == 0.0 and self.target != 0.0:
+            self.dwell_left = self.zero_dwell
+            self.rate = 0.0
+        self._write()
+
+    def _write(self, force=False):
+        d = int(round(self.duty))
+        if d == self._written and not force:
+            return
+        # 逆側のピンは向きが変わったときだけ 0 にする（pigpio への書き込み回数を減らす）
+        if d >= 0:
+            if force or self._written is None or self._written < 0:
+                self.pi.set_PWM_dutycycle(self.pin_rev, 0)
+            self.pi.set_PWM_dutycycle(self.pin_fwd, d)
+        else:
+            if force or self._written is None or self._written > 0:
+                self.pi.set_PWM_dutycycle(self.pin_fwd, 0)
+            self.pi.set_PWM_dutycycle(self.pin_rev, -d)
+        self._written = d
+
+    def stop_now(self):
+        """ランプを無視して即停止（終了処理・非常停止用）"""
+        self.target = self.duty = self.rate = 0.0
+        self.dwell_left = 0.0
+        self.braking = False
+        self._write(force=True)
+
+    def brake(self, level):
+        """両ピンを level にしてブレーキ（ランプ処理は止める）"""
+        self.target = self.duty = self.rate = 0.0
+        self.braking = True
+        self._written = None
+        self.pi.set_PWM_dutycycle(self.pin_fwd, level)
+        self.pi.set_PWM_dutycycle(self.pin_rev, level)
+
+
+class RampEngine:
+    """
+    左右モーターのランプをまとめて動かす
+    例:
+        ramp = RampEngine(pi, {"left": (12, 13), "right": (18, 19)})
+        ramp.attach(scheduler)          # scheduler.py のタスクとして周期実行
+        ramp.set_targets(left=80, right=80)
+    """
+    def __init__(self, pi, pins, slew_rate=SLEW_RATE, jerk=None, zero_dwell=ZERO_DWELL):
+        self.channels = {name: RampChannel(pi, fwd, rev, slew_rate, jerk, zero_dwell)
+                         for name, (fwd, rev) in pins.items()}
+        self.period = 1.0 / RAMP_RATE
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self._thread = None
+
+    def set_target(self, name, duty):
+        with self._lock:
+            self.channels[name].set_target(duty)
+
+    def set_targets(self, **duties):
+        with self._lock:
+            for name, duty in duties.items():
+                self.channels[name].set_target(duty)
+
+    def targets(self):
+        return {name: ch.target for name, ch in self.channels.items()}
+
+    def duties(self):
+        return {name: ch.duty for name, ch in self.channels.items()}
+
+    def at_target(self):
+        return all(ch.at_target() for ch in self.channels.values())
+
+    def step(self, dt=None):
+        with self._lock:
+            for ch in self.channels.values():
+                ch.step(self.period if dt is None else dt)
+
+    def stop_now(self):
+        with self._lock:
+            for ch in self.channels.values():
+                ch.stop_now()
+
+    def brake(self, level):
+        with self._lock:
+            for ch in self.channels.values():
+                ch.brake(level)
+
+    # --- 周期実行 ---
+    def attach(self, scheduler, rate=RAMP_RATE, priority=0):
+        """既存のスケジューラにランプ更新タスクを追加する"""
+        self.period = 1.0 / rate
+        scheduler.add_task("motor_ramp", rate, self.step, priority=priority)
+
+    def start_thread(self, rate=RAMP_RATE):
+        """
+        専用スレッドでランプを回す（キー入力待ちでブロックするループから使う用）
+        pigpio のコマンド送信はロックで保護されているので別スレッドから呼んでよい
+        """
+        self._scheduler = Scheduler(MonotonicClock())
+        self.attach(self._scheduler, rate)
+        self._thread = threading.Thread(target=self._scheduler.run, name="motor_ramp", daemon=True)
+        self._thread.start()
+
+    def stop_thread(self):
+        if self._scheduler is not None:
+            self._scheduler.stop()
+            self._thread.join(timeout=1.0)
+            self._scheduler = None
+            self._thread = None
+
+
+class RecordingPi:
+    """pigpio.pi の代わりに set_PWM_dutycycle の呼び出しを記録する（動作確認・テスト用）"""
+    def __init__(self, clock=None):
+        self.clock = clock
+        self.duty = {}
+        self.log = []
+
+    def set_PWM_dutycycle(self, pin, duty):
+        self.duty[pin] = int(duty)
+        t = self.clock.monotonic() if self.clock is not None else None
+        self.log.append((t, pin, int(duty)))
+
+
+def check_log(log, pin_fwd, pin_rev, slew_rate=SLEW_RATE, zero_dwell=ZERO_DWELL, period=1.0 / RAMP_RATE):
+    """
+    RecordingPi.log（仮想時計つき）から1つのモーターの書き込みを検査する
+     - 正転ピンと逆転ピンが同時に 0 でない瞬間が無い
+     - 符号付きデューティの変化が slew_rate を超えない（整数への丸めぶんの 1 は許す）
+     - 回転方向の反転では 0 で zero_dwell 以上とどまる
+    最初の書き込みは、その1周期（period）前に 0 だったものとして調べる
+    :return: 違反の説明のリスト（空なら合格）
+    """
+    levels = {pin_fwd: 0, pin_rev: 0}
+    timeline = []   # (時刻, 符号付きデューティ)
+    errors = []
+    for t, pin, duty in log:
+        if pin not in levels:
+            continue
+        levels[pin] = duty
+        if levels[pin_fwd] and levels[pin_rev]:
+            errors.append(f"t={t:.3f}s 両方のピンが 0 でない（{levels[pin_fwd]}, {levels[pin_rev]}）")
+        d = levels[pin_fwd] - levels[pin_rev]
+        if timeline and timeline[-1][0] == t:
+            timeline[-1] = (t, d)
+        else:
+            timeline.append((t, d))
+
+    zero_since = None
+    last_sign = 0
+    for (t0, d0), (t1, d1) in zip([(timeline[0][0] - period, 0)] + timeline, timeline):
+        # 値が変わらない間は書き込まないので、前の書き込みとの間が空いていても変化は1周期の間に起きている
+        dt = min(t1 - t0, period)
+        if abs(d1 - d0) > slew_rate * dt + 1:
+            errors.append(f"t={t1:.3f}s 変化が速すぎる（{d0} → {d1} を {dt:.3f}s）")
+        if d1 == 0:
+            if zero_since is None:
+                zero_since = t1
+            continue
+        sign = 1 if d1 > 0 else -1
+        if last_sign and sign != last_sign:
+            if zero_since is None:
+                errors.append(f"t={t1:.3f}s 0 を通らずに反転")
+            elif t1 - zero_since < zero_dwell - 1e-9:
+                errors.append(f"t={t1:.3f}s 0 での待ちが短い（{t1 - zero_since:.3f}s）")
+        last_sign = sign
+        zero_since = None
+    return errors
+
+
+def main():
+    failed = False
+    for label, jerk in (("台形", None), ("S 字", JERK)):
+        clock = VirtualClock()
+        pi = RecordingPi(clock)
+        ramp = RampEngine(pi, {"left": (12, 13)}, jerk=jerk)
+        sched = Scheduler(clock)
+        ramp.attach(sched)
+        seq = []
+        for t in range(50):
+            if t == 0:
+                ramp.set_targets(left=80)
+            elif t == 15:
+                ramp.set_targets(left=-80)   # 全開反転
+            sched.run(duration=0.04)
+            seq.append(pi.duty.get(12, 0) - pi.duty.get(13, 0))
+        print(f"[{label}] 左モーターの符号付きデューティ（0.04 秒ごと、0.6 秒で反転指令）:")
+        print("  ", seq)
+        print(f"   pigpio 書き込み回数: {len(pi.log)}")
+        errors = check_log(pi.log, 12, 13)
+        print(f"   検査（スルーレート {SLEW_RATE:.0f}%/s・反転時の 0 待ち {ZERO_DWELL}s）:",
+              "OK" if not errors else "NG")
+        for e in errors:
+            print("    ", e)
+        failed |= bool(errors)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
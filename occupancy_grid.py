@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+距離センサー（kyori.py の超音波 / ライダー）によるローカル障害物マップ
+ - ローバー中心の固定サイズ占有格子（NumPy 配列, log-odds）。移動に合わせてスクロール
+ - IMU / オドメトリの姿勢と距離の読みを、ビーム幅ぶんのレイをまとめてベクトル化で書き込む
+ - 「この方位に何 m 進めるか」を調べる is_path_clear() を motor_pawer_control.turn() から使う
+ - python3 occupancy_grid.py で模擬ワールドを走らせて更新時間を表示
+依存: numpy
+
+座標系: x=東, y=北 (m)。方位は北=0、時計回りを正（度）
+"""
+
+import math
+import sys
+import time
+
+import numpy as np
+
+# ===== 設定 =====
+GRID_SIZE = 128             # 1辺のセル数
+RESOLUTION = 0.05           # 1セルの大きさ (m) → 6.4m 四方
+MAX_RANGE = 4.0             # 距離センサーの最大距離 (m)。これ以上は「障害物なし」扱い
+BEAM_WIDTH = 15.0           # 超音波ビームの広がり (度)
+BEAM_RAYS = 7               # ビーム内で打つレイ本数
+L_OCC = 0.85                # 障害物セルの log-odds 加算量
+L_FREE = -0.4               # 空きセルの log-odds 加算量
+L_MIN, L_MAX = -4.0, 4.0    # log-odds の飽和範囲
+OCC_THRESHOLD = 0.6         # これを超える log-odds のセルを障害物とみなす
+ROVER_WIDTH = 0.30          # 通路判定に使う車体幅 (m)
+# ==================
+
+
+class OccupancyGrid:
+    """
+    ローバー中心のスクロール型占有格子
+    grid[iy, ix]（iy が北向き）で、ローバーは常に中央付近のセルにいる
+    """
+    def __init__(self, size=GRID_SIZE, resolution=RESOLUTION, max_range=MAX_RANGE,
+                 beam_width=BEAM_WIDTH, beam_rays=BEAM_RAYS):
+        self.size = size
+        self.resolution = resolution
+        self.max_range = max_range
+        self.grid = np.zeros((size, size), dtype=np.float32)
+        # 格子の左下セル (0, 0) の世界座標（セル単位の整数）
+        self.origin = np.array([-(size // 2), -(size // 2)], dtype=np.int64)
+        self.x = 0.0
+        self.y = 0.0
+        self.yaw = 0.0
+
+        # レイ上のサンプル点（ビーム内の角度 × 距離）を事前計算
+        self._beam = np.radians(np.linspace(-beam_width / 2, beam_width / 2, beam_rays))
+        self._steps = np.arange(0.0, max_range, resolution * 0.5)
+        # 通路判定用の横方向オフセット
+        self._corridor = np.arange(-ROVER_WIDTH / 2, ROVER_WIDTH / 2 + 1e-9, resolution * 0.5)
+
+    # --- 姿勢 ---
+    def update_pose(self, x, y, yaw_deg):
+        """ローバーの姿勢を更新し、1セル以上動いたら格子をスクロールする"""
+        self.x = x
+        self.y = y
+        self.yaw = yaw_deg
+        center = np.floor(np.array([x, y]) / self.resolution).astype(np.int64)
+        shift = center - (self.origin + self.size // 2)
+        if shift.any():
+            self._scroll(int(shift[0]), int(shift[1]))
+
+    def _scroll(self, dx, dy):
+        """格子を (dx, dy) セルずらし、新しく見える帯を未知（0）にする"""
+        n = self.size
+        if abs(dx) >= n or abs(dy) >= n:
+            self.grid.fill(0.0)
+        else:
+            self.grid = np.roll(self.grid, (-dy, -dx), axis=(0, 1))
+            if dx > 0:
+                self.grid[:, n - dx:] = 0.0
+            elif dx < 0:
+                self.grid[:, :-dx] = 0.0
+            if dy > 0:
+                self.grid[n - dy:, :] = 0.0
+            elif dy < 0:
+                self.grid[:-dy, :] = 0.0
+        self.origin += (dx, dy)
+
+    def _to_index(self, xs, ys):
+        """世界座標の配列をセル番号 (ix, iy) と格子内フラグにする"""
+        ix = np.floor(xs / self.resolution).astype(np.int64) - self.origin[0]
+        iy = np.floor(ys / self.resolution).astype(np.int64) - self.origin[1]
+        inside = (ix >= 0) & (ix < self.size) & (iy >= 0) & (iy < self.size)
+        return ix, iy, inside
+
+    # --- 更新 ---
+    def integrate_range(self, distance, sensor_angle=0.0):
+        """
+        距離の読み1回分を書き込む
+        :param distance: 測定距離 (m)。None / NaN / max_range 以上なら障害物なし
+        :param sensor_angle: 車体前方からのセンサー取り付け角 (度, 時計回り正)
+        """
+        hit = distance is not None and math.isfinite(distance) and distance < self.max_range
+        reach = distance if hit else self.max_range
+        if reach <= 0:
+            return
+
+        angles = math.radians(self.yaw + sensor_angle) + self._beam        # (R,)
+        steps = self._steps[self._steps < reach - self.resolution]          # (S,)
+        sin_a = np.sin(angles)[:, None]
+        cos_a = np.cos(angles)[:, None]
+
+        # 空きセル: ビーム内のレイを手前から一括で書き込む（重複セルは1回だけ）
+        ix, iy, inside = self._to_index(self.x + steps * sin_a, self.y + steps * cos_a)
+        free = np.unique(iy[inside] * self.size + ix[inside])
+        self.grid.flat[free] += L_FREE
+
+        if hit:
+            ix, iy, inside = self._to_index(self.x + reach * sin_a[:, 0], self.y + reach * cos_a[:, 0])
+            occ = np.unique(iy[inside] * self.size + ix[inside])
+            self.grid.flat[occ] += L_OCC
+
+        np.clip(self.grid, L_MIN, L_MAX, out=self.grid)
+
+    # --- 問い合わせ ---
+    def is_path_clear(self, heading_deg=None, distance=1.0, width=None):
+        """
+        現在位置から heading_deg 方向へ distance (m) の車体幅の通路に障害物が無いか
+        :param heading_deg: 方位（度）。None なら現在の向き
+        """
+        return self.clear_distance(heading_deg, distance, width) >= distance
+
+    def clear_distance(self, heading_deg=None, distance=None, width=None):
+        """heading_deg 方向に障害物なしで進める距離 (m)。distance まで調べる"""
+        if heading_deg is None:
+            heading_deg = self.yaw
+        if distance is None:
+            distance = self.max_range
+        lateral = self._corridor if width is None else np.arange(
+            -width / 2, width / 2 + 1e-9, self.resolution * 0.5)
+        a = math.radians(heading_deg)
+        s, c = math.sin(a), math.cos(a)
+        along = np.arange(self.resolution, distance + 1e-9, self.resolution * 0.5)
+        # 進行方向 (s, c) と右方向 (c, -s) の格子点
+        xs = self.x + along[:, None] * s + lateral[None, :] * c
+        ys = self.y + along[:, None] * c - lateral[None, :] * s
+        ix, iy, inside = self._to_index(xs, ys)
+        occupied = np.zeros(xs.shape, dtype=bool)
+        occupied[inside] = self.grid[iy[inside], ix[inside]] > OCC_THRESHOLD
+        blocked_rows = np.flatnonzero(occupied.any(axis=1))
+        if blocked_rows.size == 0:
+            return distance
+        return float(along[blocked_rows[0]] - self.resolution)
+
+    def best_heading(self, desired_deg, distance=1.0, span=90.0, step=10.0):
+        """
+        desired_deg に最も近い通れる方位を返す（左右交互に探索）。無ければ None
+        """
+        offsets = [0.0]
+        k = step
+        while k <= span:
+            offsets += [k, -k]
+            k += step
+        for off in offsets:
+            if self.is_path_clear(desired_deg + off, distance):
+                return (desired_deg + off) % 360.0
+        return None
+
+
+# --- 模擬ワールド ---
+class CircleWorld:
+    """円柱の障害物（岩など）が置かれた平面。距離センサーの読みを模擬する"""
+    def __init__(self, obstacles):
+        """:param obstacles: [(x, y, 半径), ...]"""
+        self.obstacles = np.asarray(obstacles, dtype=float).reshape(-1, 3)
+
+    def cast(self, x, y, heading_deg, max_range=MAX_RANGE):
+        """(x, y) から heading_deg 方向に最初に当たる障害物までの距離（無ければ inf）"""
+        if self.obstacles.size == 0:
+            return math.inf
+        a = math.radians(heading_deg)
+        d = np.array([math.sin(a), math.cos(a)])
+        rel = self.obstacles[:, :2] - (x, y)
+        proj = rel @ d
+        perp2 = np.einsum("ij,ij->i", rel, rel) - proj ** 2
+        r2 = self.obstacles[:, 2] ** 2
+        ok = (proj > 0) & (perp2 <= r2)
+        if not ok.any():
+            return math.inf
+        dist = proj[ok] - np.sqrt(r2[ok] - perp2[ok])
+        best = float(dist.min())
+        return best if best <= max_range else math.inf
+
+    def cast_beam(self, x, y, heading_deg, beam_width=BEAM_WIDTH, max_range=MAX_RANGE, rays=7):
+        """超音波はビーム内で最も近い反射を返す"""
+        angles = np.linspace(-beam_width / 2, beam_width / 2, rays) + heading_deg
+        return min(self.cast(x, y, a, max_range) for a in angles)
+
+
+def main():
+    world = CircleWorld([(0.0, 2.0, 0.3), (1.2, 1.0, 0.25), (-1.0, 3.0, 0.4)])
+    og = OccupancyGrid()
+    # その場で首振りしながら前進する
+    n = 0
+    elapsed = 0.0
+    for k in range(200):
+        y = 0.005 * k
+        yaw = 60.0 * math.sin(k / 10.0)
+        d = world.cast_beam(0.0, y, yaw)
+        start = time.perf_counter()
+        og.update_pose(0.0, y, yaw)
+        og.integrate_range(d)
+        elapsed += time.perf_counter() - start
+        n += 1
+    print(f"更新 1 回の平均時間: {elapsed / n * 1e3:.3f} ms")
+    for heading in (0, 30, 60, -30):
+        print(f"方位 {heading:4d} 度: 前方 {og.clear_distance(heading, 3.0):.2f} m 進める")
+    print("北に近い通れる方位:", og.best_heading(0.0, distance=2.0))
+    start = time.perf_counter()
+    for _ in range(100):
+        og.is_path_clear(0.0, 2.0)
+    print(f"通路判定 1 回の平均時間: {(time.perf_counter() - start) * 10:.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+ミッションフェーズごとのセンサー・CPU の省電力制御
+ - フェーズごとのプロファイル（PROFILES）で、タスクの周期・BNO055 の電源モード・GPS の出力周期 / スタンバイ・
+   カメラのオン / オフ・CPU ガバナーを決める
+ - フェーズが変わったら、ドライバを作り直さずにその場で切り替える
+     タスク周期 : scheduler.Scheduler.set_rate（0 で止める）
+     BNO055     : PWR_MODE レジスタ 0x3E（normal=0, low=1, suspend=2）。CONFIG モードで書き換える
+     GPS        : PMTK220（出力周期 ms）/ PMTK161（スタンバイ。何か送ると復帰）
+     CPU        : /sys/devices/system/cpu/cpu*/cpufreq/scaling_governor
+   変わった項目だけ書き込み、切り替えの記録を log に残す
+ - 消費電力の目安表から、フェーズごとの推定消費エネルギーを energy_report() で表示する
+ - python3 power_manager.py で simulator.py の記録付き偽ドライバを相手に一連のフェーズを回して表示
+"""
+
+import glob
+import sys
+import time
+
+# ===== 設定 =====
+# タスク名は scheduler に登録した名前（登録されていないものは無視する）。周期 0 はタスク停止
+# gps は NMEA の出力周期 (Hz)、0 ならスタンバイ（衛星情報を保持したまま待機するのでホットスタートできる）
+PROFILES = {
+    "standby": {      # 放出〜着地判定・分離。着地判定に IMU だけ使う
+        "tasks": {"imu": 10.0, "gps": 0, "ranging": 0, "control": 0, "camera": 0},
+        "bno055": "normal", "gps": 0, "camera": False, "governor": "powersave",
+    },
+    "navigation": {   # GPS 誘導で走行
+        "tasks": {"imu": 50.0, "gps": 10.0, "ranging": 10.0, "control": 20.0, "camera": 0},
+        "bno055": "normal", "gps": 1.0, "camera": False, "governor": "ondemand",
+    },
+    "approach": {     # カメラでコーンへ接近（画像処理のため CPU を上げる）
+        "tasks": {"imu": 50.0, "gps": 5.0, "ranging": 10.0, "control": 20.0, "camera": 2.0},
+        "bno055": "normal", "gps": 1.0, "camera": True, "governor": "performance",
+    },
+    "goal": {         # ゴール後は位置の送信だけ
+        "tasks": {"imu": 0, "gps": 0.5, "ranging": 0, "control": 0, "camera": 0},
+        "bno055": "suspend", "gps": 0.1, "camera": False, "governor": "powersave",
+    },
+}
+
+# 消費電力の目安 (mW)
+CPU_POWER_MW = {"powersave": 600.0, "ondemand": 750.0, "performance": 1000.0}  # Raspberry Pi Zero 2 W 本体
+BNO055_POWER_MW = {"normal": 40.6, "low": 1.3, "suspend": 0.13}   # 3.3V × 12.3mA / 0.4mA / 0.04mA
+GPS_TRACKING_MW = 82.5          # 追尾中（3.3V × 25mA）
+GPS_STANDBY_MW = 0.66           # スタンバイ（3.3V × 0.2mA）
+SONAR_MJ_PER_PING = 4.5         # HC-SR04 1回の測定 (mJ)（5V × 15mA × 60ms）
+CAMERA_POWER_MW = 1200.0        # カメラの連続撮影とビジョンプロセス（有効な間ずっと）
+# GPS タスクは1回に GPS_READ_CHUNK バイトしか読まないので、NMEA の出力量以上に読まないと
+# XA1110 のバッファがあふれて測位を取りこぼす（周期 ≥ 出力周期 × NMEA_BYTES_PER_OUTPUT ÷ GPS_READ_CHUNK）
+NMEA_BYTES_PER_OUTPUT = 500     # 既定の文（GGA/GSA/GSV/RMC/VTG）1回分のバイト数の目安
+GPS_READ_CHUNK = 128            # GPS.READ_CHUNK と同じ値
+# 終了時に戻す設定（goal の suspend / 0.1Hz / powersave のまま次の起動を迎えないように）
+RESTORE_PROFILE = {"bno055": "normal", "gps": 1.0, "governor": "ondemand"}
+# ==================
+
+BNO055_POWER_REGISTER = 0x3E
+BNO055_POWER_MODES = {"normal": 0x00, "low": 0x01, "suspend": 0x02}
+BNO055_CONFIG_MODE = 0x00
+BNO055_NDOF_MODE = 0x0C
+GOVERNOR_PATHS = "/sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_governor"
+
+
+def pmtk(body):
+    """チェックサム付きの PMTK コマンド（バイト列）"""
+    cs = 0
+    for c in body.encode("ascii"):
+        cs ^= c
+    return f"${body}*{cs:02X}\r\n".encode("ascii")
+
+
+# ---------- ドライバごとの切り替え ----------
+# どれも apply(profile) でプロファイルの自分の項目を反映する。前回と同じなら何も書かない
+class Bno055Power:
+    """
+    BNO055 の電源モード（adafruit_bno055 の sensor を渡す）
+    adafruit_bno055 には PWR_MODE を書く公開 API が無いので、既定ではライブラリ内部の
+    sensor._write_register を使う。ライブラリの更新で使えなくなったら write_register(reg, value) を渡す
+    （例: lambda reg, value: bus.write_byte_data(0x28, reg, value)）
+    """
+    key = "bno055"
+
+    def __init__(self, sensor, write_register=None):
+        self.sensor = sensor
+        if write_register is None:
+            write_register = getattr(sensor, "_write_register", None)
+            if write_register is None:
+                raise AttributeError("BNO055 のレジスタに書き込めません。write_register を渡してください")
+        self.write_register = write_register
+        self.state = None
+
+    def apply(self, profile):
+        mode = profile.get(self.key)
+        if mode is None or mode == self.state:
+            return False
+        # 電源モードは CONFIG モードで書き換え、元の動作モードに戻す
+        run_mode = self.sensor.mode
+        if run_mode == BNO055_CONFIG_MODE:
+            run_mode = BNO055_NDOF_MODE
+        self.sensor.mode = BNO055_CONFIG_MODE
+        self.write_register(BNO055_POWER_REGISTER, BNO055_POWER_MODES[mode])
+        self.sensor.mode = run_mode
+        self.state = mode
+        return True
+
+
+class GpsPower:
+    """
+    GPS（MT3333 系）の出力周期とスタンバイ
+    :param write: コマンドのバイト列を GPS へ送る関数（I2C なら over_i2c()、UART なら serial.write）
+    """
+    key = "gps"
+
+    def __init__(self, write):
+        self.write = write
+        self.state = None
+
+    @classmethod
+    def over_i2c(cls, bus, addr=0x10, i2c_msg=None):
+        """smbus2 の bus で XA1110 へ書き込む"""
+        if i2c_msg is None:
+            from smbus2 import i2c_msg
+        return cls(lambda data: bus.i2c_rdwr(i2c_msg.write(addr, data)))
+
+    def apply(self, profile):
+        rate = profile.get(self.key)
+        if rate is None or rate == self.state:
+            return False
+        if rate <= 0:
+            self.write(pmtk("PMTK161,0"))
+        else:
+            if self.state == 0:
+                self.write(b"\r\n")          # スタンバイからの復帰
+            self.write(pmtk(f"PMTK220,{int(round(1000.0 / rate))}"))
+        self.state = rate
+        return True
+
+
+class CameraPower:
+    """
+    カメラのオン / オフ
+    撮影は別プロセスで続けているので、on_change(enabled) でそのプロセスを起動・停止する
+    scheduler の camera タスクは検出結果を読むだけで、周期 0 で止まる
+    """
+    key = "camera"
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self.state = None
+
+    @property
+    def enabled(self):
+        return bool(self.state)
+
+    def apply(self, profile):
+        enabled = profile.get(self.key)
+        if enabled is None or enabled == self.state:
+            return False
+        if self.on_change is not None:
+            self.on_change(enabled)
+        self.state = enabled
+        return True
+
+
+class CpuGovernor:
+    """CPU ガバナー（書き込みには root が必要。失敗したら一度だけ警告して続ける）"""
+    key = "governor"
+
+    def __init__(self, paths=None):
+        self.paths = sorted(glob.glob(GOVERNOR_PATHS)) if paths is None else list(paths)
+        self.state = None
+        self._warned = False
+
+    def apply(self, profile):
+        governor = profile.get(self.key)
+        if governor is None or governor == self.state:
+            return False
+        for path in self.paths:
+            try:
+                with open(path, "w") as f:
+                    f.write(governor)
+            except OSError as e:
+                if not self._warned:
+                    print("CPU ガバナーを設定できません（sudo が必要）:", e, file=sys.stderr)
+                    self._warned = True
+        self.state = governor
+        return True
+
+
+# ---------- 全体 ----------
+def min_gps_poll_rate(nmea_hz):
+    """NMEA を nmea_hz [Hz] で出しているときに、取りこぼさないための GPS タスクの最低周期 (Hz)"""
+    return nmea_hz * NMEA_BYTES_PER_OUTPUT / GPS_READ_CHUNK
+
+
+def check_profiles(profiles=PROFILES):
+    """GPS タスクの周期が NMEA の出力量に追いつかないフェーズを [(フェーズ, 周期, 必要な周期), ...] で返す"""
+    short = []
+    for phase, profile in profiles.items():
+        need = min_gps_poll_rate(profile.get("gps", 0))
+        rate = profile.get("tasks", {}).get("gps", 0)
+        if rate < need:
+            short.append((phase, rate, need))
+    return short
+
+
+def estimate_power(profile):
+    """プロファイルで動かしたときの消費電力の目安 (mW) を部品ごとに返す"""
+    tasks = profile.get("tasks", {})
+    gps_rate = profile.get("gps", 0)
+    return {
+        "cpu": CPU_POWER_MW.get(profile.get("governor"), CPU_POWER_MW["ondemand"]),
+        "bno055": BNO055_POWER_MW.get(profile.get("bno055"), 0.0),
+        "gps": GPS_TRACKING_MW if gps_rate > 0 else GPS_STANDBY_MW,
+        "sonar": SONAR_MJ_PER_PING * tasks.get("ranging", 0),
+        "camera": CAMERA_POWER_MW if profile.get("camera") else 0.0,
+    }
+
+
+class PowerManager:
+    """
+    フェーズに合わせてセンサー・CPU の設定を切り替え、消費エネルギーを積算する
+    例:
+        power = PowerManager(scheduler, governor=CpuGovernor())
+        power.attach(Bno055Power(sensor))
+        power.attach(GpsPower.over_i2c(bus))
+        power.enter_phase("navigation")
+        print(power.energy_report())
+        power.restore()                  # 終了時に普段の設定へ戻す
+    """
+    def __init__(self, scheduler=None, profiles=PROFILES, governor=None, clock=time.monotonic):
+        self.scheduler = scheduler
+        self.profiles = profiles
+        self.clock = clock
+        self.drivers = {}
+        self.phase = None
+        self.phase_start = None
+        self.energy = {}       # フェーズ → {部品: mJ}
+        self.durations = {}    # フェーズ → 秒
+        self.log = []          # (時刻, フェーズ, 項目, 値)
+        if governor is not None:
+            self.attach(governor)
+
+    def attach(self, driver):
+        """ドライバを追加し、今のフェーズの設定をすぐ反映する（後から立ち上がったセンサー用）"""
+        self.drivers[driver.key] = driver
+        if self.phase is not None:
+            self._apply_driver(driver, self.profiles[self.phase])
+
+    def _apply_driver(self, driver, profile):
+        try:
+            if driver.apply(profile):
+                self.log.append((self.clock(), self.phase, driver.key, profile.get(driver.key)))
+        except OSError as e:
+            # I2C が一時的に失敗しても他の切り替えは続ける（次のフェーズ変更でまた試す）
+            print(f"{driver.key} の電源設定に失敗しました:", e, file=sys.stderr)
+
+    def enter_phase(self, phase):
+        profile = self.profiles[phase]
+        self._account()
+        self.phase = phase
+        self.apply_tasks()
+        for driver in self.drivers.values():
+            self._apply_driver(driver, profile)
+
+    def apply_tasks(self):
+        """今のフェーズのタスク周期を scheduler に反映する（フェーズに入ってから登録したタスク用）"""
+        if self.scheduler is None or self.phase is None:
+            return
+        for name, rate in self.profiles[self.phase].get("tasks", {}).items():
+            if name in self.scheduler.tasks:
+                task = self.scheduler.tasks[name]
+                if task.enabled and rate > 0 and abs(task.rate - rate) < 1e-9:
+                    continue
+                if not task.enabled and rate <= 0:
+                    continue
+                self.scheduler.set_rate(name, rate)
+                self.log.append((self.clock(), self.phase, f"task:{name}", rate))
+
+    def restore(self, profile=RESTORE_PROFILE):
+        """センサー・CPU を普段の設定に戻す（終了時に呼ぶ。消費エネルギーの積算もここで締める）"""
+        self._account()
+        for driver in self.drivers.values():
+            self._apply_driver(driver, profile)
+
+    def _account(self):
+        """前回からの経過時間ぶんのエネルギーを今のフェーズに積算する"""
+        now = self.clock()
+        if self.phase is not None:
+            dt = now - self.phase_start
+            self.durations[self.phase] = self.durations.get(self.phase, 0.0) + dt
+            total = self.energy.setdefault(self.phase, {})
+            for part, mw in estimate_power(self.profiles[self.phase]).items():
+                total[part] = total.get(part, 0.0) + mw * dt
+        self.phase_start = now
+
+    def energy_report(self):
+        """フェーズごとの推定消費エネルギー（今のフェーズは現在までの分を含む）"""
+        self._account()
+        parts = ("cpu", "bno055", "gps", "sonar", "camera")
+        lines = [f"{'フェーズ':<10} {'時間':>8} {'平均':>9} {'エネルギー':>10}  内訳 (J)"]
+        total_j = 0.0
+        for phase, energy in self.energy.items():
+            t = self.durations[phase]
+            mj = sum(energy.values())
+            total_j += mj / 1000
+            detail = " ".join(f"{p}:{energy.get(p, 0) / 1000:.1f}" for p in parts)
+            avg = mj / t if t > 0 else 0.0
+            lines.append(f"{phase:<12} {t:7.0f}s {avg:7.0f}mW {mj / 1000:9.1f}J  {detail}")
+        lines.append(f"合計 {total_j:.1f}J（{total_j / 3.6:.1f}mWh）")
+        return "\n".join(lines)
+
+
+def main():
+    # simulator.py の偽ドライバ（BNO055 レジスタモデル・NMEA GPS）を相手に、フェーズを順に回す
+    import os
+    import tempfile
+    from scheduler import Scheduler
+    import simulator
+
+    short = check_profiles()
+    for phase, rate, need in short:
+        print(f"[{phase}] GPS タスク {rate}Hz では NMEA を読み切れません（{need:.1f}Hz 以上必要）")
+    print(f"GPS の読み取り周期: {'OK' if not short else 'NG'}")
+
+    sim = simulator.Simulator(obstacles=())
+    sched = Scheduler(sim.clock)
+    runs = {}
+    for name in ("imu", "gps", "ranging", "control", "camera"):
+        runs[name] = 0
+        sched.add_task(name, 1.0, lambda name=name: runs.__setitem__(name, runs[name] + 1))
+
+    tmp = tempfile.TemporaryDirectory()
+    gov_paths = [os.path.join(tmp.name, f"cpu{i}") for i in range(4)]
+    power = PowerManager(sched, governor=CpuGovernor(gov_paths), clock=sim.clock.monotonic)
+    power.attach(Bno055Power(simulator.SimBno055(sim.bno)))
+    power.attach(GpsPower.over_i2c(sim.smbus(1), i2c_msg=simulator.SimI2cMsg))
+    power.attach(CameraPower())
+
+    for phase, duration in (("standby", 600), ("navigation", 300), ("approach", 60), ("goal", 600)):
+        before = dict(runs)
+        fixes = sim.gps.fixes
+        power.enter_phase(phase)
+        sched.run(duration=duration)
+        sim.gps.poll()
+        counts = " ".join(f"{k}:{runs[k] - before[k]}" for k in runs)
+        with open(gov_paths[0]) as f:
+            gov = f.read()
+        print(f"[{phase}] {duration}s  タスク実行 {counts}  NMEA 出力 {sim.gps.fixes - fixes} 回  ガバナー {gov}")
+    power.restore()
+    with open(gov_paths[0]) as f:
+        print(f"[終了] 設定を戻した後のガバナー {f.read()}")
+    tmp.cleanup()
+
+    print("\nBNO055 のモード書き込み (時刻, レジスタ, 値):")
+    print("  ", [(round(t), hex(r), v) for t, r, v in sim.bno.mode_log])
+    print("GPS へのコマンド:")
+    print("  ", [(round(t), c) for t, c in sim.gps.commands])
+    print()
+    print(power.energy_report())
+    return 0 if not short else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
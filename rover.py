@@ -0,0 +1,805 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+ローバーの起動エントリポイント
+ - サブシステム（IMU, 分離機構, GPS, モーター, 距離センサ, 航法, カメラ）は使う直前に import・初期化する
+   （起動時に cv2 などを全部読み込むと、Pi Zero では着地直後の数秒が無駄になる）
+ - フェーズに入ると、そのフェーズのサブシステムを立ち上げてから、
+   次のフェーズで使うモジュールをバックグラウンドスレッドで先読みする
+ - ファイル名にハイフンやドットがあるスクリプト（hujita_motor_control_ver_1.3.1.py など）も読み込める
+ - power_manager.PowerManager を渡すと、フェーズごとにセンサーの電源モード・周期と CPU ガバナーを切り替える
+ - Mission がフェーズを順に進める（着地判定 → 分離 → GPS 誘導 → カメラで接近 → ゴール）
+   カメラは別プロセス（shm_bus.vision_process）で撮影・検出し、結果を共有メモリの SensorBus で受け取る
+   simulator.py のミッションも同じ Mission を偽ドライバで動かしている
+ - python3 rover.py [緯度 経度]   … ミッションを実行する（省略時は GOAL のゴールへ）
+   --realtime を付けると制御ループを REALTIME_CPU に固定して SCHED_FIFO で回す（sudo が必要）
+ - python3 rover.py --benchmark   … サブシステムごとの import 時間と初期化時間を表示
+   （各サブシステムを別プロセスで測るので、キャッシュの効いていない起動直後の値になる）
+   --no-init を付けると import だけを測る（ハードウェアに触らない）
+   実機でなければ simulator.py の偽ドライバで測る（--sim で実機でも偽ドライバにできる）
+"""
+
+import importlib
+import importlib.util
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# ===== 設定 =====
+# (フェーズ名, そのフェーズで使うサブシステム)。上から順に進む
+PHASES = (
+    ("standby", ("imu", "cutter")),                          # 落下〜着地判定・パラシュート分離
+    ("navigation", ("gps", "motor", "ranging", "navigation")),  # GPS 誘導で走行
+    ("approach", ("camera",)),                               # カメラでコーンへ接近
+    ("goal", ()),                                            # ゴール後（位置の送信のみ）
+)
+PRELOAD_NEXT_PHASE = True   # 次のフェーズのモジュールをバックグラウンドで先読みする
+REALTIME = False            # 制御ループを REALTIME_CPU に固定して SCHED_FIFO で回す（sudo が必要。--realtime でも指定できる）
+REALTIME_CPU = 3
+REALTIME_PRIORITY = 50
+
+# ミッション
+GOAL = None                 # ゴールの (緯度, 経度)。python3 rover.py 緯度 経度 でも指定できる
+MISSION_TIMEOUT = 1200.0    # ミッション全体の制限時間 (s)
+LANDED_ACCEL = 0.5          # 線形加速度がこれ未満 (m/s^2) で
+LANDED_GYRO = 0.1           # 角速度がこれ未満 (rad/s) の状態が
+LANDED_STILL = 5.0          # この秒数続いたら着地とみなす
+CUT_SECONDS = 3             # 分離機構（ニクロム線）1回の通電時間 (s)
+CUT_CHECK_RATE = 20.0       # 通電手順を進めるタスクの周期 (Hz)
+PHASE_CHECK_RATE = 10.0     # 裏で立ち上げたフェーズに切り替えるタスクの周期 (Hz)
+IMU_RATE = 50.0             # 各タスクの周期 (Hz)（PowerManager があればフェーズごとにそちらの周期になる）
+CONTROL_RATE = 20.0         # 誘導制御
+RANGE_RATE = 10.0
+CAMERA_RATE = 2.0
+MISSION_POWER = 50          # 走行時のモーターパワー
+APPROACH_POWER = 35         # カメラ誘導時のモーターパワー
+APPROACH_DISTANCE = 4.0     # ゴールまでこの距離 (m) になったらカメラ誘導に切り替える
+GOAL_RANGE = 0.35           # 超音波でこの距離 (m) まで近づいたらゴール
+SPIN_ANGLE = 35.0           # 方位誤差がこれより大きければ信地旋回 (度)
+CURVE_ANGLE = 8.0           # これより大きければカーブ旋回 (度)
+AVOID_TIME = 1.0            # 障害物を見つけたときに回避方向へ進む時間 (s)
+CAMERA_WIDTH = 640          # 撮影画像の幅 (px)
+CAMERA_FOV = 62.2           # 水平画角 (度)（Raspberry Pi カメラ v2）
+DETECTION_MAX_AGE = 3.0     # これより古いコーンの検出結果は使わない (s)（撮影だけで約 2 秒かかる）
+# ==================
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+# ---------- モジュールの読み込み ----------
+_module_locks = {}
+
+
+def module_alias(name):
+    """ファイル名から sys.modules に登録する名前を作る（例: motor-test → motor_test）"""
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+
+
+def load_module(name):
+    """
+    モジュールを読み込んで返す（読み込み済みならそれを返す）
+    name が普通のモジュール名ならそのまま import し、
+    このディレクトリに name + ".py" があればファイルから読み込む（ハイフン・ドット入りの名前用）
+    """
+    path = os.path.join(ROOT, name + ".py")
+    if name.isidentifier() or not os.path.exists(path):
+        return importlib.import_module(name)
+
+    alias = module_alias(name)
+    # 同じファイルを2つのスレッドから同時に実行しないようにする
+    with _module_locks.setdefault(alias, threading.Lock()):
+        if alias in sys.modules:
+            return sys.modules[alias]
+        spec = importlib.util.spec_from_file_location(alias, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[alias] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[alias]
+            raise
+        return module
+
+
+# ---------- サブシステム ----------
+class Subsystem:
+    """
+    遅延読み込みされる1つのサブシステム
+    :param modules: 読み込むモジュール名のリスト（先頭が本体）
+    :param init: init(本体モジュール) → ハンドル。ハードウェアに触るのはここだけ
+    :param stop: stop(ハンドル)。終了時に呼ぶ
+    :param loader: loader(モジュール名) → モジュール（省略時は load_module。simulator.py は偽ドライバで読む）
+    """
+    def __init__(self, name, modules, init=None, stop=None, loader=None):
+        self.name = name
+        self.modules = tuple(modules)
+        self.init_func = init
+        self.stop_func = stop
+        self.loader = loader if loader is not None else load_module
+        self.module = None
+        self.handle = None
+        self.started = False
+        self.import_time = None   # 秒
+        self.init_time = None     # 秒
+        self.preloaded = False    # バックグラウンドで読み込んだか
+        self.error = None
+        self._lock = threading.Lock()
+
+    def load(self, background=False):
+        """モジュールを import する（初期化はしない）"""
+        with self._lock:
+            if self.module is None:
+                t0 = time.perf_counter()
+                mods = [self.loader(m) for m in self.modules]
+                self.import_time = time.perf_counter() - t0
+                self.module = mods[0]
+                self.preloaded = background
+        return self.module
+
+    def start(self):
+        """import と初期化を行い、ハンドルを返す（2回目以降は同じハンドル）"""
+        module = self.load()
+        with self._lock:
+            if not self.started:
+                t0 = time.perf_counter()
+                if self.init_func is not None:
+                    self.handle = self.init_func(module)
+                else:
+                    self.handle = module
+                self.init_time = time.perf_counter() - t0
+                self.started = True
+        return self.handle
+
+    def stop(self):
+        with self._lock:
+            if self.started and self.stop_func is not None:
+                try:
+                    self.stop_func(self.handle)
+                except Exception as e:
+                    print(f"{self.name} の終了処理に失敗しました:", e, file=sys.stderr)
+            self.started = False
+
+    def describe(self):
+        imp = "-" if self.import_time is None else f"{self.import_time * 1000:8.1f}ms"
+        ini = "-" if self.init_time is None else f"{self.init_time * 1000:8.1f}ms"
+        note = "（先読み）" if self.preloaded else ""
+        if self.error is not None:
+            note += f" 失敗: {self.error}"
+        return f"{self.name:<11} import:{imp:>10}  init:{ini:>10} {note}"
+
+
+# --- 各サブシステムの初期化（ハードウェアに触る処理はここに集める） ---
+def _init_imu(acceleration):
+    acceleration.init_sensor()
+    return acceleration
+
+
+def _init_cutter(wire16):
+    wire16.init()
+    return wire16
+
+
+def _stop_cutter(wire16):
+    wire16.pi.write(wire16.CAREER_CUT, 0)
+    wire16.pi.stop()
+
+
+def _init_gps(gps):
+    bus = gps.SMBus(gps.I2C_BUS)
+    return bus, gps.make_supervisor(bus)
+
+
+def _stop_gps(handle):
+    handle[0].close()
+
+
+def _init_motor(motor, scheduler=None):
+    """scheduler を渡すとランプをそのタスクにする（仮想時計で回す simulator.py 用）。無ければ専用スレッド"""
+    pi = motor.pigpio.pi()
+    if not pi.connected:
+        raise RuntimeError("pigpioデーモンに接続できません。sudo pigpiod を実行してください。")
+    ramp = motor.motor_ramp.RampEngine(pi, {
+        "left": (motor.LEFT_MOTOR_PIN1, motor.LEFT_MOTOR_PIN2),
+        "right": (motor.RIGHT_MOTOR_PIN1, motor.RIGHT_MOTOR_PIN2),
+    })
+    control = motor.motor_pawer_control(pi, ramp=ramp)
+    # ピンの PWM 設定が済んでからランプを回し始める
+    if scheduler is not None:
+        ramp.attach(scheduler, priority=0)
+    else:
+        ramp.start_thread()
+    return control
+
+
+def _stop_motor(control):
+    control.stop_now()
+    control.ramp.stop_thread()
+    control.pi.stop()
+
+
+def _init_ranging(kyori):
+    kyori.setup()
+    return kyori
+
+
+def _init_camera(shm_bus):
+    """
+    撮影とコーン検出を別プロセス（shm_bus.vision_process）で回し、結果を共有メモリの SensorBus で受け取る
+    :return: (SensorBus, 停止イベント, プロセス)
+    """
+    import multiprocessing as mp
+    # ランプ・GPS のスレッドが動いている途中で fork するとロックを持ったまま複製されることがあるので、
+    # 新しいインタプリタで立ち上げる
+    ctx = mp.get_context("spawn")
+    bus = shm_bus.SensorBus.create()
+    stop = ctx.Event()
+    proc = ctx.Process(target=shm_bus.vision_process, args=(bus.specs(), stop, "camera"),
+                       name="vision", daemon=True)
+    proc.start()
+    return bus, stop, proc
+
+
+def _stop_camera(handle):
+    bus, stop, proc = handle
+    if stop is not None:
+        stop.set()
+        # 撮影（libcamera-jpeg）の途中なら終わるまで待ち、戻らなければ止める
+        proc.join(timeout=5.0)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
+    bus.close()
+
+
+def _init_navigation(fusion):
+    import occupancy_grid
+    import dead_reckoning
+    return {
+        "ekf": fusion.GpsImuEkf(),
+        "grid": occupancy_grid.OccupancyGrid(),
+        "dead_reckoning": dead_reckoning.DeadReckoner(),
+    }
+
+
+def default_subsystems(loader=None):
+    subs = [
+        Subsystem("imu", ["acceleration"], _init_imu, loader=loader),
+        Subsystem("cutter", ["wire16"], _init_cutter, _stop_cutter, loader=loader),
+        Subsystem("gps", ["GPS"], _init_gps, _stop_gps, loader=loader),
+        Subsystem("motor", ["hujita_motor_control_ver_1.3.1"], _init_motor, _stop_motor, loader=loader),
+        Subsystem("ranging", ["kyori"], _init_ranging, loader=loader),
+        Subsystem("navigation", ["fusion", "occupancy_grid", "dead_reckoning", "timebase"],
+                  _init_navigation, loader=loader),
+        # cv2 はビジョンプロセス（spawn で新しく立ち上がる）が自分で読むので、制御側では読まない
+        Subsystem("camera", ["shm_bus", "camera5"], _init_camera, _stop_camera, loader=loader),
+    ]
+    return {s.name: s for s in subs}
+
+
+# ---------- ローバー全体 ----------
+class Rover:
+    """
+    サブシステムを必要になった時点で立ち上げる
+    例:
+        rover = Rover()
+        rover.enter_phase("standby")      # IMU と分離機構だけ立ち上げ、航法系を裏で先読み
+        rover.get("cutter").career_cat(3)
+        rover.enter_phase("navigation")
+        control = rover.get("motor")
+    """
+    def __init__(self, subsystems=None, phases=PHASES, preload=PRELOAD_NEXT_PHASE, power=None):
+        self.subsystems = subsystems if subsystems is not None else default_subsystems()
+        self.phases = phases
+        self.preload_enabled = preload
+        self.power = power
+        self.phase = None
+        self._preload_thread = None
+
+    def get(self, name):
+        """サブシステムのハンドル（まだなら import・初期化する）"""
+        return self.subsystems[name].start()
+
+    def _phase_index(self, phase):
+        for i, (name, _) in enumerate(self.phases):
+            if name == phase:
+                return i
+        raise KeyError(f"フェーズ {phase} はありません")
+
+    def enter_phase(self, phase):
+        """
+        フェーズのサブシステムを立ち上げ、電源設定を切り替える
+        :return: 失敗したサブシステム名のリスト
+        """
+        failed = self.start_phase(phase)
+        self.apply_power(phase)
+        return failed
+
+    def start_phase(self, phase):
+        """
+        フェーズのサブシステムを立ち上げ、次のフェーズのモジュールの先読みを始める（別スレッドから呼んでよい）
+        立ち上げに失敗したサブシステムは error に記録して続行する（他の系は動かす）
+        :return: 失敗したサブシステム名のリスト
+        """
+        i = self._phase_index(phase)
+        self.phase = phase
+        failed = []
+        for name in self.phases[i][1]:
+            sub = self.subsystems[name]
+            try:
+                sub.start()
+            except Exception as e:
+                sub.error = e
+                failed.append(name)
+                print(f"{name} の立ち上げに失敗しました:", e, file=sys.stderr)
+        if self.preload_enabled and i + 1 < len(self.phases):
+            self.preload(self.phases[i + 1][1])
+        return failed
+
+    def apply_power(self, phase):
+        """
+        PowerManager をフェーズに切り替える
+        動いているセンサーのレジスタに書き込むので、そのセンサーを読むスレッド（スケジューラ）から呼ぶ
+        """
+        if self.power is not None:
+            # 先にフェーズを切り替えてから、新しく立ち上がったセンサーをそのフェーズの設定で登録する
+            self.power.enter_phase(phase)
+            self._attach_power()
+
+    def _attach_power(self):
+        """立ち上がったセンサーの電源切り替えを PowerManager に登録する"""
+        import power_manager
+        imu = self.subsystems.get("imu")
+        if imu is not None and imu.started and "bno055" not in self.power.drivers:
+            self.power.attach(power_manager.Bno055Power(imu.handle.sensor))
+        gps = self.subsystems.get("gps")
+        if gps is not None and gps.started and "gps" not in self.power.drivers:
+            self.power.attach(power_manager.GpsPower.over_i2c(gps.handle[0]))
+        camera = self.subsystems.get("camera")
+        if camera is not None and camera.started and "camera" not in self.power.drivers:
+            # カメラを使わないフェーズではビジョンプロセスを止め、使うフェーズでまた立ち上げる
+            self.power.attach(power_manager.CameraPower(
+                on_change=lambda enabled: camera.start() if enabled else camera.stop()))
+
+    def preload(self, names):
+        """モジュールの import だけを低優先のバックグラウンドスレッドで行う"""
+        def work():
+            from scheduler import configure_normal
+            configure_normal()   # 制御ループの SCHED_FIFO を引き継いでいたら外す
+            # Linux ではスレッド単位で nice 値を上げられる（制御ループの邪魔をしないように）
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+            except (AttributeError, OSError):
+                pass
+            for name in names:
+                try:
+                    self.subsystems[name].load(background=True)
+                except Exception as e:
+                    # 本番で使うときに start() がもう一度試して例外を出す
+                    print(f"{name} の先読みに失敗しました:", e, file=sys.stderr)
+
+        self.wait_preload()
+        self._preload_thread = threading.Thread(target=work, name="preload", daemon=True)
+        self._preload_thread.start()
+        return self._preload_thread
+
+    def wait_preload(self, timeout=None):
+        if self._preload_thread is not None:
+            self._preload_thread.join(timeout)
+
+    def shutdown(self):
+        # センサーの電源モード・GPS の出力周期・ガバナーを普段の設定に戻してから止める
+        if self.power is not None:
+            self.power.restore()
+        for sub in reversed(list(self.subsystems.values())):
+            sub.stop()
+
+    def report(self):
+        return "\n".join(s.describe() for s in self.subsystems.values())
+
+
+# ---------- ミッション ----------
+class Mission:
+    """
+    フェーズを順に進めるミッション本体。Rover のサブシステムを scheduler.Scheduler のタスクで回す
+     standby   : IMU で着地を判定し、分離機構（wire16）に通電
+     navigation: GPS（GPS.py の XA1110Reader）と IMU の融合（fusion）、超音波の障害物マップ（kyori +
+                 occupancy_grid）でゴールへ誘導（motor_pawer_control + motor_ramp）
+     approach  : カメラで赤いコーンを探して近づき、超音波の距離でゴール判定
+     goal      : モーターを止めて終了
+    rover.power（PowerManager）は同じ scheduler を持たせておくと、フェーズごとのタスク周期も切り替わる
+    タスクの中では待たない: 分離機構の通電は cutter タスクが時刻を見て進め、次のフェーズのサブシステムは
+    request_phase で裏のスレッドが立ち上げる（済んだら phase タスクがスケジューラのスレッドで切り替える）
+    例:
+        mission = Mission(Rover(), goal=(35.68, 139.76))
+        mission.run()
+    """
+    def __init__(self, rover, goal, clock=None, verbose=True, scheduler=None):
+        from scheduler import Scheduler
+        self.rover = rover
+        self.goal = goal
+        self.verbose = verbose
+        self.sched = scheduler if scheduler is not None else Scheduler(clock)
+        self.start_time = self.now()
+        self.phase = None
+        self.phase_times = {}
+        self.aborted = False
+        self.background_startup = True   # False なら request_phase がその場で立ち上げる（simulator.py 用）
+        self.pending_phase = None
+        self._prepared = None
+        self.cutting = False
+        self._cut_steps = []
+        self._cut_until = 0.0
+        self.sched.add_task("phase", PHASE_CHECK_RATE, self.check_phase, priority=0)
+        self.log = []
+        self.imu = None
+        self.ekf = None
+        self.grid = None
+        self.control = None
+        self.kyori = None
+        self.still_since = None
+        self.avoid_until = 0.0
+        self.avoid_dir = "right"
+        self.detection = None
+        self.sonar_m = math.inf
+        # カメラ画像の中心からのずれ (px) を角度にするための焦点距離 (px)
+        self.focal = 0.5 * CAMERA_WIDTH / math.tan(math.radians(CAMERA_FOV / 2))
+
+    def now(self):
+        """スケジューラの時計 (s)。実機では timebase.now() と同じ時間軸"""
+        return self.sched.clock.now_ns() * 1e-9
+
+    def say(self, text):
+        t = self.now() - self.start_time
+        self.log.append((t, text))
+        if self.verbose:
+            print(f"[{t:7.2f}s] {text}")
+
+    # --- フェーズ ---
+    def enter_phase(self, phase):
+        """フェーズのサブシステムをその場で立ち上げ、そのフェーズのタスクを登録する（タスクの外で呼ぶ）"""
+        self._switch_phase(phase, self.start_subsystems(phase))
+
+    def start_subsystems(self, phase):
+        """:return: 立ち上げに失敗したサブシステム名のリスト"""
+        return self.rover.start_phase(phase)
+
+    def request_phase(self, phase):
+        """
+        タスクから次のフェーズを頼む（待たない）。サブシステムの import・初期化は裏のスレッドで行い、
+        済んだら phase タスクが切り替える。切り替えまでは今のフェーズのタスクが動き続ける
+        """
+        if self.pending_phase is not None:
+            return
+        self.pending_phase = phase
+        self._prepared = None
+        if self.background_startup:
+            threading.Thread(target=self._prepare, args=(phase,), name="phase_startup", daemon=True).start()
+        else:
+            self._prepare(phase)
+
+    def _prepare(self, phase):
+        from scheduler import configure_normal
+        configure_normal()   # 制御ループの SCHED_FIFO を引き継いでいたら外す
+        try:
+            failed = self.start_subsystems(phase)
+        except Exception as e:
+            print(f"{phase} の立ち上げに失敗しました:", e, file=sys.stderr)
+            failed = [phase]
+        self._prepared = failed
+
+    def check_phase(self):
+        """phase タスク: 裏の立ち上げが済み、分離機構の通電も終わっていればフェーズを切り替える"""
+        if self.pending_phase is None or self._prepared is None or self.cutting:
+            return
+        phase, failed = self.pending_phase, self._prepared
+        self.pending_phase = None
+        self._prepared = None
+        self._switch_phase(phase, failed)
+
+    def _switch_phase(self, phase, failed):
+        self.phase = phase
+        self.phase_times[phase] = self.now()
+        if failed:
+            self.say(f"{', '.join(failed)} が立ち上がりません。ミッションを中止")
+            self.abort()
+            return
+        self.rover.apply_power(phase)
+        getattr(self, "_start_" + phase)()
+        if self.rover.power is not None:
+            self.rover.power.apply_tasks()   # いま登録したタスクにもフェーズの周期を反映する
+
+    def _start_standby(self):
+        self.imu = self.rover.get("imu")
+        self.sched.add_task("imu", IMU_RATE, self.read_imu, priority=1)
+
+    def _start_navigation(self):
+        self.say("走行開始")
+        nav = self.rover.get("navigation")
+        self.ekf = nav["ekf"]
+        self.grid = nav["grid"]
+        gps = self.rover.subsystems["gps"].module
+        bus, supervisor = self.rover.get("gps")
+        gps.ECHO_SENTENCES = False
+        gps.FIX_HANDLERS.append(self.ekf.update_gps)
+        gps.XA1110Reader(bus, supervisor).attach(self.sched, priority=2, name="gps")
+        self.control = self.rover.get("motor")
+        self.control.obstacle_map = self.grid
+        self.control.power = MISSION_POWER
+        self.kyori = self.rover.get("ranging")
+        self.sched.add_task("ranging", RANGE_RATE, self.read_range, priority=3)
+        self.sched.add_task("control", CONTROL_RATE, self.step, priority=4)
+
+    def _start_approach(self):
+        self.control.obstacle_map = None       # コーン自体を障害物として避けないように
+        self.control.power = APPROACH_POWER
+        self.sched.add_task("camera", CAMERA_RATE, self.read_camera, priority=5)
+
+    def _start_goal(self):
+        self.control.stop()
+        self.sched.stop()
+
+    def abort(self):
+        self.aborted = True
+        if self.control is not None:
+            self.control.stop_now()
+        self.sched.stop()
+
+    # --- センサータスク ---
+    def _read_imu_registers(self):
+        s = self.imu.sensor
+        return s.euler[0], s.linear_acceleration, s.gyro[2]
+
+    def read_imu(self):
+        try:
+            yaw, lin, gz = self.imu.supervisor.call("bno055", self._read_imu_registers)
+        except OSError:
+            return      # バックオフ・再初期化は監視側が行う。次の周期で読み直す
+        if yaw is None or gz is None or None in lin:
+            return
+        t = self.now()
+        if self.phase == "standby":
+            if not self.cutting and self.pending_phase is None:
+                self.check_landing(t, lin, gz)
+        elif self.ekf is not None:
+            self.ekf.step_imu(t, lin[0], lin[1], yaw_deg=yaw, yaw_rate=-gz)
+
+    def check_landing(self, t, lin, gz):
+        """線形加速度と角速度が小さい状態が LANDED_STILL 秒続いたら着地とみなして分離する"""
+        if math.sqrt(sum(a * a for a in lin)) >= LANDED_ACCEL or abs(gz) >= LANDED_GYRO:
+            self.still_since = None
+            return
+        if self.still_since is None:
+            self.still_since = t
+        elif t - self.still_since >= LANDED_STILL:
+            self.say("着地を検知")
+            self.release()
+
+    def release(self):
+        """分離機構の通電を始め、その間に航法系を裏で立ち上げておく（通電が終わったら navigation に切り替わる）"""
+        self.say("分離機構に通電")
+        self.cutting = True
+        self._cut_steps = list(self.rover.get("cutter").cut_steps(CUT_SECONDS))
+        self._cut_until = self.now()
+        self.sched.add_task("cutter", CUT_CHECK_RATE, self.step_cut, priority=0)
+        self.request_phase("navigation")
+
+    def step_cut(self):
+        """cutter タスク: 今の段の時間が過ぎていたら次の出力にする（time.sleep しない）"""
+        t = self.now()
+        if t < self._cut_until:
+            return
+        cutter = self.rover.get("cutter")
+        if not self._cut_steps:
+            self.sched.remove_task("cutter")
+            self.cutting = False
+            self.cut_finished()
+            return
+        level, seconds = self._cut_steps.pop(0)
+        cutter.set_cut(level)
+        self._cut_until = t + seconds
+
+    def cut_finished(self):
+        self.say("分離機構の通電終了")
+
+    def read_range(self):
+        distance_cm = self.kyori.measure()
+        if distance_cm is None:
+            self.sonar_m = math.inf   # エコーが来なかった。前が空いているとは限らないので地図は更新しない
+            return
+        self.sonar_m = distance_cm / 100.0
+        if not self.ekf.initialized:
+            return
+        x, y = self.ekf.position()
+        self.grid.update_pose(x, y, self.ekf.heading_deg())
+        self.grid.integrate_range(self.sonar_m)
+
+    def detect(self):
+        """ビジョンプロセスの最新の検出結果を画像上の中心 (cx, cy) で返す（見つからない・古ければ None）"""
+        bus = self.rover.get("camera")[0]
+        item = bus.detections.latest()
+        if item is None:
+            return None
+        _, t_ns, det = item
+        if self.now() - t_ns * 1e-9 > DETECTION_MAX_AGE or det["cx"] < 0:
+            return None
+        return int(det["cx"]), int(det["cy"])
+
+    def read_camera(self):
+        self.detection = self.detect()
+
+    # --- 誘導 ---
+    def goal_vector(self):
+        gx, gy = self.ekf.projection.to_local(*self.goal)
+        x, y = self.ekf.position()
+        dx, dy = float(gx) - x, float(gy) - y
+        return math.hypot(dx, dy), math.degrees(math.atan2(dx, dy)) % 360.0
+
+    def steer(self, error_deg):
+        c = self.control
+        m = self.rover.subsystems["motor"].module
+        direction = "right" if error_deg > 0 else "left"
+        if abs(error_deg) > SPIN_ANGLE:
+            return c.turn(direction, m.SPIN_TURN_POWER_RATIO, m.SPIN_TURN_RATE)
+        if abs(error_deg) > CURVE_ANGLE:
+            return c.turn(direction, m.CURVE_TURN_POWER_RATIO, m.CURVE_TURN_RATE)
+        return c.forward()
+
+    def step(self):
+        t = self.now()
+        c = self.control
+        m = self.rover.subsystems["motor"].module
+        if self.phase == "navigation":
+            if not self.ekf.initialized:
+                return
+            dist, bearing = self.goal_vector()
+            if dist < APPROACH_DISTANCE and self.pending_phase is None:
+                # カメラが立ち上がるまでは GPS 誘導を続ける
+                self.say(f"ゴールまで推定 {dist:.1f}m。カメラ誘導に切り替え")
+                self.request_phase("approach")
+            if t < self.avoid_until:
+                if not c.forward():
+                    c.turn(self.avoid_dir, m.SPIN_TURN_POWER_RATIO, m.SPIN_TURN_RATE)
+                return
+            error = (bearing - self.ekf.heading_deg() + 180.0) % 360.0 - 180.0
+            if not self.steer(error):
+                # 前が塞がっている: 空いている側へ向きを変えてしばらく進む
+                heading = self.grid.best_heading(bearing, distance=m.OBSTACLE_CHECK_DISTANCE)
+                rel = 90.0 if heading is None else (heading - self.ekf.heading_deg() + 180.0) % 360.0 - 180.0
+                self.avoid_dir = "right" if rel >= 0 else "left"
+                self.avoid_until = t + AVOID_TIME
+                c.turn(self.avoid_dir, m.SPIN_TURN_POWER_RATIO, m.SPIN_TURN_RATE)
+        elif self.phase == "approach":
+            if self.detection is None:
+                c.turn("right", m.SPIN_TURN_POWER_RATIO, m.SPIN_TURN_RATE)   # 見つかるまでその場で探す
+                return
+            if self.sonar_m < GOAL_RANGE:
+                if self.pending_phase is None:
+                    self.say(f"ゴール到達（超音波 {self.sonar_m * 100:.0f}cm）")
+                    c.stop()
+                    self.request_phase("goal")
+                return
+            err_px = self.detection[0] - CAMERA_WIDTH / 2
+            self.steer(math.degrees(math.atan2(err_px, self.focal)))
+
+    # --- 実行 ---
+    def run(self, timeout=MISSION_TIMEOUT):
+        """最初のフェーズから始めて、ゴールか timeout 秒で戻る。最後のフェーズ名を返す"""
+        self.enter_phase(self.rover.phases[0][0])
+        try:
+            if not self.aborted:
+                self.sched.run(duration=timeout)
+        finally:
+            if self.control is not None:
+                self.control.stop_now()
+            if self.cutting:
+                self.rover.get("cutter").set_cut(0)
+        return self.phase
+
+
+# ---------- 起動時間ベンチマーク ----------
+def hardware_present():
+    """pigpio と I2C が使える実機か（--benchmark で偽ドライバに切り替えるかの判定）"""
+    return os.path.exists("/dev/i2c-1") and importlib.util.find_spec("pigpio") is not None
+
+
+def probe(name, do_init=True, sim=False):
+    """（子プロセス内で）1つのサブシステムの import・初期化時間を測って JSON で出力する"""
+    if sim:
+        # ドライバのモジュールを simulator.py の偽物にしておく（import も初期化も実機と同じ手順で通る）
+        import simulator
+        sys.modules.update(simulator.Simulator().modules())
+    sub = default_subsystems()[name]
+    result = {"name": name, "import": None, "init": None, "error": None}
+    try:
+        sub.load()
+        result["import"] = sub.import_time
+        if do_init:
+            sub.start()
+            result["init"] = sub.init_time
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        sub.stop()
+    print(json.dumps(result))
+    return 0
+
+
+def benchmark(do_init=True, sim=False):
+    """
+    サブシステムごとに新しいプロセスで import・初期化時間を測り、表を返す
+    「プロセス」はインタプリタ起動を含む子プロセス全体の時間
+    sim=True なら simulator.py の偽ドライバで測る（simulator が先に読み込む numpy などは import に含まれない）
+    """
+    def run(args):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable] + args, capture_output=True, text=True, cwd=ROOT)
+        return time.perf_counter() - t0, out
+
+    base, _ = run(["-c", "pass"])
+    lines = [f"Python 起動のみ: {base * 1000:.1f}ms",
+             f"{'サブシステム':<10} {'import':>10} {'init':>10} {'プロセス':>10}"]
+    if sim:
+        lines.insert(0, "実機のドライバが無いので simulator.py の偽ドライバで測定")
+    total = 0.0
+    for name in default_subsystems():
+        args = [os.path.abspath(__file__), "--probe", name] + ([] if do_init else ["--no-init"])
+        args += ["--sim"] if sim else []
+        wall, out = run(args)
+        try:
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            r = {"import": None, "init": None, "error": out.stderr.strip().splitlines()[-1:]}
+        imp = "-" if r["import"] is None else f"{r['import'] * 1000:.1f}ms"
+        ini = "-" if r["init"] is None else f"{r['init'] * 1000:.1f}ms"
+        note = f"  失敗: {r['error']}" if r["error"] else ""
+        total += (r["import"] or 0.0) + (r["init"] or 0.0)
+        lines.append(f"{name:<14} {imp:>10} {ini:>10} {wall * 1000:>8.1f}ms{note}")
+    lines.append(f"合計（import + init）: {total * 1000:.1f}ms")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    do_init = "--no-init" not in args
+    sim = "--sim" in args
+    realtime = REALTIME or "--realtime" in args
+    args = [a for a in args if a not in ("--no-init", "--sim", "--realtime")]
+
+    if args[:1] == ["--probe"]:
+        return probe(args[1], do_init, sim)
+    if args[:1] == ["--benchmark"]:
+        print(benchmark(do_init, sim or not hardware_present()))
+        return 0
+
+    goal = (float(args[0]), float(args[1])) if len(args) >= 2 else GOAL
+    if goal is None:
+        print("ゴールを指定してください: python3 rover.py 緯度 経度（または rover.py の GOAL）", file=sys.stderr)
+        return 2
+    import power_manager
+    from scheduler import Scheduler, configure_realtime
+    if realtime:
+        # 失敗した項目は configure_realtime が理由を表示する。設定できなくても通常のスケジューリングで続ける
+        applied = configure_realtime(REALTIME_CPU, REALTIME_PRIORITY)
+        print("リアルタイム設定:", applied or "なし")
+    sched = Scheduler()
+    power = power_manager.PowerManager(sched, governor=power_manager.CpuGovernor())
+    rover = Rover(power=power)
+    mission = Mission(rover, goal, scheduler=sched)
+    try:
+        phase = mission.run()
+    except KeyboardInterrupt:
+        phase = mission.phase
+        print("中断しました")
+    finally:
+        rover.wait_preload()
+        rover.shutdown()
+    print(rover.report())
+    return 0 if phase == "goal" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
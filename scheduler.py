@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+固定周期のリアルタイムスケジューラ
+ - 複数の周期タスクをそれぞれのレートで、絶対時刻の締め切り基準で実行する
+   （処理時間のぶん周期が伸びる time.sleep(定数) 方式をやめる）
+ - 締め切り超過（オーバーラン）の検出と回数の記録、取りこぼした周期のスキップ
+ - 同時に実行可能なタスクは優先度順（数値が小さいほど優先）
+ - 可能なら CPU 固定と SCHED_FIFO を設定（権限が無ければ何もしない）
+ - タスクごとのジッタ（起床遅れ）ヒストグラムを report() で表示
+ - VirtualClock を渡すと実時間を待たずにテストできる
+"""
+
+import os
+import sys
+import time
+
+# ===== 設定 =====
+JITTER_BINS_US = (50, 100, 200, 500, 1000, 2000, 5000, 10000)  # ヒストグラムの境界 (us)
+DEFAULT_FIFO_PRIORITY = 50
+# ==================
+
+NS_PER_SEC = 1_000_000_000
+
+
+class MonotonicClock:
+    """実時間の単調時計（ナノ秒整数）"""
+    def now_ns(self):
+        return time.monotonic_ns()
+
+    def sleep_until(self, deadline_ns):
+        """絶対時刻 deadline_ns まで眠る（途中で起きても残り時間を計算し直す）"""
+        while True:
+            remaining = deadline_ns - time.monotonic_ns()
+            if remaining <= 0:
+                return
+            time.sleep(remaining / NS_PER_SEC)
+
+
+class VirtualClock:
+    """
+    テスト・シミュレーション用の仮想時計
+    sleep_until は待たずに時刻を進める。タスク内で advance() すれば処理時間を模擬できる
+    """
+    def __init__(self, start_ns=0):
+        self.t_ns = start_ns
+
+    def now_ns(self):
+        return self.t_ns
+
+    def sleep_until(self, deadline_ns):
+        if deadline_ns > self.t_ns:
+            self.t_ns = deadline_ns
+
+    def advance(self, seconds):
+        self.t_ns += int(round(seconds * NS_PER_SEC))
+
+    def monotonic(self):
+        """time.monotonic 互換（秒）"""
+        return self.t_ns / NS_PER_SEC
+
+
+class PeriodicTask:
+    """1つの周期タスクと、その実行統計"""
+    def __init__(self, name, period_ns, func, priority, start_ns):
+        self.name = name
+        self.period_ns = period_ns
+        self.func = func
+        self.priority = priority
+        self.next_deadline = start_ns
+        self.enabled = True
+
+        self.runs = 0
+        self.overruns = 0        # 次の周期の開始までに終わらなかった回数
+        self.skipped = 0         # 遅れすぎて飛ばした周期の数
+        self.errors = 0
+        self.max_jitter_ns = 0
+        self.max_exec_ns = 0
+        self.jitter_hist = [0] * (len(JITTER_BINS_US) + 1)
+
+    @property
+    def rate(self):
+        return NS_PER_SEC / self.period_ns
+
+    def record_jitter(self, jitter_ns):
+        if jitter_ns > self.max_jitter_ns:
+            self.max_jitter_ns = jitter_ns
+        us = jitter_ns / 1000
+        for i, edge in enumerate(JITTER_BINS_US):
+            if us < edge:
+                self.jitter_hist[i] += 1
+                return
+        self.jitter_hist[-1] += 1
+
+
+class Scheduler:
+    """
+    周期タスクのスケジューラ
+    例:
+        sched = Scheduler()
+        sched.add_task("motor", 50, control_step, priority=0)
+        sched.add_task("gps", 20, gps_poll, priority=1)
+        sched.run()
+    """
+    def __init__(self, clock=None):
+        self.clock = clock if clock is not None else MonotonicClock()
+        self.tasks = {}
+        self._running = False
+
+    def add_task(self, name, rate_hz, func, priority=0, phase=0.0):
+        """
+        rate_hz [Hz] で func() を呼ぶタスクを追加する
+        :param phase: 最初の実行を遅らせる秒数（タスク同士の起床をずらす用）
+        """
+        if name in self.tasks:
+            raise ValueError(f"タスク {name} は登録済みです")
+        if rate_hz <= 0:
+            raise ValueError("rate_hz は正の値にしてください")
+        start = self.clock.now_ns() + int(phase * NS_PER_SEC)
+        task = PeriodicTask(name, int(round(NS_PER_SEC / rate_hz)), func, priority, start)
+        self.tasks[name] = task
+        return task
+
+    def remove_task(self, name):
+        self.tasks.pop(name, None)
+
+    def set_rate(self, name, rate_hz):
+        """実行中にレートを変える（次の締め切りから新しい周期になる）"""
+        task = self.tasks[name]
+        if rate_hz <= 0:
+            task.enabled = False
+            return
+        new_period = int(round(NS_PER_SEC / rate_hz))
+        if not task.enabled:
+            task.enabled = True
+            task.next_deadline = self.clock.now_ns() + new_period
+        else:
+            task.next_deadline += new_period - task.period_ns
+        task.period_ns = new_period
+
+    def stop(self):
+        self._running = False
+
+    def _next_ready(self, now):
+        """実行可能なタスクのうち最優先のもの。無ければ (None, 次の締め切り)"""
+        best = None
+        earliest = None
+        for task in self.tasks.values():
+            if not task.enabled:
+                continue
+            if task.next_deadline <= now:
+                if best is None or (task.priority, task.next_deadline) < (best.priority, best.next_deadline):
+                    best = task
+            elif earliest is None or task.next_deadline < earliest:
+                earliest = task.next_deadline
+        return best, earliest
+
+    def _run_task(self, task, now):
+        task.record_jitter(now - task.next_deadline)
+        try:
+            task.func()
+        except Exception as e:
+            task.errors += 1
+            print(f"タスク {task.name} で例外:", e, file=sys.stderr)
+        end = self.clock.now_ns()
+        task.runs += 1
+        task.max_exec_ns = max(task.max_exec_ns, end - now)
+
+        # 次の締め切りは前の締め切り + 周期（実行時間のぶんずれない）
+        task.next_deadline += task.period_ns
+        if end > task.next_deadline:
+            task.overruns += 1
+            missed = (end - task.next_deadline) // task.period_ns + 1
+            task.skipped += missed
+            task.next_deadline += missed * task.period_ns
+
+    def run(self, duration=None):
+        """
+        タスクを実行し続ける。duration [s] を指定するとその時間で戻る
+        """
+        clock = self.clock
+        end = None if duration is None else clock.now_ns() + int(duration * NS_PER_SEC)
+        self._running = True
+        while self._running:
+            now = clock.now_ns()
+            if end is not None and now >= end:
+                break
+            task, earliest = self._next_ready(now)
+            if task is not None:
+                self._run_task(task, now)
+                continue
+            if earliest is None:
+                if end is None:
+                    break
+                earliest = end
+            if end is not None:
+                earliest = min(earliest, end)
+            clock.sleep_until(earliest)
+        self._running = False
+
+    def report(self):
+        """タスクごとの統計を文字列で返す"""
+        labels = [f"<{b}us" for b in JITTER_BINS_US] + [f">={JITTER_BINS_US[-1]}us"]
+        lines = []
+        for t in sorted(self.tasks.values(), key=lambda t: t.priority):
+            lines.append(
+                f"[{t.name}] {t.rate:.1f}Hz 優先度:{t.priority} 実行:{t.runs} "
+                f"オーバーラン:{t.overruns} スキップ:{t.skipped} 例外:{t.errors} "
+                f"最大ジッタ:{t.max_jitter_ns / 1000:.0f}us 最大実行時間:{t.max_exec_ns / 1000:.0f}us")
+            hist = " ".join(f"{l}:{n}" for l, n in zip(labels, t.jitter_hist) if n)
+            lines.append(f"    ジッタ分布 {hist}")
+        return "\n".join(lines)
+
+
+def configure_realtime(cpu=None, fifo_priority=None):
+    """
+    プロセスを指定 CPU に固定し、SCHED_FIFO に設定する（Linux のみ、権限が必要）
+    :return: 実際に設定できた項目の辞書
+    """
+    applied = {}
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+            applied["cpu"] = cpu
+        except (AttributeError, OSError) as e:
+            print("CPU 固定に失敗しました:", e, file=sys.stderr)
+    if fifo_priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(fifo_priority))
+            applied["fifo_priority"] = fifo_priority
+        except (AttributeError, OSError) as e:
+            print("SCHED_FIFO の設定に失敗しました（sudo が必要）:", e, file=sys.stderr)
+    return applied
+
+
+def configure_normal():
+    """
+    呼んだスレッドが SCHED_FIFO なら通常のスケジューリング・全 CPU に戻す
+    configure_realtime したスレッドから作ったスレッド・プロセスは設定を引き継ぐので、
+    重い処理（先読み・画像処理）を始める前に呼んで制御ループの CPU を空けておく
+    """
+    try:
+        if os.sched_getscheduler(0) != os.SCHED_FIFO:
+            return False
+        os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+        os.sched_setaffinity(0, range(os.cpu_count()))
+    except (AttributeError, OSError) as e:
+        print("通常のスケジューリングに戻せませんでした:", e, file=sys.stderr)
+        return False
+    return True
+
+
+def main():
+    # 仮想時計で 10 秒分を一瞬で実行し、重いタスクのオーバーランを確認する
+    clock = VirtualClock()
+    sched = Scheduler(clock)
+    sched.add_task("motor", 50, lambda: clock.advance(0.002), priority=0)
+    sched.add_task("imu", 100, lambda: clock.advance(0.001), priority=1)
+    heavy = [0]
+
+    def camera():
+        heavy[0] += 1
+        clock.advance(0.25 if heavy[0] % 5 == 0 else 0.05)
+
+    sched.add_task("camera", 5, camera, priority=5)
+    sched.run(duration=10.0)
+    print(sched.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+共有メモリのリングバッファによるプロセス間センサーバス
+ - カメラ処理を別プロセスに分け、同じプロセスの GIL でモーター・GPS のループが止まらないようにする
+   効くのは GIL を持ったままの処理（Python で書いた画像処理・検出結果の後処理）。numpy / cv2 の演算は
+   GIL を手放すので、スレッドのままでも制御ループはあまり遅れない。また CPU が1個なら別プロセスでも
+   OS の時分割で CPU を取り合う（python3 shm_bus.py で両方の場合を測れる）
+ - フレーム・検出結果・姿勢サンプルは multiprocessing.shared_memory 上のリングでやり取りする
+   （Queue のような pickle とコピーをしない。読み書きとも NumPy のビューで直接触る）
+ - 書き手は1プロセスだけ。スロットごとの通番スタンプで公開するのでロックは使わない
+     書き込み中: seq = 2n+1 → 書き終わり: seq = 2n+2 → 全体の件数 count = n+1
+   読み手は seq が 2n+2 であることを読む前後で確かめ、上書きされていたら捨てる
+ - Python からはメモリバリアを入れられず、ARM では書いた順に見えるとは限らない（新しい seq が中身より先に
+   見えることがある）。そこで公開時にスロットへ通番・時刻・中身の CRC32 を書いておき、読み手は読んだ中身と
+   突き合わせる。途中までしか見えていない中身や、前の周回の中身は CRC が合わないので捨てる
+ - python3 shm_bus.py          … 画像の大きさの確認と、制御ループのジッタ比較（ビジョンなし / 同一プロセスのスレッド / 別プロセス）
+                                 検出は numpy / cv2（GIL を手放す）と純 Python（GIL を持ち続ける）の2通り
+ - python3 shm_bus.py queue    … multiprocessing.Queue とのスループット・遅延比較
+"""
+
+import contextlib
+import io
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+import zlib
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from scheduler import Scheduler, configure_normal
+
+# ===== 設定 =====
+FRAME_SHAPE = (480, 640, 3)     # BGR フレーム
+FRAME_SLOTS = 4                 # フレームのリングの段数（読み手が遅れたら古いものは捨てる）
+SAMPLE_SLOTS = 256              # 検出結果・姿勢サンプルのリングの段数
+CONTROL_RATE = 100.0            # ベンチマークの制御ループ周期 (Hz)
+READ_RETRIES = 3                # 読んでいる最中に上書きされたときの再試行回数
+SOURCE_RETRY = 1.0              # 撮影に失敗したときに次を試すまでの待ち時間 (s)
+# ==================
+
+# 検出結果（ビジョン → 制御）
+DETECTION_DTYPE = np.dtype([("frame", np.int64), ("cx", np.int32), ("cy", np.int32),
+                            ("proc_ns", np.int64)])
+# 姿勢サンプル（制御 → ビジョン。コーンの方位を地図座標にするのに使う）
+POSE_DTYPE = np.dtype([("x", np.float64), ("y", np.float64), ("yaw", np.float64)])
+
+_MAGIC = 0x52494E47          # "RING"
+_HDR_MAGIC, _HDR_SLOTS, _HDR_COUNT = 0, 1, 2
+_HEADER_BYTES = 64
+
+
+def _align(n, a=64):
+    return (n + a - 1) // a * a
+
+
+class ShmRing:
+    """
+    共有メモリ上の単一書き手・複数読み手リングバッファ
+    例（書き手）:
+        ring = ShmRing.create(FRAME_SHAPE, np.uint8, slots=4)
+        frame = ring.reserve()        # 次のスロットのビュー。ここへ直接書く
+        camera.capture_into(frame)
+        ring.publish()
+    例（読み手、別プロセス）:
+        ring = ShmRing.attach(spec)   # spec は書き手の ring.spec
+        n, t_ns, frame = ring.latest(copy=False)
+        ...                           # frame を使う
+        if not ring.valid(n): ...     # 使っている間に上書きされたら結果を捨てる
+    """
+    def __init__(self, shm, shape, dtype, slots, owner):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.owner = owner
+        buf = shm.buf
+        self._header = np.ndarray((8,), np.int64, buf, 0)
+        self._seq = np.ndarray((slots,), np.int64, buf, _HEADER_BYTES)
+        self._time = np.ndarray((slots,), np.int64, buf, _HEADER_BYTES + 8 * slots)
+        self._crc = np.ndarray((slots,), np.int64, buf, _HEADER_BYTES + 16 * slots)
+        data_offset = _align(_HEADER_BYTES + 24 * slots)
+        self._data = np.ndarray((slots,) + self.shape, self.dtype, buf, data_offset)
+        self._next = int(self._header[_HDR_COUNT])  # 書き手が次に書く通番
+
+    @staticmethod
+    def nbytes_for(shape, dtype, slots):
+        item = int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+        return _align(_HEADER_BYTES + 24 * slots) + item * slots
+
+    @classmethod
+    def create(cls, shape, dtype, slots=8, name=None):
+        size = cls.nbytes_for(shape, dtype, slots)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        ring = cls(shm, shape, dtype, slots, owner=True)
+        ring._header[:] = 0
+        ring._seq[:] = 0
+        ring._header[_HDR_SLOTS] = slots
+        ring._header[_HDR_MAGIC] = _MAGIC
+        return ring
+
+    @classmethod
+    def attach(cls, spec):
+        name, shape, dtype, slots = spec
+        shm = shared_memory.SharedMemory(name=name)
+        ring = cls(shm, shape, dtype, slots, owner=False)
+        if ring._header[_HDR_MAGIC] != _MAGIC or ring._header[_HDR_SLOTS] != slots:
+            ring.close()
+            raise ValueError(f"共有メモリ {name} はリングバッファではありません")
+        return ring
+
+    @property
+    def spec(self):
+        """別プロセスで attach するための情報（pickle できるタプル）"""
+        dtype = self.dtype.descr if self.dtype.fields else self.dtype.str
+        return (self.shm.name, self.shape, dtype, self.slots)
+
+    @property
+    def count(self):
+        """これまでに公開された件数"""
+        return int(self._header[_HDR_COUNT])
+
+    @staticmethod
+    def _checksum(n, t_ns, block):
+        """通番・時刻・中身（block はスロット1つ分の連続した配列）の CRC32"""
+        return zlib.crc32(block, zlib.crc32(np.array([n, t_ns], np.int64).tobytes()))
+
+    # --- 書き手 ---
+    def reserve(self):
+        """次のスロットを書き込み中にして、そのビューを返す（publish() で公開）"""
+        n = self._next
+        slot = n % self.slots
+        self._seq[slot] = 2 * n + 1
+        return self._data[slot]
+
+    def publish(self, t_ns=None):
+        n = self._next
+        slot = n % self.slots
+        t_ns = time.monotonic_ns() if t_ns is None else t_ns
+        self._time[slot] = t_ns
+        self._crc[slot] = self._checksum(n, t_ns, self._data[slot:slot + 1])
+        self._seq[slot] = 2 * n + 2
+        self._header[_HDR_COUNT] = n + 1
+        self._next = n + 1
+        return n
+
+    def put(self, value, t_ns=None):
+        """value をコピーして公開する（小さいサンプル用）"""
+        self.reserve()
+        self._data[self._next % self.slots] = value
+        return self.publish(t_ns)
+
+    # --- 読み手 ---
+    def valid(self, n):
+        """n 番目の要素がまだ上書きされていないか（中身も CRC で確かめる）"""
+        if n < 0:
+            return False
+        slot = n % self.slots
+        return (self._seq[slot] == 2 * n + 2
+                and self._checksum(n, int(self._time[slot]), self._data[slot:slot + 1]) == self._crc[slot])
+
+    def read(self, n, copy=True):
+        """
+        n 番目の要素を (時刻 ns, 値) で返す。上書き済み・書き込み中・中身が CRC と合わないなら None
+        copy=False のときはビューを返すので、使い終わったら valid(n) で確かめること
+        """
+        slot = n % self.slots
+        want = 2 * n + 2
+        if self._seq[slot] != want:
+            return None
+        t_ns = int(self._time[slot])
+        crc = int(self._crc[slot])
+        block = self._data[slot:slot + 1]
+        if copy:
+            block = block.copy()
+        # 新しい seq が中身より先に見えていたり、読んでいる間に上書きされたりしたら CRC が合わない
+        if self._checksum(n, t_ns, block) != crc or self._seq[slot] != want:
+            return None
+        return t_ns, block[0]
+
+    def latest(self, copy=True):
+        """最新の要素を (通番, 時刻 ns, 値) で返す。まだ何も無ければ None"""
+        for _ in range(READ_RETRIES):
+            n = self.count - 1
+            if n < 0:
+                return None
+            item = self.read(n, copy)
+            if item is not None:
+                return (n,) + item
+        return None
+
+    def since(self, cursor, copy=True):
+        """
+        通番 cursor 以降の要素を読む
+        :return: ([(通番, 時刻 ns, 値), ...], 次の cursor, 取りこぼした件数)
+        """
+        count = self.count
+        first = max(cursor, count - self.slots)
+        dropped = first - cursor
+        items = []
+        for n in range(first, count):
+            item = self.read(n, copy)
+            if item is None:
+                dropped += 1
+            else:
+                items.append((n,) + item)
+        return items, count, dropped
+
+    def close(self):
+        # ビューが残っていると共有メモリを閉じられないので先に捨てる
+        self._header = self._seq = self._time = self._crc = self._data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SensorBus:
+    """
+    ビジョンプロセスと制御プロセスの間のリングをまとめたもの
+     frames     : カメラフレーム（ビジョンが書く）
+     detections : コーンの検出結果（ビジョンが書く）
+     pose       : 自己位置（制御が書く）
+    """
+    def __init__(self, rings):
+        self.rings = rings
+        for name, ring in rings.items():
+            setattr(self, name, ring)
+
+    @classmethod
+    def create(cls, frame_shape=FRAME_SHAPE):
+        return cls({
+            "frames": ShmRing.create(frame_shape, np.uint8, FRAME_SLOTS),
+            "detections": ShmRing.create((), DETECTION_DTYPE, SAMPLE_SLOTS),
+            "pose": ShmRing.create((), POSE_DTYPE, SAMPLE_SLOTS),
+        })
+
+    @classmethod
+    def attach(cls, specs):
+        return cls({name: ShmRing.attach(spec) for name, spec in specs.items()})
+
+    def specs(self):
+        return {name: ring.spec for name, ring in self.rings.items()}
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+
+
+# ---------- フレームの取得と検出 ----------
+def synthetic_source(frame, n):
+    """動く赤いコーンの入ったフレームを frame に直接描く（カメラの無い環境での動作確認用）"""
+    h, w = frame.shape[:2]
+    frame[...] = 90
+    cx = int(w / 2 + w / 4 * np.sin(n * 0.05))
+    cy = h * 2 // 3
+    frame[cy - 40:cy + 40, max(cx - 25, 0):cx + 25] = (30, 30, 220)
+
+
+def camera_source(frame, n, path="shm_frame.jpg"):
+    """camera5 で frame と同じ大きさに撮影して frame に読み込む（実機用）"""
+    import camera5
+    cv2, _ = camera5.load_cv()
+    height, width = frame.shape[:2]
+    if not camera5.take_picture(path, width=width, height=height):
+        return False
+    img = cv2.imread(path)
+    if img is None:
+        return False
+    return load_frame(frame, img, resize=cv2.resize)
+
+
+def load_frame(frame, img, resize=None):
+    """
+    画像を frame に書き込む
+    大きさが違うときは報告し、resize（cv2.resize と同じ引数）があれば縮小して使う。無ければ捨てる
+    """
+    if img.shape != frame.shape:
+        print(f"カメラ画像の大きさ {img.shape} がフレーム {frame.shape} と違います", file=sys.stderr)
+        if resize is None or img.shape[2:] != frame.shape[2:]:
+            return False
+        img = resize(img, (frame.shape[1], frame.shape[0]))
+    np.copyto(frame, img)
+    return True
+
+
+def numpy_detector(img):
+    """cv2 の無い環境用の簡易検出（赤い画素の重心）"""
+    b, g, r = img[..., 0], img[..., 1], img[..., 2]
+    mask = (r > 150) & (g < 80) & (b < 80)
+    ys, xs = np.nonzero(mask)
+    if len(xs) <= 100:
+        return (-1, -1)
+    return (int(xs.mean()), int(ys.mean()))
+
+
+def python_detector(img, step=4):
+    """
+    numpy_detector と同じ検出を純 Python のループで行う（ベンチマーク用）
+    numpy の演算と違って処理中ずっと GIL を持ち続けるので、同じプロセスの制御ループと競合する
+    """
+    rows = img[::step, ::step].tolist()
+    n = sx = sy = 0
+    for y, row in enumerate(rows):
+        for x, (b, g, r) in enumerate(row):
+            if r > 150 and g < 80 and b < 80:
+                n += 1
+                sx += x
+                sy += y
+    if n * step * step <= 100:
+        return (-1, -1)
+    return (sx * step // n, sy * step // n)
+
+
+def default_detector(name="default"):
+    """name が "python" なら python_detector、それ以外は camera5（cv2 が無ければ numpy_detector）"""
+    if name == "python":
+        return python_detector
+    try:
+        import camera5
+        camera5.load_cv()
+        return camera5.find_red_cone_in_image
+    except ImportError:
+        return numpy_detector
+
+
+def vision_step(bus, n, source, detector, clock=time.monotonic_ns):
+    """
+    1フレーム撮影して検出し、結果を公開する（フレームはコピーしない）
+    :param clock: 打刻に使う時計 (ns)（simulator.py は仮想時計を渡す）
+    """
+    frame = bus.frames.reserve()
+    if source(frame, n) is False:
+        return False
+    frame_no = bus.frames.publish(clock())
+    t0 = clock()
+    cx, cy = detector(frame)
+    t1 = clock()
+    bus.detections.put((frame_no, cx, cy, t1 - t0), t1)
+    return True
+
+
+def vision_process(specs, stop, source="synthetic", detector="default"):
+    """ビジョンプロセスの本体。stop がセットされるまで全力でフレームを処理する"""
+    configure_normal()   # 制御プロセスの SCHED_FIFO・CPU 固定を引き継いでいたら外す
+    bus = SensorBus.attach(specs)
+    src = camera_source if source == "camera" else synthetic_source
+    detector = default_detector(detector)
+    try:
+        n = 0
+        while not stop.is_set():
+            try:
+                ok = vision_step(bus, n, src, detector)
+            except Exception as e:
+                # 撮影・検出の失敗でビジョンプロセスごと止まらないようにする
+                print("ビジョン処理でエラー:", e, file=sys.stderr)
+                ok = False
+            if not ok:
+                stop.wait(SOURCE_RETRY)   # カメラが応答しないときに空回りしない
+            n += 1
+    finally:
+        bus.close()
+
+
+# ---------- ベンチマーク ----------
+def _percentiles(values_ms):
+    if not len(values_ms):
+        return "-"
+    p50, p99 = np.percentile(values_ms, [50, 99])
+    return f"p50 {p50:.3f}ms  p99 {p99:.3f}ms  最大 {np.max(values_ms):.3f}ms"
+
+
+def control_benchmark(mode, duration=3.0, detector="default"):
+    """
+    CONTROL_RATE の制御ループを回し、起床間隔のずれ（ジッタ）を測る
+    mode: "none" ビジョンなし / "thread" 同じプロセスのスレッド / "process" 別プロセス（共有メモリ）
+    detector: default_detector に渡す名前（"python" で GIL を持ち続ける検出にする）
+    """
+    bus = SensorBus.create()
+    stop_thread = threading.Event()
+    stop_proc = mp.Event()
+    worker = None
+    if mode == "thread":
+        def run():
+            detect = default_detector(detector)
+            n = 0
+            while not stop_thread.is_set():
+                vision_step(bus, n, synthetic_source, detect)
+                n += 1
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+    elif mode == "process":
+        worker = mp.Process(target=vision_process, args=(bus.specs(), stop_proc, "synthetic", detector),
+                            daemon=True)
+        worker.start()
+    time.sleep(0.5)   # ワーカーの立ち上がりを待つ
+
+    period_ns = 1e9 / CONTROL_RATE
+    state = {"last": None, "cursor": bus.detections.count, "detections": 0}
+    jitter_ms = []
+    age_ms = []
+
+    def control():
+        now = time.monotonic_ns()
+        if state["last"] is not None:
+            jitter_ms.append(abs(now - state["last"] - period_ns) / 1e6)
+        state["last"] = now
+        items, state["cursor"], _ = bus.detections.since(state["cursor"])
+        for _, t_ns, det in items:
+            state["detections"] += 1
+            age_ms.append((now - t_ns) / 1e6)
+        bus.pose.put((0.0, 0.0, 0.0))
+
+    sched = Scheduler()
+    sched.add_task("control", CONTROL_RATE, control)
+    sched.run(duration)
+
+    stop_thread.set()
+    stop_proc.set()
+    if worker is not None:
+        worker.join(timeout=5.0)
+    bus.close()
+    rate = state["detections"] / duration
+    return (f"[{mode:<7}] 制御ジッタ {_percentiles(jitter_ms)}\n"
+            f"          ビジョン {rate:.1f} 検出/s  検出→制御の遅れ {_percentiles(age_ms)}")
+
+
+def _shm_producer(spec, count, consumed):
+    ring = ShmRing.attach(spec)
+    try:
+        for n in range(count):
+            # Queue(maxsize) と条件をそろえるため、読み手が追いつくまで待つ（取りこぼさない）
+            while n - consumed.value >= ring.slots - 1:
+                time.sleep(0)
+            synthetic_source(ring.reserve(), n)
+            ring.publish()
+    finally:
+        ring.close()
+
+
+def _queue_producer(q, count, shape):
+    frame = np.empty(shape, np.uint8)
+    for n in range(count):
+        synthetic_source(frame, n)
+        q.put((time.monotonic_ns(), frame))
+    q.put(None)
+
+
+def transport_benchmark(count=1000, shape=FRAME_SHAPE):
+    """
+    フレームを別プロセスから受け取るときのスループットと遅延を共有メモリと Queue で比べる
+    どちらも書き手は FRAME_SLOTS 段より先へは進まない。時間は最初のフレームを受け取ってから測る
+    """
+    lines = []
+
+    # 共有メモリ（読み手はビューで触り、使い終わってから上書きされていないか確かめる）
+    ring = ShmRing.create(shape, np.uint8, FRAME_SLOTS)
+    consumed = mp.RawValue("q", 0)
+    proc = mp.Process(target=_shm_producer, args=(ring.spec, count, consumed))
+    proc.start()
+    cursor, got, dropped, lat, t0 = 0, 0, 0, [], None
+    while cursor < count:
+        items, cursor, d = ring.since(cursor, copy=False)
+        dropped += d
+        for n, t_ns, frame in items:
+            int(frame[0, 0, 0])   # 受け取った側で実際に触る
+            if ring.valid(n):
+                got += 1
+                lat.append((time.monotonic_ns() - t_ns) / 1e6)
+            else:
+                dropped += 1
+        if items and t0 is None:
+            t0 = time.perf_counter()
+        consumed.value = cursor
+    elapsed = time.perf_counter() - t0
+    proc.join()
+    ring.close()
+    lines.append(f"共有メモリ: {got / elapsed:7.1f} フレーム/s  取りこぼし {dropped}  遅延 {_percentiles(lat)}")
+
+    # multiprocessing.Queue（pickle して送る）
+    q = mp.Queue(maxsize=FRAME_SLOTS)
+    proc = mp.Process(target=_queue_producer, args=(q, count, shape))
+    proc.start()
+    got, lat, t0 = 0, [], None
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        if t0 is None:
+            t0 = time.perf_counter()
+        t_ns, frame = item
+        int(frame[0, 0, 0])
+        lat.append((time.monotonic_ns() - t_ns) / 1e6)
+        got += 1
+    elapsed = time.perf_counter() - t0
+    proc.join()
+    lines.append(f"Queue     : {got / elapsed:7.1f} フレーム/s  取りこぼし 0  遅延 {_percentiles(lat)}")
+    return "\n".join(lines)
+
+
+def check_load_frame():
+    """大きさの違う画像が報告され、縮小できなければ捨てられ、できれば使われることを確かめる"""
+    frame = np.zeros(FRAME_SHAPE, np.uint8)
+    full = np.full((1944, 2592, 3), 7, np.uint8)     # --width/--height を付けないときの最大解像度
+
+    def shrink(img, size):
+        w, h = size
+        return img[np.arange(h) * img.shape[0] // h][:, np.arange(w) * img.shape[1] // w]
+
+    err = io.StringIO()
+    with contextlib.redirect_stderr(err):
+        dropped = load_frame(frame, full) is False
+        resized = load_frame(frame, full, resize=shrink) is True and frame[0, 0, 0] == 7
+    reported = err.getvalue().count("と違います") == 2
+    ok = dropped and resized and reported
+    print(f"大きさの違うフレーム: 報告 {reported}  縮小なしで破棄 {dropped}  縮小して使用 {resized}  "
+          f"{'OK' if ok else 'NG'}")
+    return ok
+
+
+def main():
+    if sys.argv[1:2] == ["queue"]:
+        print(f"{FRAME_SHAPE} のフレームを別プロセスから受け取る:")
+        print(transport_benchmark())
+        return 0
+    if not check_load_frame():
+        return 1
+    print(f"CPU {os.cpu_count()} 個")
+    for detector, label in (("default", "numpy / cv2（処理中は GIL を手放す）"),
+                            ("python", "純 Python（処理中ずっと GIL を持つ）")):
+        print(f"{CONTROL_RATE:.0f}Hz の制御ループのジッタ（ビジョンを全力で回しながら。検出: {label}）:")
+        for mode in ("none", "thread", "process"):
+            print(control_benchmark(mode, detector=detector))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
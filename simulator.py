@@ -0,0 +1,1159 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+ローバーのハードウェア・イン・ザ・ループ シミュレータ
+ - 実機が無くても、リポジトリのスクリプト（モーター制御・GPS・BNO055・距離センサー・分離機構・カメラ処理）を
+   そのまま動かせるように、pigpio / RPi.GPIO / smbus2 / serial / adafruit_bno055 / pynmea2 などの偽モジュールを用意する
+ - 偽ドライバの裏には物理モデルがある
+     差動二輪: pigpio の PWM デューティ → dead_reckoning.SpeedCurve で車輪速度 → 位置・方位
+     GPS     : ノイズ入りの NMEA (GGA / RMC) を指定レートで生成し、I2C (XA1110) / UART で読ませる
+     BNO055  : レジスタモデル（オイラー角・ジャイロ・加速度・キャリブレーション状態・動作/電源モード）
+     超音波  : トリガ後のエコー HIGH 時間を occupancy_grid.CircleWorld の距離から作る
+     カメラ  : ピンホールモデルで赤いコーンの入った BGR 画像を描く
+ - 時間は scheduler.VirtualClock で進む。スクリプトの time モジュールを SimTime に差し替えるので、
+   time.sleep や busy wait も実時間を待たずに進み、実時間の何倍もの速さでミッション全体を回せる
+ - python3 simulator.py          … rover.py のミッション（着地判定 → 分離 → GPS 誘導 → カメラで接近）を実行して結果を表示
+ - python3 simulator.py latency  … 方位の外乱からモーター指令が変わるまでの端から端までの遅れを測る
+依存: numpy
+"""
+
+import contextlib
+import datetime
+import errno
+import math
+import os
+import re
+import sys
+import time
+import types
+
+import numpy as np
+
+import motor_ramp
+import occupancy_grid
+import rover
+from dead_reckoning import SpeedCurve, TRACK_WIDTH
+from fusion import LocalProjection, wrap_angle
+from scheduler import VirtualClock
+
+# ===== 設定 =====
+ORIGIN = (35.681236, 139.767125)   # 模擬フィールドの原点 (緯度, 経度)
+EPOCH = 1749254400.0               # 仮想時刻 0 の UTC（2025-06-07 00:00:00）
+PHYSICS_DT = 0.002                 # 物理モデルの積分刻み (s)
+MOTOR_TAU = 0.15                   # モーター応答の時定数 (s)
+
+GPS_RATE = 1.0                     # NMEA の出力レート (Hz)
+GPS_NOISE = 1.5                    # 測位ノイズ (m, 1σ)
+GPS_HDOP = 0.9
+YAW_NOISE = 0.5                    # BNO055 方位のノイズ (度, 1σ)
+
+SOUND_SPEED = 331.5 + 0.6 * 20     # 音速 (m/s)（kyori.py の TEMP と同じ 20℃）
+ECHO_POLL = 20e-6                  # GPIO.input 1回で進む時間 (s)（busy wait の1周ぶん）
+ECHO_TIMEOUT = 0.038               # 反射が無いときのエコー HIGH 時間 (s)（HC-SR04）
+
+CAMERA_SHAPE = (480, 640, 3)
+CAMERA_FOV = 62.2                  # 水平画角 (度)（Raspberry Pi カメラ v2）
+CAMERA_HEIGHT = 0.15               # カメラの高さ (m)
+CONE_HEIGHT = 0.7                  # コーンの高さ (m)
+CONE_RADIUS = 0.15                 # コーンの底面半径 (m)
+
+MOTOR_PINS = {"left": (12, 13), "right": (18, 19)}  # hujita_motor_control と同じ
+CUTTER_PIN = 16                    # wire16.CAREER_CUT
+CUT_TIME = 4.0                     # ニクロム線の通電がこの秒数たまると分離する
+TRIG_PIN = 17                      # kyori.py
+ECHO_PIN = 27
+
+# ==================
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+NMEA_SENTENCE_RE = re.compile(r'(\$[^$]*\*[0-9A-Fa-f]{2})')
+
+
+# ---------- 時間 ----------
+class SimTime:
+    """
+    time モジュールの代わり。仮想時計で進む
+    スクリプトの module.time をこれに差し替えると、sleep は待たずに時計を進める
+    """
+    def __init__(self, clock, epoch=EPOCH):
+        self.clock = clock
+        self.epoch = epoch
+
+    def monotonic(self):
+        return self.clock.monotonic()
+
+    def monotonic_ns(self):
+        return self.clock.now_ns()
+
+    perf_counter = monotonic
+
+    def time(self):
+        return self.epoch + self.clock.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.clock.advance(seconds)
+
+    def __getattr__(self, name):
+        # strftime などは本物を使う
+        return getattr(time, name)
+
+
+# ---------- 物理モデル ----------
+class World:
+    """
+    差動二輪ローバーと周囲の環境
+    座標は局所 ENU (m)、方位 yaw は北=0 時計回り (rad)。motor の PWM が書かれるたびに
+    その時刻まで積分してから値を変えるので、指令は区分的に一定として正確に扱える
+    """
+    def __init__(self, clock, obstacles=(), cone=(0.0, 10.0), origin=ORIGIN,
+                 left_curve=None, right_curve=None, track_width=TRACK_WIDTH, seed=0):
+        self.clock = clock
+        self.proj = LocalProjection(*origin)
+        self.obstacles = np.asarray(obstacles, dtype=float).reshape(-1, 3)
+        self.cone = cone
+        # 超音波にはコーンも映る
+        self.sonar_world = occupancy_grid.CircleWorld(
+            np.vstack([self.obstacles, [[cone[0], cone[1], CONE_RADIUS]]]))
+        self.left_curve = left_curve if left_curve is not None else SpeedCurve(0.012, 0.0, 10.0)
+        self.right_curve = right_curve if right_curve is not None else SpeedCurve(0.0115, 0.0, 11.0)
+        self.track_width = track_width
+        self.rng = np.random.default_rng(seed)
+
+        self.x = self.y = self.yaw = 0.0
+        self.vl = self.vr = 0.0
+        self.accel = 0.0
+        self.yaw_rate = 0.0
+        self.levels = {}           # ピン → PWM デューティ / デジタル出力
+        self.collisions = 0
+        self._blocked = False
+        self.cutter_on_time = 0.0
+        self.released = False
+        self.disturbance = None    # (時刻, 向き)。latency_benchmark 用
+        self.response_latencies = []
+        self._t = clock.monotonic()
+
+    def motor_duty(self, name):
+        fwd, rev = MOTOR_PINS[name]
+        return self.levels.get(fwd, 0) - self.levels.get(rev, 0)
+
+    def set_pin(self, pin, value):
+        self.sync()
+        self.levels[pin] = value
+        if self.disturbance is not None:
+            self._check_response()
+
+    def sync(self):
+        """物理を現在の仮想時刻まで進める"""
+        now = self.clock.monotonic()
+        if (self.vl == 0.0 and self.vr == 0.0 and not self.levels.get(CUTTER_PIN)
+                and self.motor_duty("left") == 0 and self.motor_duty("right") == 0):
+            # 止まっている間は積分しても何も変わらない
+            self.accel = self.yaw_rate = 0.0
+            self._t = max(self._t, now)
+            return
+        while self._t < now:
+            dt = min(PHYSICS_DT, now - self._t)
+            self._integrate(dt)
+            self._t += dt
+
+    def _integrate(self, dt):
+        k = dt / (MOTOR_TAU + dt)
+        v_old = 0.5 * (self.vl + self.vr)
+        self.vl += (self.left_curve.speed(self.motor_duty("left")) - self.vl) * k
+        self.vr += (self.right_curve.speed(self.motor_duty("right")) - self.vr) * k
+        if abs(self.vl) < 1e-6 and abs(self.vr) < 1e-6:
+            self.vl = self.vr = 0.0
+        v = 0.5 * (self.vl + self.vr)
+        self.accel = (v - v_old) / dt
+        self.yaw_rate = (self.vl - self.vr) / self.track_width
+        self.yaw = wrap_angle(self.yaw + self.yaw_rate * dt)
+        nx = self.x + v * math.sin(self.yaw) * dt
+        ny = self.y + v * math.cos(self.yaw) * dt
+        if self._inside_obstacle(nx, ny):
+            if not self._blocked:
+                self.collisions += 1
+            self._blocked = True
+            self.vl = self.vr = 0.0
+        else:
+            self._blocked = False
+            self.x, self.y = nx, ny
+
+        if self.levels.get(CUTTER_PIN):
+            self.cutter_on_time += dt
+            if self.cutter_on_time >= CUT_TIME:
+                self.released = True
+
+    def _inside_obstacle(self, x, y):
+        if self.obstacles.size == 0:
+            return False
+        d2 = (self.obstacles[:, 0] - x) ** 2 + (self.obstacles[:, 1] - y) ** 2
+        return bool((d2 < self.obstacles[:, 2] ** 2).any())
+
+    def heading_deg(self):
+        return math.degrees(self.yaw) % 360.0
+
+    def distance_to_cone(self):
+        return math.hypot(self.cone[0] - self.x, self.cone[1] - self.y)
+
+    # --- 外乱と応答（端から端までの遅れの計測） ---
+    def inject_yaw(self, degrees):
+        """機体を degrees だけ回す（時計回りが正）。逆向きの旋回指令が出るまでの時間を記録する"""
+        self.sync()
+        self.yaw = wrap_angle(self.yaw + math.radians(degrees))
+        self.disturbance = (self.clock.monotonic(), 1.0 if degrees > 0 else -1.0)
+
+    def _check_response(self):
+        t0, sign = self.disturbance
+        # 時計回りに回されたら左旋回（左 < 右）で戻そうとするはず
+        if (self.motor_duty("left") - self.motor_duty("right")) * sign < -5:
+            self.response_latencies.append(self.clock.monotonic() - t0)
+            self.disturbance = None
+
+
+# ---------- pigpio / RPi.GPIO ----------
+class SimPi(motor_ramp.RecordingPi):
+    """pigpio.pi の代わり。PWM と出力をワールドへ伝える"""
+    connected = True
+
+    def __init__(self, world, clock=None):
+        super().__init__(clock if clock is not None else world.clock)
+        self.world = world
+        self.modes = {}
+        self.frequency = {}
+        self.range = {}
+
+    def set_mode(self, pin, mode):
+        self.modes[pin] = mode
+
+    def get_mode(self, pin):
+        return self.modes.get(pin, 0)
+
+    def set_PWM_frequency(self, pin, freq):
+        self.frequency[pin] = freq
+        return freq
+
+    def set_PWM_range(self, pin, value):
+        self.range[pin] = value
+
+    def set_PWM_dutycycle(self, pin, duty):
+        super().set_PWM_dutycycle(pin, duty)
+        # PWM_RANGE を 0-100 にしている前提で、そのまま % として扱う
+        self.world.set_pin(pin, int(duty))
+
+    def get_PWM_dutycycle(self, pin):
+        return self.duty.get(pin, 0)
+
+    def write(self, pin, level):
+        self.world.set_pin(pin, 1 if level else 0)
+
+    def read(self, pin):
+        # I2C の SDA などは常に HIGH（プルアップ）として返す
+        return self.world.levels.get(pin, 1)
+
+    def stop(self):
+        pass
+
+
+class SimGPIO:
+    """RPi.GPIO の代わり（超音波センサーと motor-test.py 用）"""
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self, world, sonar):
+        self.world = world
+        self.sonar = sonar
+        self.setup_pins = {}
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, **kwargs):
+        self.setup_pins[pin] = direction
+
+    def output(self, pin, level):
+        if pin == self.sonar.trig_pin:
+            self.sonar.trigger(level)
+        else:
+            self.world.set_pin(pin, 1 if level else 0)
+
+    def input(self, pin):
+        # busy wait の1周ぶん時間を進める（これが無いと仮想時間が止まって抜けられない）
+        # エコーの変化まで間があるときは、変化の1周前まで一気に進める（分解能は ECHO_POLL のまま）
+        clock = self.world.clock
+        step = ECHO_POLL
+        if pin == self.sonar.echo_pin:
+            edge = self.sonar.next_edge()
+            if edge is not None and edge - clock.monotonic() > 2 * ECHO_POLL:
+                step = edge - clock.monotonic() - ECHO_POLL
+        clock.advance(step)
+        if pin == self.sonar.echo_pin:
+            return self.sonar.echo_level()
+        return self.world.levels.get(pin, 0)
+
+    def cleanup(self, *pins):
+        pass
+
+
+class UltrasonicModel:
+    """HC-SR04 相当。トリガの立ち下がりから少し遅れて、往復時間ぶんエコーを HIGH にする"""
+    def __init__(self, world, trig_pin=TRIG_PIN, echo_pin=ECHO_PIN, sensor_angle=0.0, noise=0.005):
+        self.world = world
+        self.trig_pin = trig_pin
+        self.echo_pin = echo_pin
+        self.sensor_angle = sensor_angle
+        self.noise = noise
+        self._trig = 0
+        self.echo_start = self.echo_end = -1.0
+        self.pings = 0
+
+    def trigger(self, level):
+        if self._trig and not level:
+            w = self.world
+            w.sync()
+            d = w.sonar_world.cast_beam(w.x, w.y, w.heading_deg() + self.sensor_angle)
+            now = w.clock.monotonic()
+            self.echo_start = now + 0.0005
+            if math.isinf(d):
+                self.echo_end = self.echo_start + ECHO_TIMEOUT
+            else:
+                d = max(0.02, d + w.rng.normal(0, self.noise))
+                self.echo_end = self.echo_start + 2.0 * d / SOUND_SPEED
+            self.pings += 1
+        self._trig = level
+
+    def next_edge(self):
+        """次にエコーの値が変わる時刻（もう変わらなければ None）"""
+        now = self.world.clock.monotonic()
+        if now < self.echo_start:
+            return self.echo_start
+        if now < self.echo_end:
+            return self.echo_end
+        return None
+
+    def echo_level(self):
+        now = self.world.clock.monotonic()
+        return 1 if self.echo_start <= now < self.echo_end else 0
+
+
+# ---------- GPS (NMEA) ----------
+def nmea_sentence(body):
+    """チェックサムを付けた NMEA 文"""
+    cs = 0
+    for c in body.encode("ascii"):
+        cs ^= c
+    return f"${body}*{cs:02X}\r\n"
+
+
+def _nmea_coord(value, is_lat):
+    hemi = ("N" if value >= 0 else "S") if is_lat else ("E" if value >= 0 else "W")
+    v = abs(value)
+    d = int(v)
+    m = (v - d) * 60.0
+    return (f"{d:02d}{m:07.4f}" if is_lat else f"{d:03d}{m:07.4f}"), hemi
+
+
+# --- pynmea2 の代わり（GPS.py / GPS-I2C.py を pynmea2 の無い環境で動かす） ---
+class NmeaParseError(ValueError):
+    """pynmea2.ParseError の代わり"""
+
+
+def _nmea_time(text):
+    if len(text) < 6:
+        return None
+    frac = float(text[6:] or 0) if text[6:7] == "." else 0.0
+    return datetime.time(int(text[0:2]), int(text[2:4]), int(text[4:6]), int(round(frac * 1e6)) % 1000000)
+
+
+def _nmea_date(text):
+    if len(text) != 6:
+        return None
+    return datetime.date(2000 + int(text[4:6]), int(text[2:4]), int(text[0:2]))
+
+
+def _nmea_float(text):
+    return float(text) if text else None
+
+
+def _nmea_degrees(value, hemi, width):
+    """ddmm.mmmm / dddmm.mmmm を度に（空なら ValueError。pynmea2 と同じく呼んだ側で扱う）"""
+    deg = int(value[:width]) + float(value[width:]) / 60.0
+    return -deg if hemi in ("S", "W") else deg
+
+
+class SimNmeaSentence:
+    """pynmea2 の文オブジェクトの代わり。フィールド名と型は pynmea2 に合わせる"""
+    fields = ()
+    types = {}
+
+    def __init__(self, talker, sentence_type, data):
+        self.talker = talker
+        self.sentence_type = sentence_type
+        self.data = data
+        for i, name in enumerate(self.fields):
+            text = data[i] if i < len(data) else ""
+            conv = self.types.get(name)
+            try:
+                setattr(self, name, conv(text) if conv is not None else text)
+            except ValueError:
+                setattr(self, name, None)
+
+
+class SimGGA(SimNmeaSentence):
+    fields = ("timestamp", "lat", "lat_dir", "lon", "lon_dir", "gps_qual", "num_sats", "horizontal_dil",
+              "altitude", "altitude_units", "geo_sep", "geo_sep_units", "age_gps_data", "ref_station_id")
+    types = {"timestamp": _nmea_time, "gps_qual": int, "altitude": _nmea_float}
+
+    @property
+    def latitude(self):
+        return _nmea_degrees(self.lat, self.lat_dir, 2)
+
+    @property
+    def longitude(self):
+        return _nmea_degrees(self.lon, self.lon_dir, 3)
+
+    @property
+    def gps_qual_str(self):
+        return {0: "測位無し", 1: "GPS", 2: "DGPS"}.get(self.gps_qual, str(self.gps_qual))
+
+
+class SimRMC(SimNmeaSentence):
+    fields = ("timestamp", "status", "lat", "lat_dir", "lon", "lon_dir", "spd_over_grnd", "true_course",
+              "datestamp", "mag_variation", "mag_var_dir", "mode_indicator")
+    types = {"timestamp": _nmea_time, "spd_over_grnd": _nmea_float, "true_course": _nmea_float,
+             "datestamp": _nmea_date}
+
+    @property
+    def latitude(self):
+        return _nmea_degrees(self.lat, self.lat_dir, 2)
+
+    @property
+    def longitude(self):
+        return _nmea_degrees(self.lon, self.lon_dir, 3)
+
+
+def nmea_parse(line):
+    """pynmea2.parse の代わり。チェックサムを確かめて GGA / RMC はフィールドを持つオブジェクトにする"""
+    m = re.match(r'\$([^*$]*)\*([0-9A-Fa-f]{2})$', line.strip())
+    if not m:
+        raise NmeaParseError(f"NMEA 文ではありません: {line!r}")
+    body = m.group(1)
+    if nmea_sentence(body)[-4:-2] != m.group(2).upper():
+        raise NmeaParseError(f"チェックサムが合いません: {line!r}")
+    head, *data = body.split(",")
+    talker, sentence_type = head[:2], head[2:]
+    cls = {"GGA": SimGGA, "RMC": SimRMC}.get(sentence_type, SimNmeaSentence)
+    return cls(talker, sentence_type, data)
+
+
+class NmeaGps:
+    """
+    NMEA を出す GPS モジュール（XA1110 / MT3333 相当）
+    PMTK220（出力周期）と PMTK161（スタンバイ）を受け付け、受けたコマンドを commands に記録する
+    """
+    def __init__(self, world, rate=GPS_RATE, noise=GPS_NOISE, hdop=GPS_HDOP):
+        self.world = world
+        self.rate = rate
+        self.noise = noise
+        self.hdop = hdop
+        self.buffer = bytearray()
+        self.standby = False
+        self.commands = []
+        self.fixes = 0
+        self._next = world.clock.monotonic() + 1.0 / rate
+
+    def poll(self):
+        """前回から今までに出力されるはずの文をバッファに積む"""
+        now = self.world.clock.monotonic()
+        if self.standby:
+            self._next = now + 1.0 / self.rate
+            return
+        while self._next <= now:
+            self._emit(self._next)
+            self._next += 1.0 / self.rate
+
+    def _emit(self, t):
+        w = self.world
+        w.sync()
+        e = w.x + w.rng.normal(0, self.noise)
+        n = w.y + w.rng.normal(0, self.noise)
+        lat, lon = w.proj.to_latlon(e, n)
+        lat_s, ns = _nmea_coord(float(lat), True)
+        lon_s, ew = _nmea_coord(float(lon), False)
+        utc = time.gmtime(EPOCH + t)
+        hms = time.strftime("%H%M%S", utc) + f".{int((t % 1) * 100):02d}"
+        dmy = time.strftime("%d%m%y", utc)
+        speed_kn = abs(0.5 * (w.vl + w.vr)) / 0.514444
+        self.buffer += nmea_sentence(
+            f"GPGGA,{hms},{lat_s},{ns},{lon_s},{ew},1,09,{self.hdop:.1f},12.0,M,39.0,M,,").encode()
+        self.buffer += nmea_sentence(
+            f"GPRMC,{hms},A,{lat_s},{ns},{lon_s},{ew},{speed_kn:.2f},{w.heading_deg():.1f},{dmy},,,A").encode()
+        self.fixes += 1
+
+    def read(self, n):
+        """n バイト読む。データが無いぶんは XA1110 と同じく改行で埋める"""
+        self.poll()
+        chunk = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return chunk + b"\n" * (n - len(chunk))
+
+    def readline(self):
+        self.poll()
+        i = self.buffer.find(b"\n")
+        if i < 0:
+            return b""
+        line = bytes(self.buffer[:i + 1])
+        del self.buffer[:i + 1]
+        return line
+
+    def write(self, data):
+        """PMTK コマンドを受け付ける（何か書き込まれるとスタンバイから復帰する）"""
+        self.standby = False
+        for s in NMEA_SENTENCE_RE.findall(data.decode("ascii", "ignore")):
+            fields = s[1:s.index("*")].split(",")
+            self.commands.append((self.world.clock.monotonic(), ",".join(fields)))
+            if fields[0] == "PMTK220" and len(fields) > 1:
+                self.rate = 1000.0 / max(100, int(fields[1]))
+            elif fields[0] == "PMTK161":
+                self.standby = True
+                self.buffer.clear()
+
+
+# ---------- BNO055 ----------
+REG_CHIP_ID = 0x00
+REG_ACC_DATA = 0x08
+REG_MAG_DATA = 0x0E
+REG_GYR_DATA = 0x14
+REG_EUL_DATA = 0x1A
+REG_QUA_DATA = 0x20
+REG_LIA_DATA = 0x28
+REG_GRV_DATA = 0x2E
+REG_TEMP = 0x34
+REG_CALIB_STAT = 0x35
+REG_OPR_MODE = 0x3D
+REG_PWR_MODE = 0x3E
+REG_ACC_OFFSET = 0x55
+REG_MAG_OFFSET = 0x5B
+REG_GYR_OFFSET = 0x61
+REG_ACC_RADIUS = 0x67
+REG_MAG_RADIUS = 0x69
+CONFIG_MODE = 0x00
+NDOF_MODE = 0x0C
+POWER_NORMAL, POWER_LOW, POWER_SUSPEND = 0, 1, 2
+
+
+class Bno055Model:
+    """
+    BNO055 のレジスタモデル
+     - データレジスタは読まれた時点のワールドの状態から作る（CONFIG モード・サスペンド中は更新しない）
+     - オフセットレジスタは CONFIG モードのときだけ書ける（実機と同じ）
+     - キャリブレーション状態は時間経過と回転量で上がっていく
+     - 動作モード・電源モードの書き込みは mode_log に記録する
+    """
+    def __init__(self, world, yaw_noise=YAW_NOISE):
+        self.world = world
+        self.yaw_noise = yaw_noise
+        self.regs = bytearray(0x80)
+        self.regs[REG_CHIP_ID] = 0xA0
+        self.regs[REG_OPR_MODE] = CONFIG_MODE
+        self.regs[REG_PWR_MODE] = POWER_NORMAL
+        self.pointer = 0
+        self.mode_log = []
+        self.start = world.clock.monotonic()
+        self.rotation = 0.0          # 磁気キャリブレーション用の累積回転 (度)
+        self._last_yaw = world.yaw
+
+    def _put(self, reg, values, scale):
+        for i, v in enumerate(values):
+            raw = int(round(v * scale))
+            raw = max(-32768, min(32767, raw)) & 0xFFFF
+            self.regs[reg + 2 * i] = raw & 0xFF
+            self.regs[reg + 2 * i + 1] = raw >> 8
+
+    def _refresh(self):
+        w = self.world
+        w.sync()
+        self.rotation += abs(math.degrees(wrap_angle(w.yaw - self._last_yaw)))
+        self._last_yaw = w.yaw
+        heading = (w.heading_deg() + w.rng.normal(0, self.yaw_noise)) % 360.0
+        h = math.radians(heading)
+        self._put(REG_EUL_DATA, (heading, 0.0, 0.0), 16)
+        # z 軸は上向き（反時計回りが正）なので、時計回りのヨーレートとは符号が逆
+        self._put(REG_GYR_DATA, (0.0, 0.0, -math.degrees(w.yaw_rate)), 16)
+        self._put(REG_LIA_DATA, (w.accel, 0.0, 0.0), 100)
+        self._put(REG_GRV_DATA, (0.0, 0.0, 9.81), 100)
+        self._put(REG_ACC_DATA, (w.accel, 0.0, 9.81), 100)
+        self._put(REG_MAG_DATA, (30.0 * math.cos(h), 30.0 * math.sin(h), -35.0), 16)
+        self._put(REG_QUA_DATA, (math.cos(-h / 2), 0.0, 0.0, math.sin(-h / 2)), 1 << 14)
+        self.regs[REG_TEMP] = 25
+        elapsed = w.clock.monotonic() - self.start
+        gyr = min(3, int(elapsed / 1.0))
+        acc = min(3, int(elapsed / 3.0))
+        mag = min(3, int(self.rotation / 120.0))
+        sys_ = min(gyr, mag)
+        self.regs[REG_CALIB_STAT] = (sys_ << 6) | (gyr << 4) | (acc << 2) | mag
+
+    def _data_live(self):
+        return (self.regs[REG_OPR_MODE] & 0x0F) != CONFIG_MODE and self.regs[REG_PWR_MODE] != POWER_SUSPEND
+
+    def read_register(self, reg):
+        if REG_ACC_DATA <= reg <= REG_CALIB_STAT and self._data_live():
+            self._refresh()
+        return self.regs[reg]
+
+    def read_block(self, reg, n):
+        if REG_ACC_DATA <= reg <= REG_CALIB_STAT and self._data_live():
+            self._refresh()
+        return bytes(self.regs[reg:reg + n])
+
+    def write_register(self, reg, value):
+        t = self.world.clock.monotonic()
+        if reg in (REG_OPR_MODE, REG_PWR_MODE):
+            self.mode_log.append((t, reg, value))
+            if reg == REG_OPR_MODE and value != CONFIG_MODE and self.regs[REG_MAG_RADIUS]:
+                # 保存済みのオフセットを書き戻してあれば、磁気キャリブレーションはすぐ済む
+                self.rotation = max(self.rotation, 360.0)
+        elif REG_ACC_OFFSET <= reg <= REG_MAG_RADIUS + 1 and (self.regs[REG_OPR_MODE] & 0x0F) != CONFIG_MODE:
+            return
+        self.regs[reg] = value & 0xFF
+
+    # --- I2C のバイト列として読み書きする（smbus2 の i2c_rdwr 用） ---
+    def write(self, data):
+        self.pointer = data[0]
+        for i, v in enumerate(data[1:]):
+            self.write_register(self.pointer + i, v)
+
+    def read(self, n):
+        return self.read_block(self.pointer, n)
+
+
+class SimBno055:
+    """adafruit_bno055.BNO055_I2C と同じ属性で Bno055Model を読み書きする"""
+    def __init__(self, model):
+        self.model = model
+        self.model.write_register(REG_OPR_MODE, NDOF_MODE)
+
+    # adafruit_bno055 と同じ名前のレジスタ直接アクセス（電源モードの切り替えなどで使う）
+    def _read_register(self, register):
+        return self.model.read_register(register)
+
+    def _write_register(self, register, value):
+        self.model.write_register(register, value)
+
+    def _vec(self, reg, scale, n=3):
+        raw = np.frombuffer(self.model.read_block(reg, 2 * n), dtype="<i2")
+        return tuple(float(v) / scale for v in raw)
+
+    def _raw3(self, reg):
+        return tuple(int(v) for v in np.frombuffer(self.model.read_block(reg, 6), dtype="<i2"))
+
+    def _write3(self, reg, values):
+        for i, v in enumerate(values):
+            raw = int(v) & 0xFFFF
+            self.model.write_register(reg + 2 * i, raw & 0xFF)
+            self.model.write_register(reg + 2 * i + 1, raw >> 8)
+
+    @property
+    def euler(self):
+        return self._vec(REG_EUL_DATA, 16.0)
+
+    @property
+    def gyro(self):
+        return tuple(math.radians(v) for v in self._vec(REG_GYR_DATA, 16.0))
+
+    @property
+    def acceleration(self):
+        return self._vec(REG_ACC_DATA, 100.0)
+
+    @property
+    def linear_acceleration(self):
+        return self._vec(REG_LIA_DATA, 100.0)
+
+    @property
+    def gravity(self):
+        return self._vec(REG_GRV_DATA, 100.0)
+
+    @property
+    def magnetic(self):
+        return self._vec(REG_MAG_DATA, 16.0)
+
+    @property
+    def quaternion(self):
+        return self._vec(REG_QUA_DATA, float(1 << 14), 4)
+
+    @property
+    def temperature(self):
+        return self.model.read_register(REG_TEMP)
+
+    @property
+    def calibration_status(self):
+        s = self.model.read_register(REG_CALIB_STAT)
+        return (s >> 6) & 3, (s >> 4) & 3, (s >> 2) & 3, s & 3
+
+    @property
+    def calibrated(self):
+        return all(v == 3 for v in self.calibration_status)
+
+    @property
+    def mode(self):
+        return self.model.read_register(REG_OPR_MODE) & 0x0F
+
+    @mode.setter
+    def mode(self, value):
+        self.model.write_register(REG_OPR_MODE, value)
+
+    @property
+    def offsets_accelerometer(self):
+        return self._raw3(REG_ACC_OFFSET)
+
+    @offsets_accelerometer.setter
+    def offsets_accelerometer(self, values):
+        self._write3(REG_ACC_OFFSET, values)
+
+    @property
+    def offsets_magnetometer(self):
+        return self._raw3(REG_MAG_OFFSET)
+
+    @offsets_magnetometer.setter
+    def offsets_magnetometer(self, values):
+        self._write3(REG_MAG_OFFSET, values)
+
+    @property
+    def offsets_gyroscope(self):
+        return self._raw3(REG_GYR_OFFSET)
+
+    @offsets_gyroscope.setter
+    def offsets_gyroscope(self, values):
+        self._write3(REG_GYR_OFFSET, values)
+
+    @property
+    def radius_accelerometer(self):
+        return self._raw3(REG_ACC_RADIUS)[0]
+
+    @radius_accelerometer.setter
+    def radius_accelerometer(self, value):
+        self._write3(REG_ACC_RADIUS, (value,))
+
+    @property
+    def radius_magnetometer(self):
+        return self._raw3(REG_MAG_RADIUS)[0]
+
+    @radius_magnetometer.setter
+    def radius_magnetometer(self, value):
+        self._write3(REG_MAG_RADIUS, (value,))
+
+
+# ---------- I2C / UART ----------
+class SimI2cMsg:
+    """smbus2.i2c_msg の代わり"""
+    def __init__(self, addr, is_read, data):
+        self.addr = addr
+        self.is_read = is_read
+        self.buf = bytearray(data)
+        self.len = len(self.buf)
+
+    @classmethod
+    def read(cls, addr, length):
+        return cls(addr, True, bytes(length))
+
+    @classmethod
+    def write(cls, addr, data):
+        return cls(addr, False, bytes(data))
+
+    def __iter__(self):
+        return iter(self.buf)
+
+    def __len__(self):
+        return self.len
+
+    def __bytes__(self):
+        return bytes(self.buf)
+
+
+class SimSMBus:
+    """smbus2.SMBus の代わり。アドレスごとのデバイスモデルへ読み書きを渡す"""
+    def __init__(self, devices, bus=None):
+        self.devices = devices
+        self.bus = bus
+        self.closed = bus is None
+
+    def open(self, bus):
+        self.bus = bus
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _device(self, addr):
+        if self.closed:
+            raise OSError(errno.EBADF, "バスが開かれていません")
+        dev = self.devices.get(addr)
+        if dev is None:
+            raise OSError(errno.EREMOTEIO, f"0x{addr:02X} が応答しません")
+        return dev
+
+    def i2c_rdwr(self, *msgs):
+        for msg in msgs:
+            dev = self._device(msg.addr)
+            if msg.is_read:
+                msg.buf[:] = dev.read(msg.len)
+            else:
+                dev.write(bytes(msg.buf))
+
+    def read_byte_data(self, addr, reg):
+        return self._device(addr).read_register(reg)
+
+    def write_byte_data(self, addr, reg, value):
+        self._device(addr).write_register(reg, value)
+
+    def read_i2c_block_data(self, addr, reg, length):
+        return list(self._device(addr).read_block(reg, length))
+
+    def write_i2c_block_data(self, addr, reg, data):
+        self._device(addr).write(bytes([reg]) + bytes(data))
+
+
+class SimSerial:
+    """serial.Serial の代わり（UART 接続の GPS）"""
+    def __init__(self, gps, port=None, baudrate=9600, timeout=None, **kwargs):
+        self.gps = gps
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        self.gps.poll()
+        return len(self.gps.buffer)
+
+    def read(self, n=1):
+        self.gps.poll()
+        chunk = bytes(self.gps.buffer[:n])
+        del self.gps.buffer[:n]
+        return chunk
+
+    def readline(self):
+        return self.gps.readline()
+
+    def write(self, data):
+        self.gps.write(bytes(data))
+        return len(data)
+
+    def close(self):
+        self.is_open = False
+
+
+class SimTitanGps:
+    """qwiic_titan_gps.QwiicTitanGps の代わり（GPS-test.py 用）"""
+    def __init__(self, gps):
+        self.gps = gps
+        self.connected = True
+        self.gnss_messages = {}
+
+    def begin(self):
+        return True
+
+    def get_nmea_data(self):
+        got = False
+        line = self.gps.readline()
+        while line:
+            try:
+                msg = nmea_parse(line.decode("ascii", "ignore"))
+            except NmeaParseError:
+                msg = None
+            if isinstance(msg, SimGGA) and msg.gps_qual:
+                self.gnss_messages.update(Latitude=msg.latitude, Longitude=msg.longitude,
+                                          NumSats=int(msg.num_sats), FixType=msg.gps_qual,
+                                          HDOP=float(msg.horizontal_dil))
+                got = True
+            line = self.gps.readline()
+        return got
+
+    def end(self):
+        pass
+
+
+# ---------- カメラ ----------
+class CameraModel:
+    """ピンホールカメラ。ローバーの位置と向きから、赤いコーンの写った BGR 画像を描く"""
+    def __init__(self, world, shape=CAMERA_SHAPE, fov=CAMERA_FOV, noise=6.0):
+        self.world = world
+        self.shape = shape
+        h, w = shape[:2]
+        self.focal = (w / 2) / math.tan(math.radians(fov) / 2)
+        self.noise = noise
+        self._yy, self._xx = np.mgrid[0:h, 0:w]
+        self._background = np.empty(shape, np.uint8)
+        self._background[:h // 2] = (200, 170, 130)   # 空
+        self._background[h // 2:] = (70, 90, 100)     # 地面
+        self._noise = world.rng.normal(0, noise, shape).astype(np.int16)
+        self._work = np.empty(shape, np.int16)
+        self.frames = 0
+
+    def cone_projection(self):
+        """コーンの (画像上の中心 x, 上端 y, 下端 y, 底面の半幅) 。写らなければ None"""
+        w = self.world
+        w.sync()
+        dx, dy = w.cone[0] - w.x, w.cone[1] - w.y
+        dist = math.hypot(dx, dy)
+        rel = wrap_angle(math.atan2(dx, dy) - w.yaw)
+        if dist < 0.1 or abs(rel) >= math.radians(CAMERA_FOV) / 2:
+            return None
+        depth = dist * math.cos(rel)
+        h, width = self.shape[:2]
+        u = width / 2 + self.focal * math.tan(rel)
+        base = h / 2 + self.focal * CAMERA_HEIGHT / depth
+        top = base - self.focal * CONE_HEIGHT / depth
+        half = self.focal * CONE_RADIUS / depth
+        return u, top, base, half
+
+    def capture(self, frame=None, n=0):
+        """画像を描く（frame を渡せばそこへ直接書く。shm_bus の source と同じ呼び方）"""
+        if frame is None:
+            frame = np.empty(self.shape, np.uint8)
+        img = self._work
+        np.copyto(img, self._background)
+        cone = self.cone_projection()
+        if cone is not None:
+            u, top, base, half = cone
+            frac = (self._yy - top) / max(base - top, 1e-6)
+            mask = (frac >= 0) & (frac <= 1) & (np.abs(self._xx - u) <= half * frac + 1)
+            img[mask] = (40, 40, 210)
+        # 作っておいたノイズをフレームごとにずらして使う（毎回乱数を作らない）
+        img += np.roll(self._noise, (self.frames * 7919) % self.shape[1], axis=1)
+        np.clip(img, 0, 255, out=img)
+        np.copyto(frame, img, casting="unsafe")
+        self.frames += 1
+        return frame
+
+
+# ---------- シミュレータ全体 ----------
+DEFAULT_OBSTACLES = ((0.3, 7.0, 0.6), (3.8, 14.0, 0.5), (1.0, 19.0, 0.4))
+DEFAULT_CONE = (4.0, 25.0)
+
+
+class Simulator:
+    """
+    仮想時計・ワールド・各センサーモデル・偽ドライバモジュールをまとめたもの
+    例:
+        sim = Simulator()
+        kyori = sim.load_script("kyori")   # 偽の RPi.GPIO と仮想時間で読み込む
+        kyori.setup()
+        print(kyori.measure())             # 前方の障害物までの距離 (cm)
+    """
+    def __init__(self, obstacles=DEFAULT_OBSTACLES, cone=DEFAULT_CONE, seed=0,
+                 gps_rate=GPS_RATE, gps_noise=GPS_NOISE):
+        self.clock = VirtualClock()
+        self.time = SimTime(self.clock)
+        self.world = World(self.clock, obstacles, cone, seed=seed)
+        self.gps = NmeaGps(self.world, gps_rate, gps_noise)
+        self.bno = Bno055Model(self.world)
+        self.sonar = UltrasonicModel(self.world)
+        self.camera = CameraModel(self.world)
+        self.gpio = SimGPIO(self.world, self.sonar)
+        self.devices = {0x10: self.gps, 0x28: self.bno}
+        self.pis = []
+        self._timebase = None
+
+    def pi(self, *args, **kwargs):
+        p = SimPi(self.world)
+        self.pis.append(p)
+        return p
+
+    def smbus(self, bus=None):
+        return SimSMBus(self.devices, bus)
+
+    def modules(self):
+        """偽ドライバのモジュール（sys.modules に入れる名前 → モジュール）"""
+        def module(name, **attrs):
+            m = types.ModuleType(name)
+            m.__dict__.update(attrs)
+            return m
+
+        gpio = module("RPi.GPIO", **{k: getattr(self.gpio, k) for k in dir(self.gpio) if not k.startswith("_")})
+        return {
+            "pigpio": module("pigpio", pi=self.pi, OUTPUT=1, INPUT=0, ALT0=4, PUD_UP=2),
+            "RPi": module("RPi", GPIO=gpio),
+            "RPi.GPIO": gpio,
+            "smbus2": module("smbus2", SMBus=self.smbus, i2c_msg=SimI2cMsg),
+            "serial": module("serial", Serial=lambda *a, **k: SimSerial(self.gps, *a, **k),
+                             SerialException=OSError),
+            "board": module("board", SCL="SCL", SDA="SDA"),
+            "busio": module("busio", I2C=lambda scl, sda, **k: (scl, sda)),
+            "adafruit_bno055": module("adafruit_bno055",
+                                      BNO055_I2C=lambda i2c, address=0x28: SimBno055(self.bno),
+                                      CONFIG_MODE=CONFIG_MODE, NDOF_MODE=NDOF_MODE),
+            "qwiic_titan_gps": module("qwiic_titan_gps", QwiicTitanGps=lambda *a: SimTitanGps(self.gps)),
+            "pynmea2": module("pynmea2", parse=nmea_parse, ParseError=NmeaParseError, GGA=SimGGA, RMC=SimRMC,
+                              types=types.SimpleNamespace(talker=types.SimpleNamespace(GGA=SimGGA, RMC=SimRMC))),
+        }
+
+    def virtual_timebase(self):
+        """仮想時計で動く timebase（読み込んだスクリプトの timebase.now() も仮想時間にする）"""
+        if self._timebase is None:
+            self._timebase = self.load_script("timebase")
+        return self._timebase
+
+    @contextlib.contextmanager
+    def installed(self):
+        """偽ドライバのモジュールを一時的に sys.modules に入れる（関数の中でドライバを import するスクリプト用）"""
+        fakes = self.modules()
+        saved = {k: sys.modules.get(k) for k in fakes}
+        sys.modules.update(fakes)
+        try:
+            yield fakes
+        finally:
+            for k, v in saved.items():
+                if v is None:
+                    sys.modules.pop(k, None)
+                else:
+                    sys.modules[k] = v
+
+    def load_script(self, name):
+        """
+        リポジトリのスクリプトを偽ドライバで読み込む（sys.modules には登録しない）
+        ハイフン・ドット入りのファイル名もそのまま渡せる。time は仮想時間に差し替える
+        """
+        import importlib.util
+        with self.installed():
+            alias = "sim_" + "".join(c if c.isalnum() else "_" for c in name)
+            spec = importlib.util.spec_from_file_location(alias, os.path.join(ROOT, name + ".py"))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        if hasattr(module, "time"):
+            module.time = self.time
+        if hasattr(module, "timebase"):
+            module.timebase = self.virtual_timebase()
+        return module
+
+
+# ---------- ミッション ----------
+class Mission(rover.Mission):
+    """
+    rover.Mission（着地判定 → 分離 → GPS 誘導 → カメラで接近）を偽ドライバと仮想時計で動かす
+    サブシステムは rover.py と同じ初期化関数で立ち上げ、スクリプトだけ Simulator.load_script で読む
+    違うのはランプを専用スレッドでなくスケジューラのタスクにすることと、カメラの撮影・検出を
+    ビジョンプロセスでなくカメラタスクの中で行うこと（結果は実機と同じく SensorBus を通して受け取る）
+    """
+    def __init__(self, sim, goal=None, verbose=True):
+        self.sim = sim
+        w = sim.world
+        goal = goal if goal is not None else tuple(float(v) for v in w.proj.to_latlon(*w.cone))
+        subsystems = rover.default_subsystems(loader=sim.load_script)
+        subsystems["motor"].init_func = lambda motor: rover._init_motor(motor, scheduler=self.sched)
+        subsystems["camera"] = rover.Subsystem("camera", ["shm_bus"], self._init_camera, rover._stop_camera)
+        self.frames = 0
+        super().__init__(rover.Rover(subsystems, preload=False), goal, clock=sim.clock, verbose=verbose)
+        # 仮想時計は実時間の処理中は進まないので、立ち上げはその場で行っても他のタスクは遅れない（結果も毎回同じ）
+        self.background_startup = False
+
+    def start_subsystems(self, phase):
+        # acceleration.init_sensor() などは関数の中でドライバを import するので、その間も偽物を見せる
+        with self.sim.installed():
+            return super().start_subsystems(phase)
+
+    def _switch_phase(self, phase, failed):
+        with self.sim.installed():
+            super()._switch_phase(phase, failed)
+
+    def cut_finished(self):
+        super().cut_finished()
+        if not self.sim.world.released:
+            self.say("分離に失敗")
+
+    def _init_camera(self, shm_bus):
+        self.detector = shm_bus.default_detector()
+        return shm_bus.SensorBus.create(CAMERA_SHAPE), None, None
+
+    def detect(self):
+        # 仮想時計で撮影するので、ビジョンプロセスの 1 周分をここで回してから実機と同じ読み方をする
+        bus = self.rover.get("camera")[0]
+        shm_bus = self.rover.subsystems["camera"].module
+        shm_bus.vision_step(bus, self.frames, self.sim.camera.capture, self.detector, clock=self.sim.clock.now_ns)
+        self.frames += 1
+        return super().detect()
+
+    def run(self, timeout=180.0):
+        """ミッションを実行して結果の辞書を返す"""
+        sim = self.sim
+        wall0 = time.perf_counter()
+        try:
+            phase = super().run(timeout)
+        finally:
+            self.rover.shutdown()
+        sim_time = sim.clock.monotonic()
+        wall = time.perf_counter() - wall0
+        w = sim.world
+        return {
+            "phase": phase,
+            "sim_time": sim_time,
+            "drive_time": sim_time - self.phase_times.get("navigation", sim_time),
+            "wall_time": wall,
+            "speedup": sim_time / wall,
+            "cone_distance": w.distance_to_cone(),
+            "collisions": w.collisions,
+            "gps_fixes": sim.gps.fixes,
+            "pings": sim.sonar.pings,
+            "camera_frames": sim.camera.frames,
+            "pwm_writes": sum(len(p.log) for p in sim.pis),
+        }
+
+
+def latency_benchmark(trials=40, seed=1):
+    """
+    走行中に機体の向きを外乱で ±40° 変え、逆向きの旋回指令が PWM に現れるまでの時間を測る
+    （BNO055 読み取り → EKF → 誘導制御 → ランプ → pigpio の端から端まで。仮想時間）
+    """
+    sim = Simulator(obstacles=(), cone=(0.0, 2000.0), seed=seed)
+    mission = Mission(sim, verbose=False)
+    mission.enter_phase("standby")       # 分離は飛ばして IMU と航法系だけ立ち上げる
+    mission.enter_phase("navigation")
+    rng = np.random.default_rng(seed)
+    wall0 = time.perf_counter()
+    mission.sched.run(duration=5.0)      # GPS の初期化と直進の安定を待つ
+    for _ in range(trials):
+        sim.world.inject_yaw(40.0 if rng.random() < 0.5 else -40.0)
+        mission.sched.run(duration=3.0 + rng.random())
+    wall = time.perf_counter() - wall0
+    lat = np.array(sim.world.response_latencies) * 1000
+    return lat, sim.clock.monotonic() / wall
+
+
+def main():
+    if sys.argv[1:2] == ["latency"]:
+        lat, speedup = latency_benchmark()
+        print(f"外乱 → モーター指令の遅れ（IMU {rover.IMU_RATE:.0f}Hz, 制御 {rover.CONTROL_RATE:.0f}Hz, "
+              f"ランプ {motor_ramp.RAMP_RATE:.0f}Hz）: {len(lat)} 回")
+        if len(lat):
+            p50, p99 = np.percentile(lat, [50, 99])
+            print(f"  p50 {p50:.1f}ms  p99 {p99:.1f}ms  最大 {lat.max():.1f}ms")
+        print(f"  実時間の {speedup:.0f} 倍で実行")
+        return 0
+
+    sim = Simulator()
+    result = Mission(sim).run()
+    print("-" * 40)
+    print(f"結果: {result['phase']}  コーンまで {result['cone_distance']:.2f}m  衝突 {result['collisions']} 回")
+    print(f"仮想時間 {result['sim_time']:.1f}s（走行 {result['drive_time']:.1f}s）を "
+          f"{result['wall_time']:.2f}s で実行（実時間の {result['speedup']:.0f} 倍）")
+    print(f"GPS 測位 {result['gps_fixes']} 回 / 超音波 {result['pings']} 回 / "
+          f"カメラ {result['camera_frames']} 枚 / PWM 書き込み {result['pwm_writes']} 回")
+    return 0 if result["phase"] == "goal" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
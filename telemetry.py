@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+低速無線（9600bps の LoRa / XBee）向けの小さなテレメトリフレーム
+ - 各値を固定小数点に量子化し、前回送ったフレームとの差分をビット詰めで送る
+ - フレームは SYNC・ヘッダ・ペイロード・CRC16 で、キーフレームを定期的に挟んで欠落から復帰
+ - 優先度つきで、1秒あたりのバイト予算に収まるように送るストリームを選ぶ
+ - 地上局側の TelemetryDecoder で各ストリームを復元する
+ - python3 telemetry.py で pty をループバック回線に見立てて往復・圧縮率・処理速度を確認
+
+フレーム構成（バイト）:
+    [0xA5][ストリームID(5bit) | キー(1bit) | 予約(2bit)][連番][ペイロード長][ペイロード...][CRC16(2)]
+ペイロード（フィールドごと）:
+    キーフレーム   : 値そのもの（bits ビット）
+    差分フレーム   : 2bit のタグ 00=変化なし / 01=差分(delta_bits ビット) / 10=値そのもの
+"""
+
+import os
+import sys
+import time
+
+# ===== 設定 =====
+SYNC = 0xA5
+HEADER_SIZE = 4
+CRC_SIZE = 2
+KEYFRAME_INTERVAL = 10      # この回数に1回はキーフレームを送る
+DEFAULT_BUDGET = 600        # 1秒あたりのバイト予算（9600bps の約半分）
+MAX_PAYLOAD = 255
+# ==================
+
+TAG_SAME = 0
+TAG_DELTA = 1
+TAG_FULL = 2
+
+ACTIONS = ("停止中", "前進中", "後進中", "左カーブ旋回中", "右カーブ旋回中",
+           "左信地旋回中", "右信地旋回中", "ブレーキ中", "障害物のため停止")
+
+
+def action_code(current_action):
+    """hujita_motor_control の current_action 文字列を番号にする（未知なら None）"""
+    try:
+        return ACTIONS.index(current_action)
+    except ValueError:
+        return None
+
+
+def action_name(code):
+    if code is None or not 0 <= int(code) < len(ACTIONS):
+        return None
+    return ACTIONS[int(code)]
+
+
+# --- CRC ---
+def _make_crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+
+_CRC_TABLE = _make_crc_table()
+
+
+def crc16(data, crc=0xFFFF):
+    """CRC-16/CCITT-FALSE"""
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC_TABLE[((crc >> 8) ^ b) & 0xFF]
+    return crc
+
+
+# --- ビット詰め ---
+class BitWriter:
+    def __init__(self):
+        self.acc = 0
+        self.nbits = 0
+
+    def write(self, value, nbits):
+        self.acc = (self.acc << nbits) | (value & ((1 << nbits) - 1))
+        self.nbits += nbits
+
+    def to_bytes(self):
+        pad = -self.nbits % 8
+        return (self.acc << pad).to_bytes((self.nbits + pad) // 8, "big")
+
+
+class BitReader:
+    def __init__(self, data):
+        self.acc = int.from_bytes(data, "big")
+        self.remaining = len(data) * 8
+
+    def read(self, nbits):
+        if nbits > self.remaining:
+            raise ValueError("ペイロードが短すぎます")
+        self.remaining -= nbits
+        return (self.acc >> self.remaining) & ((1 << nbits) - 1)
+
+    def read_signed(self, nbits):
+        v = self.read(nbits)
+        return v - (1 << nbits) if v & (1 << (nbits - 1)) else v
+
+
+# --- フィールド・ストリーム定義 ---
+class Field:
+    """
+    固定小数点のフィールド
+    :param scale: 1 LSB あたりの値（例: 緯度 1e-7 度）
+    :param bits: キーフレームでのビット数
+    :param delta_bits: 差分フレームでの差分ビット数（符号付き）
+    :param signed: 値が負になりうるか
+    :param wrap: 角度など折り返す値の周期（例: 360.0）。差分も折り返しで計算する
+    """
+    def __init__(self, name, scale, bits, delta_bits, signed=True, wrap=None):
+        self.name = name
+        self.scale = scale
+        self.bits = bits
+        self.delta_bits = delta_bits
+        self.signed = signed
+        self.wrap = wrap
+        self.modulus = int(round(wrap / scale)) if wrap else None
+        # 欠測（None）は範囲の端の値で表す（signed なら最小値、unsigned なら最大値）
+        # 折り返す値は 0 も正当な値なので、周期ちょうどのコード（量子化値には現れない）を欠測にする
+        if wrap:
+            if self.modulus >= (1 << bits):
+                raise ValueError(f"フィールド {name} は {bits} ビットに欠測コードが入りません")
+            self.missing = self.modulus
+            self.lo, self.hi = 0, self.modulus - 1
+        elif signed:
+            self.missing = -(1 << (bits - 1))
+            self.lo, self.hi = self.missing + 1, (1 << (bits - 1)) - 1
+        else:
+            self.missing = (1 << bits) - 1
+            self.lo, self.hi = 0, self.missing - 1
+        self.dlim = (1 << (delta_bits - 1)) - 1
+
+    def quantize(self, value):
+        if value is None:
+            return self.missing
+        if self.wrap:
+            return int(round(value / self.scale)) % self.modulus
+        return max(self.lo, min(self.hi, int(round(value / self.scale))))
+
+    def dequantize(self, q):
+        if q == self.missing:
+            return None
+        return q * self.scale
+
+    def delta(self, q, ref):
+        """差分。折り返す値で片方が欠測なら差分は取れない（None）"""
+        if self.wrap and (q == self.missing or ref == self.missing):
+            return 0 if q == ref else None
+        d = q - ref
+        if self.wrap:
+            m = self.modulus
+            d = (d + m // 2) % m - m // 2
+        return d
+
+    def apply_delta(self, ref, d):
+        q = ref + d
+        return q % self.modulus if self.wrap else q
+
+
+class Stream:
+    """1種類のテレメトリ（GPS, IMU など）"""
+    def __init__(self, stream_id, name, fields, priority, rate):
+        self.stream_id = stream_id
+        self.name = name
+        self.fields = fields
+        self.priority = priority  # 小さいほど優先
+        self.rate = rate          # 送りたいレート (Hz)
+
+
+STREAMS = (
+    Stream(1, "gps", (
+        Field("lat", 1e-7, 32, 12),
+        Field("lon", 1e-7, 32, 12),
+        Field("hdop", 0.1, 8, 4, signed=False),
+        Field("sats", 1, 6, 3, signed=False),
+    ), priority=1, rate=1.0),
+    Stream(2, "imu", (
+        Field("yaw", 0.1, 12, 8, signed=False, wrap=360.0),
+        Field("pitch", 0.1, 12, 7),
+        Field("roll", 0.1, 12, 7),
+        Field("mag_cal", 1, 3, 2, signed=False),
+    ), priority=2, rate=5.0),
+    Stream(3, "range", (
+        Field("distance", 0.5, 12, 7, signed=False),
+    ), priority=3, rate=5.0),
+    Stream(4, "motor", (
+        Field("action", 1, 4, 3, signed=False),
+        Field("power", 1, 7, 4, signed=False),
+        Field("left_balance", 0.005, 8, 4, signed=False),
+        Field("right_balance", 0.005, 8, 4, signed=False),
+    ), priority=0, rate=2.0),
+)
+
+
+# --- 送信側 ---
+class TelemetryEncoder:
+    """最新値を受け取り、予算内で送るフレームを作る"""
+    def __init__(self, streams=STREAMS, budget=DEFAULT_BUDGET, keyframe_interval=KEYFRAME_INTERVAL):
+        self.streams = {s.name: s for s in streams}
+        self.budget = budget
+        self.keyframe_interval = keyframe_interval
+        self.tokens = float(budget)
+        self.last_refill = None
+        self._latest = {}
+        self._ref = {}       # 前回送った量子化値
+        self._seq = {}
+        self._count = {}
+        self._next_due = {}  # 次に送る予定の時刻 [s]
+        self.bytes_sent = 0
+        self.frames_sent = 0
+
+    def update(self, name, values):
+        """ストリームの最新値を登録（送信はしない）"""
+        self._latest[name] = values
+
+    def _build(self, name, values, key=False):
+        """フレームを組み立てる（内部状態は変えない）。(フレーム, 量子化値) を返す"""
+        stream = self.streams[name]
+        q = [f.quantize(values.get(f.name)) for f in stream.fields]
+        ref = self._ref.get(name)
+        key = key or ref is None or self._count.get(name, 0) % self.keyframe_interval == 0
+
+        w = BitWriter()
+        for i, f in enumerate(stream.fields):
+            if key:
+                w.write(q[i], f.bits)
+                continue
+            d = f.delta(q[i], ref[i])
+            if d == 0:
+                w.write(TAG_SAME, 2)
+            elif d is not None and -f.dlim <= d <= f.dlim:
+                w.write(TAG_DELTA, 2)
+                w.write(d, f.delta_bits)
+            else:
+                w.write(TAG_FULL, 2)
+                w.write(q[i], f.bits)
+        payload = w.to_bytes()
+        if len(payload) > MAX_PAYLOAD:
+            raise ValueError(f"ストリーム {name} のペイロードが長すぎます")
+
+        header = bytes((SYNC, (stream.stream_id << 3) | (4 if key else 0),
+                        self._seq.get(name, 0), len(payload)))
+        body = header + payload
+        return body + crc16(body[1:]).to_bytes(2, "big"), q
+
+    def _commit(self, name, q):
+        self._ref[name] = q
+        self._seq[name] = (self._seq.get(name, 0) + 1) & 0xFF
+        self._count[name] = self._count.get(name, 0) + 1
+        self.frames_sent += 1
+
+    def encode(self, name, values, key=False):
+        """1フレーム分のバイト列を作る（予算は気にしない）"""
+        frame, q = self._build(name, values, key)
+        self._commit(name, q)
+        return frame
+
+    def poll(self, now):
+        """
+        now [s] の時点で送るべきフレームをまとめて返す（バイト予算を超える分は次回に回す）
+        優先度の高い順、同じ優先度なら待たされている順
+        予定時刻は scheduler.py と同じく前の予定 + 周期で進める（poll の刻みのぶんずれない）
+        最優先のフレームが予算に収まらないときはそこで打ち切り、後ろの小さいフレームに予算を使わせない
+        """
+        if self.last_refill is None:
+            self.last_refill = now
+        self.tokens = min(self.budget, self.tokens + (now - self.last_refill) * self.budget)
+        self.last_refill = now
+
+        due = []
+        for name in self._latest:
+            stream = self.streams[name]
+            next_due = self._next_due.setdefault(name, now)
+            if now >= next_due - 1e-9:      # 周期の足し算の丸め誤差で1回分遅れないように
+                due.append((stream.priority, next_due, name))
+        due.sort()
+
+        out = bytearray()
+        for _, _, name in due:
+            frame, q = self._build(name, self._latest[name])
+            if len(frame) > self.budget:
+                continue        # 予算が満タンでも送れない（待っても無駄なので後ろに譲る）
+            if len(frame) > self.tokens:
+                break           # 予算が貯まるまで、優先度の低いフレームも待たせる
+            self._commit(name, q)
+            self.tokens -= len(frame)
+            period = 1.0 / self.streams[name].rate
+            next_due = self._next_due[name] + period
+            if next_due <= now:
+                # 予算不足で周期以上遅れたら、溜まった分はまとめて送らずに飛ばす
+                next_due += ((now - next_due) // period + 1) * period
+            self._next_due[name] = next_due
+            out += frame
+        self.bytes_sent += len(out)
+        return bytes(out)
+
+
+# --- 受信側 ---
+class TelemetryDecoder:
+    """地上局側。バイト列を流し込むとストリームごとの値を復元する"""
+    def __init__(self, streams=STREAMS):
+        self.streams = {s.stream_id: s for s in streams}
+        self.buffer = bytearray()
+        self._ref = {}
+        self._seq = {}
+        self.latest = {}
+        self.crc_errors = 0
+        self.dropped = 0       # 参照フレーム欠落で捨てた差分フレーム
+        self.frames = 0
+
+    def feed(self, data):
+        """
+        受信バイトを追加し、復元できたフレームを [(ストリーム名, 値の辞書, 連番), ...] で返す
+        """
+        self.buffer += data
+        out = []
+        buf = self.buffer
+        while True:
+            start = buf.find(SYNC)
+            if start < 0:
+                buf.clear()
+                break
+            if start:
+                del buf[:start]
+            if len(buf) < HEADER_SIZE:
+                break
+            total = HEADER_SIZE + buf[3] + CRC_SIZE
+            if len(buf) < total:
+                break
+            frame = bytes(buf[:total])
+            if crc16(frame[1:-2]) != int.from_bytes(frame[-2:], "big"):
+                # SYNC の誤検出か破損: 1バイト進めて探し直す
+                self.crc_errors += 1
+                del buf[:1]
+                continue
+            del buf[:total]
+            result = self._decode(frame)
+            if result is not None:
+                out.append(result)
+        return out
+
+    def _decode(self, frame):
+        stream = self.streams.get(frame[1] >> 3)
+        if stream is None:
+            return None
+        key = bool(frame[1] & 4)
+        seq = frame[2]
+        sid = stream.stream_id
+        ref = self._ref.get(sid)
+        if not key and (ref is None or seq != (self._seq[sid] + 1) & 0xFF):
+            self.dropped += 1
+            self._ref.pop(sid, None)  # 次のキーフレームまで待つ
+            return None
+
+        r = BitReader(frame[HEADER_SIZE:-CRC_SIZE])
+        q = []
+        for i, f in enumerate(stream.fields):
+            if key:
+                v = r.read(f.bits)
+            else:
+                tag = r.read(2)
+                if tag == TAG_SAME:
+                    v = ref[i]
+                elif tag == TAG_DELTA:
+                    v = f.apply_delta(ref[i], r.read_signed(f.delta_bits))
+                else:
+                    v = r.read(f.bits)
+            if f.signed and (key or tag == TAG_FULL) and v & (1 << (f.bits - 1)):
+                v -= 1 << f.bits
+            q.append(v)
+
+        self._ref[sid] = q
+        self._seq[sid] = seq
+        values = {f.name: f.dequantize(v) for f, v in zip(stream.fields, q)}
+        self.latest[stream.name] = values
+        self.frames += 1
+        return stream.name, values, seq
+
+
+# --- ループバック試験 ---
+def _text_size(name, v):
+    """同じ内容を今の日本語の print 形式で送った場合のバイト数"""
+    if name == "gps":
+        text = f"GGA - 緯度:{v['lat']:.6f}, 経度:{v['lon']:.6f}, 測位品質:1, 衛星数:{v['sats']}\n"
+    elif name == "imu":
+        text = f"オイラー角: ({v['yaw']}, {v['roll']}, {v['pitch']})\n"
+    elif name == "range":
+        text = f"{v['distance']}\n"
+    else:
+        text = (f"  アクション: {action_name(v['action'])}\n  モーターパワー: {v['power']}\n"
+                f"  左右バランス: L={v['left_balance']:.3f}, R={v['right_balance']:.3f}\n")
+    return len(text.encode("utf-8"))
+
+
+def loopback(budget=DEFAULT_BUDGET, duration=120.0, step=0.05, seed=0):
+    """
+    pty をループバック回線に見立てて、模擬値を送って受ける
+    IMU は時々方位が取れない（None）ことにして、欠測が 0 度と区別されるかも確かめる
+    :return: 結果の辞書
+    """
+    import math
+    import random
+    import tty
+
+    rng = random.Random(seed)
+    master, slave = os.openpty()
+    tty.setraw(slave)   # 改行変換などをさせない
+    os.set_blocking(slave, False)
+
+    enc = TelemetryEncoder(budget=budget)
+    dec = TelemetryDecoder()
+    sent = {}
+    text_bytes = 0
+    encode_time = 0.0
+    decode_time = 0.0
+    errors = 0
+    t = 0.0
+    while t < duration:
+        yaw = None if int(t) % 15 == 7 else (350 + 3 * t) % 360
+        values = {
+            "gps": {"lat": 35.6 + 1e-6 * t + rng.gauss(0, 2e-6), "lon": 139.7 + 1e-6 * t,
+                    "hdop": 1.2, "sats": 9},
+            "imu": {"yaw": yaw, "pitch": 2 * math.sin(t), "roll": rng.gauss(0, 1),
+                    "mag_cal": 3},
+            "range": {"distance": 150 + 50 * math.sin(t / 5)},
+            "motor": {"action": action_code("前進中"), "power": 80,
+                      "left_balance": 1.0, "right_balance": 0.975},
+        }
+        for name, v in values.items():
+            enc.update(name, v)
+
+        start = time.perf_counter()
+        data = enc.poll(t)
+        encode_time += time.perf_counter() - start
+        if data:
+            os.write(master, data)
+            received = b""
+            while len(received) < len(data):
+                try:
+                    received += os.read(slave, 4096)
+                except BlockingIOError:
+                    time.sleep(0.001)
+            start = time.perf_counter()
+            frames = dec.feed(received)
+            decode_time += time.perf_counter() - start
+            for name, v, _ in frames:
+                text_bytes += _text_size(name, values[name])
+                sent[name] = sent.get(name, 0) + 1
+                for f in enc.streams[name].fields:
+                    got, want = v[f.name], values[name][f.name]
+                    if got is None or want is None:
+                        errors += got is not want
+                    elif abs(got - want) > f.scale:
+                        if not (f.wrap and abs(abs(got - want) - f.wrap) < f.scale):
+                            errors += 1
+        t += step
+
+    os.close(master)
+    os.close(slave)
+    return {"encoder": enc, "decoder": dec, "sent": sent, "text_bytes": text_bytes,
+            "encode_time": encode_time, "decode_time": decode_time, "errors": errors,
+            "duration": duration}
+
+
+def main():
+    ok = True
+    # 予算 600 B/s では全ストリームが希望レートで送れる。60 B/s では優先度の低いものから間引かれる
+    for budget in (DEFAULT_BUDGET, 60):
+        r = loopback(budget)
+        enc, dec = r["encoder"], r["decoder"]
+        wanted = {s.name: int(s.rate * r["duration"]) for s in enc.streams.values()}
+        print(f"--- 予算 {budget} B/s ---")
+        print(f"送信: {enc.frames_sent} フレーム / {enc.bytes_sent} バイト "
+              f"（{enc.bytes_sent / r['duration']:.0f} B/s）")
+        print(f"復元: {dec.frames} フレーム, CRC エラー {dec.crc_errors}, 欠落 {dec.dropped}, "
+              f"値の不一致 {r['errors']}（方位の欠測を含む）")
+        print("ストリーム別フレーム数（送った / 希望）:",
+              ", ".join(f"{n} {r['sent'].get(n, 0)}/{wanted[n]}"
+                        for n in sorted(wanted, key=lambda n: enc.streams[n].priority)))
+        print(f"圧縮率: 日本語テキスト {r['text_bytes']} バイト → {enc.bytes_sent} バイト "
+              f"（{r['text_bytes'] / max(1, enc.bytes_sent):.1f} 倍）")
+        print(f"処理時間: 符号化 {r['encode_time'] / max(1, enc.frames_sent) * 1e6:.0f} us/フレーム, "
+              f"復号 {r['decode_time'] / max(1, dec.frames) * 1e6:.0f} us/フレーム")
+        ok &= r["errors"] == 0 and dec.frames == enc.frames_sent
+        ok &= enc.bytes_sent <= budget * (r["duration"] + 1)
+        # 送れた割合は優先度の順に並ぶ（予算が足りれば全ストリームが希望どおり）
+        order = sorted(wanted, key=lambda n: enc.streams[n].priority)
+        ratios = [min(1.0, r["sent"].get(n, 0) / wanted[n]) for n in order]   # t=0 の1回ぶん希望を超える
+        by_priority = all(a >= b for a, b in zip(ratios, ratios[1:]))
+        if budget == DEFAULT_BUDGET:
+            by_priority &= min(ratios) >= 0.99
+        print(f"優先度どおり: {'OK' if by_priority else 'NG'}")
+        ok &= by_priority
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
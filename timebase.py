@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+センサー時刻の統一と再サンプリング
+ - すべてのサンプルを1つの単調時計（time.monotonic_ns）で打刻する
+ - GPS の UTC と単調時計の対応を、オフセット＋ドリフトの一次式で推定（スライディング窓の最小二乗）
+   日付の無い GGA の時刻は推定中の UTC に最も近い日に合わせるので、UTC 0 時をまたいでも巻き戻らない
+ - ソート済み配列に対する as-of 結合・線形補間・共通時間軸への再サンプリング（すべてベクトル化）
+ - python3 timebase.py で合成ストリームの結合例を表示
+依存: numpy（打刻の now() 以外）
+"""
+
+import collections
+import datetime
+import sys
+import time
+
+# numpy は補間・推定の関数の中で import する（now() で打刻するだけのセンサーの起動では読まない）
+
+# ===== 設定 =====
+CLOCK_WINDOW = 120          # GPS 時刻対応の推定に使う直近の組数
+CLOCK_OUTLIER_SEC = 0.5     # 推定からこれ以上ずれる組は外れ値として捨てる
+INITIAL_CAPACITY = 1024     # SampleLog の初期確保サイズ
+# ==================
+
+
+def now():
+    """共通の単調時計（秒）。全センサーのサンプルはこれで打刻する"""
+    return time.monotonic_ns() * 1e-9
+
+
+def gps_utc_seconds(datestamp, timestamp, reference=None):
+    """
+    NMEA の日付（RMC の datestamp）と時刻（GGA / RMC の timestamp）から UNIX 秒を作る
+    datestamp が無い（GGA のみ）の場合は、reference（おおよその UNIX 秒）に最も近い日の時刻にする
+    reference も無ければ当日 0 時からの秒数を返す
+    """
+    if datestamp is None:
+        sod = (timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second
+               + timestamp.microsecond * 1e-6)
+        if reference is None:
+            return sod
+        return round((reference - sod) / 86400.0) * 86400.0 + sod
+    dt = datetime.datetime.combine(datestamp, timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+class GpsClockMapping:
+    """
+    単調時計 t と GPS UTC u の対応 u = offset + rate * t を推定する
+    rate - 1 がラズパイ水晶のドリフト（ppm オーダー）
+    """
+    def __init__(self, window=CLOCK_WINDOW, outlier=CLOCK_OUTLIER_SEC):
+        self.pairs = collections.deque(maxlen=window)
+        self.outlier = outlier
+        self.offset = None
+        self.rate = 1.0
+        self.rejected = 0
+        self.dated = False         # 日付付き（RMC）の時刻で推定しているか
+        self._consecutive_rejects = 0
+
+    def add(self, mono, utc):
+        """(受信時の単調時計, GPS UTC) の組を追加して推定を更新する"""
+        if self.offset is not None and abs(self.mono_to_utc(mono) - utc) > self.outlier:
+            self.rejected += 1
+            self._consecutive_rejects += 1
+            # 大きくずれ続けるなら（GPS 時刻の飛びなど）推定をやり直す
+            if self._consecutive_rejects <= self.pairs.maxlen // 4:
+                return False
+            self.pairs.clear()
+            self.offset = None
+        self._consecutive_rejects = 0
+        self.pairs.append((mono, utc))
+        self._fit()
+        return True
+
+    def add_nmea(self, mono, timestamp, datestamp=None):
+        """
+        NMEA の時刻で組を追加する（GGA は datestamp=None、RMC は日付付き）
+        日付の無い時刻は推定中の UTC に最も近い日に合わせる（0 時の繰り上がり対策）
+        """
+        if datestamp is not None and not self.dated:
+            # それまで当日 0 時起点の秒で推定していたなら、日付付きでやり直す
+            self.pairs.clear()
+            self.offset = None
+            self.dated = True
+        reference = None if self.offset is None else float(self.mono_to_utc(mono))
+        return self.add(mono, gps_utc_seconds(datestamp, timestamp, reference))
+
+    def _fit(self):
+        import numpy as np
+        p = np.array(self.pairs)
+        t = p[:, 0]
+        u = p[:, 1]
+        if len(p) < 2 or np.ptp(t) < 1.0:
+            self.rate = 1.0
+            self.offset = float(np.mean(u - t))
+            return
+        t0 = t.mean()
+        u0 = u.mean()
+        dt = t - t0
+        self.rate = float(dt @ (u - u0) / (dt @ dt))
+        self.offset = float(u0 - self.rate * t0)
+
+    def mono_to_utc(self, mono):
+        import numpy as np
+        if self.offset is None:
+            raise RuntimeError("GPS 時刻がまだ得られていません")
+        return self.offset + self.rate * np.asarray(mono)
+
+    def utc_to_mono(self, utc):
+        import numpy as np
+        if self.offset is None:
+            raise RuntimeError("GPS 時刻がまだ得られていません")
+        return (np.asarray(utc) - self.offset) / self.rate
+
+    def drift_ppm(self):
+        return (self.rate - 1.0) * 1e6
+
+
+class SampleLog:
+    """
+    打刻済みサンプルを時刻順に貯める（足りなくなったら倍に拡張）
+    arrays() はコピーせずにビューを返す
+    """
+    def __init__(self, width, capacity=INITIAL_CAPACITY):
+        import numpy as np
+        self.width = width
+        self._t = np.empty(capacity)
+        self._v = np.empty((capacity, width))
+        self.n = 0
+
+    def append(self, values, t=None):
+        import numpy as np
+        if t is None:
+            t = now()
+        if self.n and t < self._t[self.n - 1]:
+            raise ValueError("時刻が逆行しています")
+        if self.n == self._t.shape[0]:
+            self._t = np.concatenate([self._t, np.empty_like(self._t)])
+            self._v = np.concatenate([self._v, np.empty_like(self._v)])
+        self._t[self.n] = t
+        self._v[self.n] = values
+        self.n += 1
+
+    def arrays(self):
+        return self._t[:self.n], self._v[:self.n]
+
+    def __len__(self):
+        return self.n
+
+
+# --- 結合・補間 ---
+def asof_join(t_left, t_right, v_right, tolerance=None):
+    """
+    t_left の各時刻について、それ以前で最も新しい右側サンプルを取る（as-of 結合）
+    該当なし・tolerance 超過の行は NaN
+    """
+    import numpy as np
+    t_left = np.asarray(t_left, dtype=float)
+    v_right = np.asarray(v_right, dtype=float)
+    idx = np.searchsorted(t_right, t_left, side="right") - 1
+    valid = idx >= 0
+    safe = np.where(valid, idx, 0)
+    if tolerance is not None:
+        valid &= (t_left - np.asarray(t_right)[safe]) <= tolerance
+    out = v_right[safe].copy()
+    out[~valid] = np.nan
+    return out
+
+
+def interpolate(t_src, v_src, t_dst, angular=False):
+    """
+    ソート済みの (t_src, v_src) を t_dst に線形補間する（v_src は 1 次元または (N, k)）
+    範囲外は NaN。angular=True なら度単位の角度として 360 度の折り返しを考慮する
+    """
+    import numpy as np
+    t_src = np.asarray(t_src, dtype=float)
+    t_dst = np.asarray(t_dst, dtype=float)
+    v = np.asarray(v_src, dtype=float)
+    if angular:
+        v = np.degrees(np.unwrap(np.radians(v), axis=0))
+    squeeze = v.ndim == 1
+    if squeeze:
+        v = v[:, None]
+
+    i = np.clip(np.searchsorted(t_src, t_dst, side="right"), 1, t_src.size - 1)
+    t0 = t_src[i - 1]
+    t1 = t_src[i]
+    span = t1 - t0
+    w = np.divide(t_dst - t0, span, out=np.zeros_like(t_dst), where=span > 0)
+    out = v[i - 1] + (v[i] - v[i - 1]) * w[:, None]
+    out[(t_dst < t_src[0]) | (t_dst > t_src[-1])] = np.nan
+    if angular:
+        out %= 360.0
+    return out[:, 0] if squeeze else out
+
+
+def resample(streams, rate, start=None, end=None, method="interp", tolerance=None):
+    """
+    複数ストリームを共通の時間軸にそろえる
+    :param streams: {名前: (t, v, 種類)} 種類は "linear" / "angle" / "asof"
+                    （種類を省略した (t, v) は method に従う）
+    :param rate: 出力レート (Hz)
+    :return: (grid, {名前: 値の配列})
+    """
+    import numpy as np
+    starts = [s[0][0] for s in streams.values() if len(s[0])]
+    ends = [s[0][-1] for s in streams.values() if len(s[0])]
+    if not starts:
+        return np.empty(0), {name: np.empty(0) for name in streams}
+    start = max(starts) if start is None else start
+    end = min(ends) if end is None else end
+    grid = np.arange(start, end + 0.5 / rate, 1.0 / rate)
+
+    merged = {}
+    for name, stream in streams.items():
+        t, v = stream[0], stream[1]
+        kind = stream[2] if len(stream) > 2 else ("asof" if method == "asof" else "linear")
+        if len(t) == 0:
+            merged[name] = np.full(grid.shape, np.nan)
+        elif kind == "asof" or len(t) < 2:
+            merged[name] = asof_join(grid, t, v, tolerance)
+        else:
+            merged[name] = interpolate(t, v, grid, angular=(kind == "angle"))
+    return grid, merged
+
+
+def main():
+    import numpy as np
+    rng = np.random.default_rng(0)
+    # 100Hz の IMU、1Hz の GPS、約10Hz で揺らぐ距離センサー
+    t_imu = np.arange(0, 10, 0.01) + rng.normal(0, 0.0005, 1000)
+    t_imu.sort()
+    yaw = (350 + 5 * t_imu) % 360
+    t_gps = np.arange(0.3, 10, 1.0)
+    gps = np.column_stack([35.0 + t_gps * 1e-5, 139.0 + t_gps * 1e-5])
+    t_rng = np.cumsum(rng.uniform(0.08, 0.12, 100))
+    dist = 100 - 3 * t_rng
+
+    grid, merged = resample({
+        "yaw": (t_imu, yaw, "angle"),
+        "gps": (t_gps, gps, "asof"),
+        "range": (t_rng, dist),
+    }, rate=20)
+    for k in range(0, len(grid), 40):
+        lat, lon = merged["gps"][k]
+        print(f"t={grid[k]:6.2f} yaw={merged['yaw'][k]:6.1f} "
+              f"gps=({lat:.5f},{lon:.5f}) range={merged['range'][k]:6.1f}")
+
+    mapping = GpsClockMapping()
+    for t in np.arange(0, CLOCK_WINDOW, 1.0):
+        mapping.add(t + 100.0, 1.7e9 + t * (1 + 20e-6) + rng.normal(0, 0.001))
+    print(f"推定ドリフト: {mapping.drift_ppm():.1f} ppm（真値 20.0 ppm）")
+
+    # 日付の無い GGA だけで UTC 0 時をまたぐ
+    mapping = GpsClockMapping()
+    day = datetime.datetime(2025, 6, 7, 23, 59, 0, tzinfo=datetime.timezone.utc)
+    for k in range(120):
+        utc = day + datetime.timedelta(seconds=k)
+        mapping.add_nmea(500.0 + k, utc.timetz())
+    span = float(mapping.mono_to_utc(619.0) - mapping.mono_to_utc(500.0))
+    print(f"0 時をまたいだ 119 秒の GGA: 推定 {span:.1f} 秒、外れ値 {mapping.rejected} 件")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
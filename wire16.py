@@ -1,34 +1,46 @@
 import time
 import pigpio
 
-# pigpio初期化
-pi = pigpio.pi()
-
 # 使用するGPIO番号 (例: 17番)
 CAREER_CUT = 16  
 
-# 出力ピンを設定
-pi.set_mode(CAREER_CUT, pigpio.OUTPUT)
+# init() を呼ぶまで pigpio には接続しない（import しただけでは点火ピンに触らない）
+pi = None
 
-def career_cat(t=3):
-    career_time = t
-    
-    # 1回目点火
-    print("点火")
-    pi.write(CAREER_CUT, 1)
-    time.sleep(career_time)
-    pi.write(CAREER_CUT, 0)
-    time.sleep(1)
+def init():
+    global pi
+    # pigpio初期化
+    pi = pigpio.pi()
 
-    # 2回目点火
-    print("点火")
-    pi.write(CAREER_CUT, 1)
-    time.sleep(career_time)
+    # 出力ピンを設定
+    pi.set_mode(CAREER_CUT, pigpio.OUTPUT)
     pi.write(CAREER_CUT, 0)
-    time.sleep(1)
+    return pi
+
+# 通電の手順 [(出力, 秒), ...]。点火 t 秒・休み 1 秒を2回
+def cut_steps(t=3):
+    return [(1, t), (0, 1), (1, t), (0, 1)]
+
+# 出力を切り替えるだけで待たない（スケジューラのタスクから手順を進めるとき用）
+def set_cut(level):
+    if level:
+        print("点火")
+    pi.write(CAREER_CUT, level)
+
+def career_cat(t=3):
+    for level, seconds in cut_steps(t):
+        set_cut(level)
+        time.sleep(seconds)
 
-# 実行例
-career_cat(3)
+def main():
+    init()
+    try:
+        # 実行例
+        career_cat(3)
+    finally:
+        # 終了時はリソース解放
+        pi.write(CAREER_CUT, 0)
+        pi.stop()
 
-# 終了時はリソース解放
-pi.stop()
\ No newline at end of file
+if __name__ == "__main__":
+    main()